@@ -0,0 +1,56 @@
+#!/usr/bin/python3
+"""
+Rewrite the runlumi and parents of the files in the FILEMETADATA table which are still in
+the legacy python literal format in the JSON one (see ServerUtilities.encodeRunLumi), a batch
+at a time, until none is left. The REST reads both formats, this only saves the decoding of
+the legacy one. Needs an operator certificate (or the service one). It can be run any number
+of times, e.g. from a cron job until it reports 0 files. Files which can not be rewritten
+are reported as skipped and left as they are.
+usage:  python3 MigrateFileMetadata.py --instance prod --batch 1000
+"""
+
+import sys
+import time
+import argparse
+
+from RESTInteractions import CRABRest
+from ServerUtilities import encodeRequest
+
+
+def main():
+    """ call filemetadata migrate until there is nothing left to migrate """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', default='cmsweb.cern.ch')
+    parser.add_argument('--instance', default='prod')
+    parser.add_argument('--cert', default='/data/certs/servicecert.pem')
+    parser.add_argument('--key', default='/data/certs/servicekey.pem')
+    parser.add_argument('--batch', type=int, default=1000, help="files rewritten by each call (at most 10000)")
+    parser.add_argument('--max-batches', type=int, default=0, help="stop after this many calls (0: no limit)")
+    parser.add_argument('--sleep', type=float, default=1, help="seconds between calls, to go easy on the DB")
+    args = parser.parse_args()
+
+    crabserver = CRABRest(hostname=args.host, localcert=args.cert, localkey=args.key, userAgent='MigrateFileMetadata')
+    crabserver.setDbInstance(args.instance)
+
+    total = 0
+    totalSkipped = 0
+    batches = 0
+    request = {'subresource': 'migrate', 'howmany': args.batch}
+    while True:
+        result = crabserver.post(api='filemetadata', data=encodeRequest(request))[0]['result'][0]
+        total += result['migrated']
+        totalSkipped += result['skipped']
+        batches += 1
+        print("%s migrated %d files, skipped %d (total %d migrated, %d skipped)" %
+              (time.strftime('%Y-%m-%d %H:%M:%S'), result['migrated'], result['skipped'], total, totalSkipped))
+        # files which could not be migrated are still there: carry on after them
+        if not result['migrated'] and not result['skipped'] or batches == args.max_batches:
+            break
+        request['aftertask'] = result['aftertask']
+        request['afterlfn'] = result['afterlfn']
+        time.sleep(args.sleep)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -65,8 +65,7 @@ PJargs=`cat RunJobs*.*dag | grep "POST Job${jobId} " | awk 'BEGIN { FS="MAX_RETR
 # find the condor clusterId for the job
 jobClusterId=`grep '^ClusterId' finished_jobs/job.${jobId}.${jobRetry} | awk '{print $NF}'`
 # reset PJ count
-echo '{"pre": 1, "post": 0}' > retry_info/job.${jobId}.txt
-rm defer_info/defer_num.${jobId}.0.txt
+PYTHONPATH=$PWD/CRAB3.zip:$PYTHONPATH python3 -m TaskWorker.JobStateStore reset-postjob ${jobId} --dag-retry ${jobRetry}
 
 # these two are mandatory
 export _CONDOR_JOB_AD=finished_jobs/job.${jobId}.0
@@ -89,6 +88,5 @@ echo "sh dag_bootstrap.sh POSTJOB ${jobClusterId} ${jobReturnCode} ${retryCount}
 
 echo ""
 echo "if you want to run again, execute these lines:"
-echo "echo '{"pre": 1, "post": 0}' > retry_info/job.${jobId}.txt"
-echo "rm defer_info/defer_num.${jobId}.0.txt"
+echo "PYTHONPATH=\$PWD/CRAB3.zip:\$PYTHONPATH python3 -m TaskWorker.JobStateStore reset-postjob ${jobId} --dag-retry ${jobRetry}"
 echo "sh dag_bootstrap.sh POSTJOB ${jobClusterId} ${jobReturnCode} ${retryCount} ${maxRetries} $PJargs"
@@ -125,5 +125,9 @@ if [ "X$_CONDOR_JOB_AD" != "X" ]; then
   cat $_CONDOR_JOB_AD
 fi
 echo "Now running the job in `pwd`..."
+if [ -e USE_TASKMANAGER_SERVER ]; then
+    # same as below, but through the long lived TaskManagerServer of this task
+    exec nice -n 19 python3 -m TaskWorker.TaskManagerClient "$@"
+fi
 exec nice -n 19 python3 -m TaskWorker.TaskManagerBootstrap "$@"
 } 2>&1 | tee dag_bootstrap.out
@@ -39,10 +39,8 @@ if [ "X$source_script" != "X" ] && [ -e $source_script ]; then
     source $source_script
 fi
 
-mkdir -p retry_info
+# retry, deferral and transfer bookkeeping of the jobs is in job_state.db, see TaskWorker/JobStateStore.py
 mkdir -p resubmit_info
-mkdir -p defer_info
-mkdir -p transfer_info
 
 
 #This is the only file transfered from the TW to the schedd. Can be downloaded for the "preparelocal" client command
@@ -179,6 +177,15 @@ then
     touch USE_FTS_REUSE
 fi
 
+# Decide if PRE and POST scripts of this task run through a long lived TaskManagerServer
+# instead of starting python and importing everything each time. Same as above, the decision
+# stays for the task lifetime
+if [ -f /etc/enable_taskmanager_server ] ;
+then
+    echo "Found file /etc/enable_taskmanager_server. Set this task to use a TaskManagerServer"
+    touch USE_TASKMANAGER_SERVER
+fi
+
 export _CONDOR_DAGMAN_LOG=$PWD/$1.dagman.out
 export _CONDOR_DAGMAN_GENERATE_SUBDAG_SUBMITS=False
 export _CONDOR_MAX_DAGMAN_LOG=0
@@ -8,35 +8,48 @@ import re
 import time
 import logging
 import os
-import ast
-import glob
 import copy
+import glob
 from shutil import move
 import pickle
 import json
+import sqlite3
+import argparse
+import fcntl
 import htcondor
 import classad
 
-logging.basicConfig(filename='task_process/cache_status.log', level=logging.DEBUG)
-
-NODE_DEFAULTS = {
-    'Retries': 0,
-    'Restarts': 0,
-    'SiteHistory': [],
-    'ResidentSetSize': [],
-    'SubmitTimes': [],
-    'StartTimes': [],
-    'EndTimes': [],
-    'TotalUserCpuTimeHistory': [],
-    'TotalSysCpuTimeHistory': [],
-    'WallDurations': [],
-    'JobIds': []
-}
+def newNodeInfo():
+    """
+    a new record for a node with default values, built from literals since
+    this is called once per node and copy.deepcopy of a template is slow
+    """
+    return {
+        'Retries': 0,
+        'Restarts': 0,
+        'SiteHistory': [],
+        'ResidentSetSize': [],
+        'SubmitTimes': [],
+        'StartTimes': [],
+        'EndTimes': [],
+        'TotalUserCpuTimeHistory': [],
+        'TotalSysCpuTimeHistory': [],
+        'WallDurations': [],
+        'JobIds': []
+    }
 
 STATUS_CACHE_FILE = "task_process/status_cache.txt"
 PKL_STATUS_CACHE_FILE = "task_process/status_cache.pkl"
 LOG_PARSING_POINTERS_DIR = "task_process/jel_pickles/"
 FJR_PARSE_RES_FILE = "task_process/fjr_parse_results.txt"
+DB_STATUS_CACHE_FILE = "task_process/status_cache.db"
+# how many jel-<timestamp>.pkl checkpoints to keep in LOG_PARSING_POINTERS_DIR
+JEL_CHECKPOINTS_TO_KEEP = 3
+# serializes updates of the same task by this script and by cache_status_daemon.py
+LOCK_FILE = "task_process/cache_status.lock"
+# status_cache.pkl (and .txt) hold all the nodes, they are rewritten at most this often (seconds)
+# unless the DAG status changes
+PKL_REFRESH_INTERVAL = 900
 
 #
 # insertCpu, parseJobLog, parsNodeStateV2 and parseErrorReport
@@ -68,30 +81,61 @@ def insertCpu(event, info):
             info['TotalUserCpuTimeHistory'][-1] = float(event['RemoteUserCpu'])
 
 
+# many events share the same EventTime, so parse each value only once
+eventTimeCache = {}
+
+def parseEventTime(eventTime):
+    """
+    convert a job log EventTime (local time "%Y-%m-%dT%H:%M:%S") to seconds from Epoch,
+    same result as time.mktime(time.strptime(eventTime, "%Y-%m-%dT%H:%M:%S"))
+    :param eventTime: the EventTime string
+    :return: a float
+    """
+    try:
+        return eventTimeCache[eventTime]
+    except KeyError:
+        pass
+    if len(eventTimeCache) > 100000:
+        eventTimeCache.clear()
+    try:
+        value = time.mktime((int(eventTime[0:4]), int(eventTime[5:7]), int(eventTime[8:10]),
+                             int(eventTime[11:13]), int(eventTime[14:16]), int(eventTime[17:19]), 0, 0, -1))
+    except ValueError:
+        value = time.mktime(time.strptime(eventTime, "%Y-%m-%dT%H:%M:%S"))
+    eventTimeCache[eventTime] = value
+    return value
+
+
 nodeNameRe = re.compile("DAG Node: Job(\d+(?:-\d+)?)")
 nodeName2Re = re.compile("Job(\d+(?:-\d+)?)")
 
 # this now takes as input an htcondor.JobEventLog object
 # which as of HTCondor 8.9 can be saved/restored with memory of
 # where it had reached in processing the job log file
-def parseJobLog(jel, nodes, nodeMap):
+def parseJobLog(jel, nodes, nodeMap, touched=None):
     """
     parses new events in condor job log file and updates nodeMap
     :param jel: a condor JobEventLog object which provides an iterator over events
     :param nodes: the structure where we collect one job info for cache_status file
     :param nodeMap: the structure where collect summary of all events
+    :param touched: if not None, a set where to add the names of the nodes which were modified
     :return: nothing
     """
     count = 0
+    node = None
     for event in jel.events(0):
         count += 1
-        eventtime = time.mktime(time.strptime(event['EventTime'], "%Y-%m-%dT%H:%M:%S"))
-        if event['MyType'] == 'SubmitEvent':
+        eventtime = parseEventTime(event['EventTime'])
+        # looking up a JobEvent attribute is not cheap, do it once
+        eventType = event['MyType']
+        if eventType == 'SubmitEvent':
             m = nodeNameRe.match(event['LogNotes'])
             if m:
                 node = m.groups()[0]
                 proc = event['Cluster'], event['Proc']
-                info = nodes.setdefault(node, copy.deepcopy(NODE_DEFAULTS))
+                info = nodes.get(node)
+                if info is None:
+                    info = nodes[node] = newNodeInfo()
                 info['State'] = 'idle'
                 info['JobIds'].append("%d.%d" % proc)
                 info['RecordedSite'] = False
@@ -102,12 +146,12 @@ def parseJobLog(jel, nodes, nodeMap):
                 info['ResidentSetSize'].append(0)
                 info['Retries'] = len(info['SubmitTimes'])-1
                 nodeMap[proc] = node
-        elif event['MyType'] == 'ExecuteEvent':
+        elif eventType == 'ExecuteEvent':
             node = nodeMap[event['Cluster'], event['Proc']]
             nodes[node]['StartTimes'].append(eventtime)
             nodes[node]['State'] = 'running'
             nodes[node]['RecordedSite'] = False
-        elif event['MyType'] == 'JobTerminatedEvent':
+        elif eventType == 'JobTerminatedEvent':
             node = nodeMap[event['Cluster'], event['Proc']]
             nodes[node]['EndTimes'].append(eventtime)
             # at times HTCondor does not log the ExecuteEvent and there's no StartTime
@@ -123,7 +167,7 @@ def parseJobLog(jel, nodes, nodeMap):
                     nodes[node]['State'] = 'cooloff'
             else:
                 nodes[node]['State'] = 'cooloff'
-        elif event['MyType'] == 'PostScriptTerminatedEvent':
+        elif eventType == 'PostScriptTerminatedEvent':
             m = nodeName2Re.match(event['DAGNodeName'])
             if m:
                 node = m.groups()[0]
@@ -136,7 +180,7 @@ def parseJobLog(jel, nodes, nodeMap):
                         nodes[node]['State'] = 'cooloff'
                 else:
                     nodes[node]['State'] = 'cooloff'
-        elif event['MyType'] == 'ShadowExceptionEvent' or event["MyType"] == "JobReconnectFailedEvent" or event['MyType'] == 'JobEvictedEvent':
+        elif eventType == 'ShadowExceptionEvent' or eventType == "JobReconnectFailedEvent" or eventType == 'JobEvictedEvent':
             node = nodeMap[event['Cluster'], event['Proc']]
             if nodes[node]['State'] != 'idle':
                 nodes[node]['EndTimes'].append(eventtime)
@@ -151,7 +195,7 @@ def parseJobLog(jel, nodes, nodeMap):
                 nodes[node]['SubmitTimes'].append(-1)
                 nodes[node]['JobIds'].append(nodes[node]['JobIds'][-1])
                 nodes[node]['Restarts'] += 1
-        elif event['MyType'] == 'JobAbortedEvent':
+        elif eventType == 'JobAbortedEvent':
             node = nodeMap[event['Cluster'], event['Proc']]
             if nodes[node]['State'] == "idle" or nodes[node]['State'] == "held":
                 nodes[node]['StartTimes'].append(-1)
@@ -159,7 +203,7 @@ def parseJobLog(jel, nodes, nodeMap):
                     nodes[node]['SiteHistory'].append("Unknown")
             nodes[node]['State'] = 'killed'
             insertCpu(event, nodes[node])
-        elif event['MyType'] == 'JobHeldEvent':
+        elif eventType == 'JobHeldEvent':
             node = nodeMap[event['Cluster'], event['Proc']]
             if nodes[node]['State'] == 'running':
                 nodes[node]['EndTimes'].append(eventtime)
@@ -174,28 +218,31 @@ def parseJobLog(jel, nodes, nodeMap):
                 nodes[node]['JobIds'].append(nodes[node]['JobIds'][-1])
                 nodes[node]['Restarts'] += 1
             nodes[node]['State'] = 'held'
-        elif event['MyType'] == 'JobReleaseEvent':
+        elif eventType == 'JobReleaseEvent':
             node = nodeMap[event['Cluster'], event['Proc']]
             nodes[node]['State'] = 'idle'
-        elif event['MyType'] == 'JobAdInformationEvent':
+        elif eventType == 'JobAdInformationEvent':
             node = nodeMap[event['Cluster'], event['Proc']]
             if (not nodes[node]['RecordedSite']) and ('JOBGLIDEIN_CMSSite' in event) and not event['JOBGLIDEIN_CMSSite'].startswith("$$"):
                 nodes[node]['SiteHistory'].append(event['JOBGLIDEIN_CMSSite'])
                 nodes[node]['RecordedSite'] = True
             insertCpu(event, nodes[node])
-        elif event['MyType'] == 'JobImageSizeEvent':
+        elif eventType == 'JobImageSizeEvent':
             node = nodeMap[event['Cluster'], event['Proc']]
             nodes[node]['ResidentSetSize'][-1] = int(event['ResidentSetSize'])
             if nodes[node]['StartTimes']:
                 nodes[node]['WallDurations'][-1] = eventtime - nodes[node]['StartTimes'][-1]
             insertCpu(event, nodes[node])
-        elif event["MyType"] == "JobDisconnectedEvent" \
-             or event["MyType"] == "JobReconnectedEvent" \
-             or event["MyType"] == "FileTransferEvent" :
+        elif eventType == "JobDisconnectedEvent" \
+             or eventType == "JobReconnectedEvent" \
+             or eventType == "FileTransferEvent" :
             # These events don't really affect the node status
-            pass
+            continue
         else:
-            logging.warning("Unknown event type: %s", event['MyType'])
+            logging.warning("Unknown event type: %s", eventType)
+            continue
+        if touched is not None and node is not None:
+            touched.add(node)
 
     logging.debug("There were %d events in the job log.", count)
     now = time.time()
@@ -206,6 +253,8 @@ def parseJobLog(jel, nodes, nodeMap):
         lastStart = now
         if info['StartTimes']:
             lastStart = info['StartTimes'][-1]
+        if touched is not None and len(info['WallDurations']) != len(info['SiteHistory']):
+            touched.add(node)
         while len(info['WallDurations']) < len(info['SiteHistory']):
             if lastStart > 0:
                 info['WallDurations'].append(now - lastStart)
@@ -214,7 +263,7 @@ def parseJobLog(jel, nodes, nodeMap):
         while len(info['WallDurations']) > len(info['SiteHistory']):
             info['SiteHistory'].append("Unknown")
 
-def parseErrorReport(data, nodes):
+def parseErrorReport(data, nodes, touched=None):
     """
     iterate over the jobs and set the error dict for those which are failed
     :param data: a dictionary as returned by summarizeFjrParseResults() : {jobid:errdict}
@@ -222,20 +271,61 @@ def parseErrorReport(data, nodes):
                  which writes one line for PostJoun run: {job_id : {crab_retry : error_summary}}
                  where crab_retry is a string and error_summary a list [exitcode, errorMsg, {}]
     :param nodes: a dictionary with format {jobid:statedict}
+    :param touched: if not None, a set where to add the jobids of the nodes which were modified
     :return: nothing, modifies nodes in place
     """
-    for jobid, statedict in nodes.items():
-        if 'State' in statedict and statedict['State'] == 'failed' and jobid in data:
+    for jobid in data:
+        statedict = nodes.get(jobid)
+        if statedict and 'State' in statedict and statedict['State'] == 'failed':
             # pick error info from last retry (SB: AFAICT only last retry is listed anyhow)
             for key in data[jobid]:
                 statedict['Error'] = data[jobid][key]
+            if touched is not None:
+                touched.add(jobid)
 
-def parseNodeStateV2(fp, nodes, level):
+def nextNodeState(state, status, retry, msg):
+    """
+    the State of a node after a NodeStatus ad of the node_state file
+    :param state: the State of the node before, None if it has none yet
+    :param status, retry, msg: NodeStatus, RetryCount and StatusDetails from the ad
+    :return: the new State, None if it still has none
+    """
+    if status == 1: # STATUS_READY
+        if state == "transferring":
+            return "cooloff"
+        if state != "cooloff":
+            return 'unsubmitted'
+    elif status == 2: # STATUS_PRERUN
+        if retry == 0:
+            return 'unsubmitted'
+        return 'cooloff'
+    elif status == 3: # STATUS_SUBMITTED
+        if state is None:
+            return 'running' if msg == 'not_idle' else 'idle'
+    elif status == 4: # STATUS_POSTRUN
+        if state != "cooloff":
+            return 'transferring'
+    elif status == 5: # STATUS_DONE
+        return 'finished'
+    elif status == 6: # STATUS_ERROR
+        # Older versions of HTCondor would put jobs into STATUS_ERROR
+        # for a short time if the job was to be retried.  Hence, we had
+        # some status parsing logic to try and guess whether the job would
+        # be tried again in the near future.  This behavior is no longer
+        # observed; STATUS_ERROR is terminal.
+        return 'failed'
+    return state
+
+def parseNodeStateV2(fp, nodes, level, touched):
     """
     HTCondor 8.1.6 updated the node state file to be classad-based.
     This is a more flexible format that allows future extensions but, unfortunately,
     also requires a separate parser.
+    The node state file lists all nodes: the record of a node is only read (see
+    LazyNodes.peekState) and modified when its state changes. The names of the nodes
+    which were modified are added to touched.
     """
+    oldDagStatus = copy.deepcopy(nodes.get("DagStatus"))
     dagStatus = nodes.setdefault("DagStatus", {})
     dagStatus.setdefault("SubDagStatus", {})
     subDagStatus = dagStatus.setdefault("SubDags", {})
@@ -269,117 +359,21 @@ def parseNodeStateV2(fp, nodes, level):
         status = ad.get('NodeStatus', -1)
         retry = ad.get('RetryCount', -1)
         msg = ad.get("StatusDetails", "")
-        info = nodes.setdefault(nodeid, copy.deepcopy(NODE_DEFAULTS))
-        if status == 1: # STATUS_READY
-            if info.get("State") == "transferring":
-                info["State"] = "cooloff"
-            elif info.get('State') != "cooloff":
-                info['State'] = 'unsubmitted'
-        elif status == 2: # STATUS_PRERUN
-            if retry == 0:
-                info['State'] = 'unsubmitted'
-            else:
-                info['State'] = 'cooloff'
-        elif status == 3: # STATUS_SUBMITTED
-            if msg == 'not_idle':
-                info.setdefault('State', 'running')
-            else:
-                info.setdefault('State', 'idle')
-        elif status == 4: # STATUS_POSTRUN
-            if info.get("State") != "cooloff":
-                info['State'] = 'transferring'
-        elif status == 5: # STATUS_DONE
-            info['State'] = 'finished'
-        elif status == 6: # STATUS_ERROR
-            # Older versions of HTCondor would put jobs into STATUS_ERROR
-            # for a short time if the job was to be retried.  Hence, we had
-            # some status parsing logic to try and guess whether the job would
-            # be tried again in the near future.  This behavior is no longer
-            # observed; STATUS_ERROR is terminal.
-            info['State'] = 'failed'
-
-def storeNodesInfoInFile():
-    """
-    Open cache file and get the location until which the jobs_log was parsed last time
-    returns: a dictionary with keys: jobLogCheckpoint, fjrParseResCheckpoint, nodes, nodeMap
-    """
-    jobLogCheckpoint = None
-    if os.path.exists(STATUS_CACHE_FILE) and os.stat(STATUS_CACHE_FILE).st_size > 0:
-        logging.debug("cache file found, opening")
-        try:
-            nodesStorage = open(STATUS_CACHE_FILE, "r")
-            jobLogCheckpoint = nodesStorage.readline().strip()
-            if jobLogCheckpoint.startswith('#') :
-                logging.debug("cache file contains initial comments, skipping")
-                # comment line indicates a place-holder file created at DAG bootstrap time
-                jobLogCheckpoint = None
-            else:
-                logging.debug("reading cache file")
-                fjrParseResCheckpoint = int(nodesStorage.readline())
-                nodes = ast.literal_eval(nodesStorage.readline())
-                nodeMap = ast.literal_eval(nodesStorage.readline())
-                nodesStorage.close()
-        except Exception:
-            logging.exception("error during status_cache handling")
-            jobLogCheckpoint = None
-
-    if not jobLogCheckpoint:
-        logging.debug("no usable cache file found, creating")
-        fjrParseResCheckpoint = 0
-        nodes = {}
-        nodeMap = {}
-
-    if jobLogCheckpoint:
-        # resume log parsing where we left
-        with open((LOG_PARSING_POINTERS_DIR+jobLogCheckpoint), 'rb') as f:
-            jel = pickle.load(f)
-    else:
-        # parse log from beginning
-        jel = htcondor.JobEventLog('job_log')
-    #jobsLog = open("job_log", "r")
-    #jobsLog.seek(jobLogCheckpoint)
-
-    parseJobLog(jel, nodes, nodeMap)
-    # save jel object in a pickle file made unique by a timestamp
-    newJelPickleName = 'jel-%d.pkl' % int(time.time())
-    if not os.path.exists(LOG_PARSING_POINTERS_DIR):
-        os.mkdir(LOG_PARSING_POINTERS_DIR)
-    with open((LOG_PARSING_POINTERS_DIR+newJelPickleName), 'wb') as f:
-        pickle.dump(jel, f)
-    newJobLogCheckpoint = newJelPickleName
-
-    for fn in glob.glob("node_state*"):
-        level = re.match(r'(\w+)(?:.(\w+))?', fn).group(2)
-        with open(fn, 'r') as nodeState:
-            parseNodeStateV2(nodeState, nodes, level)
-
-    try:
-        errorSummary, newFjrParseResCheckpoint = summarizeFjrParseResults(fjrParseResCheckpoint)
-        if errorSummary and newFjrParseResCheckpoint:
-            parseErrorReport(errorSummary, nodes)
-    except IOError:
-        logging.exception("error during error_summary file handling")
-
-    # First write the new cache file under a temporary name, so that other processes
-    # don't get an incomplete result. Then replace the old one with the new one.
-    tempFilename = (STATUS_CACHE_FILE + ".%s") % os.getpid()
-
-    nodesStorage = open(tempFilename, "w")
-    nodesStorage.write(str(newJobLogCheckpoint) + "\n")
-    nodesStorage.write(str(newFjrParseResCheckpoint) + "\n")
-    nodesStorage.write(str(nodes) + "\n")
-    nodesStorage.write(str(nodeMap) + "\n")
-    nodesStorage.close()
-
-    move(tempFilename, STATUS_CACHE_FILE)
-
-    # collect all cache info in a single dictionary and return it to called
-    cacheDoc = {}
-    cacheDoc['jobLogCheckpoint'] = newJobLogCheckpoint
-    cacheDoc['fjrParseResCheckpoint'] = newFjrParseResCheckpoint
-    cacheDoc['nodes'] = nodes
-    cacheDoc['nodeMap'] = nodeMap
-    return cacheDoc
+        exists, oldState = nodes.peekState(nodeid)
+        if exists and nextNodeState(oldState, status, retry, msg) == oldState:
+            continue
+        info = nodes.get(nodeid)
+        isNew = info is None
+        if isNew:
+            info = nodes[nodeid] = newNodeInfo()
+        oldState = info.get('State')
+        newState = nextNodeState(oldState, status, retry, msg)
+        if newState is not None:
+            info['State'] = newState
+        if isNew or newState != oldState:
+            touched.add(nodeid)
+    if dagStatus != oldDagStatus:
+        touched.add("DagStatus")
 
 def readOldStatusCacheFile():
     """
@@ -393,10 +387,10 @@ def readOldStatusCacheFile():
             with open(PKL_STATUS_CACHE_FILE, "rb") as fp:
                 cacheDoc = pickle.load(fp)
             # protect against fake file with just bootstrapTime created by AdjustSites.py
-            jobLogCheckpoint = getattr(cacheDoc, 'jobLogCheckpoint', None)
-            fjrParseResCheckpoint = getattr(cacheDoc, 'fjrParseResCheckpoint', None)
-            nodes = getattr(cacheDoc, 'nodes', None)
-            nodeMap = getattr(cacheDoc, 'nodeMap', None)
+            jobLogCheckpoint = cacheDoc.get('jobLogCheckpoint', None)
+            fjrParseResCheckpoint = cacheDoc.get('fjrParseResCheckpoint', None)
+            nodes = cacheDoc.get('nodes', None)
+            nodeMap = cacheDoc.get('nodeMap', None)
         except Exception:
             logging.exception("error during status_cache handling")
             jobLogCheckpoint = None
@@ -415,18 +409,24 @@ def readOldStatusCacheFile():
     cacheDoc['nodeMap'] = nodeMap
     return cacheDoc
 
-def parseCondorLog(cacheDoc):
+def parseCondorLog(cacheDoc, touched):
     """
     do all real work and update checkpoints, nodes and nodemap dictionaries
     takes as input a cacheDoc dictionary with keys
-      jobLogCheckpoint, fjrParseResCheckpoint, nodes, nodeMap
-    and returns the same dictionary with updated information
+      jobLogCheckpoint, fjrParseResCheckpoint, nodes (a LazyNodes), nodeMap (a LazyRecords)
+    and returns the same dictionary with updated information.
+    The names of the nodes which were modified are added to touched
     """
 
     jobLogCheckpoint = cacheDoc['jobLogCheckpoint']
     fjrParseResCheckpoint = cacheDoc['fjrParseResCheckpoint']
     nodes = cacheDoc['nodes']
     nodeMap = cacheDoc['nodeMap']
+    if jobLogCheckpoint and not os.path.exists(LOG_PARSING_POINTERS_DIR+jobLogCheckpoint):
+        logging.warning("checkpoint %s not found, parsing job_log from the beginning", jobLogCheckpoint)
+        jobLogCheckpoint = None
+        nodes.clear()
+        nodeMap.clear()
     if jobLogCheckpoint:
         # resume log parsing where we left
         with open((LOG_PARSING_POINTERS_DIR+jobLogCheckpoint), 'rb') as f:
@@ -435,7 +435,7 @@ def parseCondorLog(cacheDoc):
         # parse log from beginning
         jel = htcondor.JobEventLog('job_log')
 
-    parseJobLog(jel, nodes, nodeMap)
+    parseJobLog(jel, nodes, nodeMap, touched)
     # save jel object in a pickle file made unique by a timestamp
     newJelPickleName = 'jel-%d.pkl' % int(time.time())
     if not os.path.exists(LOG_PARSING_POINTERS_DIR):
@@ -447,12 +447,12 @@ def parseCondorLog(cacheDoc):
     for fn in glob.glob("node_state*"):
         level = re.match(r'(\w+)(?:.(\w+))?', fn).group(2)
         with open(fn, 'r') as nodeState:
-            parseNodeStateV2(nodeState, nodes, level)
+            parseNodeStateV2(nodeState, nodes, level, touched)
 
     try:
         errorSummary, newFjrParseResCheckpoint = summarizeFjrParseResults(fjrParseResCheckpoint)
         if errorSummary and newFjrParseResCheckpoint:
-            parseErrorReport(errorSummary, nodes)
+            parseErrorReport(errorSummary, nodes, touched)
     except IOError:
         logging.exception("error during error_summary file handling")
 
@@ -464,10 +464,91 @@ def parseCondorLog(cacheDoc):
     newCacheDoc['nodeMap'] = nodeMap
     return newCacheDoc
 
+class LazyRecords(dict):
+    """
+    a dictionary backed by a table of the status cache DB: a key which is not in memory is
+    looked up with load(key) the first time it is used, so that each run only reads the
+    records it needs. Keys which are set are added to self.assigned.
+    Without load (e.g. after clear(), when the job log is parsed again from the beginning)
+    what is in memory is all there is, and self.complete is True.
+    Iterating over it only gives what is in memory.
+    """
+
+    def __init__(self, load=None, content=None):
+        super().__init__(content or {})
+        self.load = load
+        self.complete = load is None
+        self.absent = set()
+        self.assigned = set()
+
+    def fetch(self, key):
+        """ bring the record of key in memory, if it is in the DB """
+        if self.load is None or key in self.absent or dict.__contains__(self, key):
+            return
+        value = self.load(key)
+        if value is None:
+            self.absent.add(key)
+        else:
+            dict.__setitem__(self, key, value)
+
+    def __missing__(self, key):
+        self.fetch(key)
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        self.fetch(key)
+        return dict.__contains__(self, key)
+
+    def get(self, key, default=None):
+        self.fetch(key)
+        return dict.get(self, key, default)
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return dict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        self.absent.discard(key)
+        self.assigned.add(key)
+        dict.__setitem__(self, key, value)
+
+    def clear(self):
+        dict.clear(self)
+        self.load = None
+        self.complete = True
+
+
+class LazyNodes(LazyRecords):
+    """
+    LazyRecords for the nodes, which can also tell the State of a node without reading its
+    record: the node state file lists all the nodes, but few of them change at each run
+    """
+
+    def __init__(self, load=None, loadStates=None, content=None):
+        super().__init__(load, content)
+        self.loadStates = loadStates
+        self.states = None
+
+    def peekState(self, node):
+        """ returns: a tuple (the node exists, its State or None) """
+        if self.complete or node in self.absent or dict.__contains__(self, node):
+            info = dict.get(self, node)
+            return info is not None, info.get('State') if info is not None else None
+        if self.states is None:
+            self.states = self.loadStates()
+        if node in self.states:
+            return True, self.states[node]
+        return False, None
+
+
 def storeNodesInfoInPklFile(cacheDoc):
     """
     takes as input an cacheDoc dictionary with keys
       jobLogCheckpoint, fjrParseResCheckpoint, nodes, nodeMap
+    with nodes and nodeMap complete, as plain dictionaries
     """
     # First write the new cache file under a temporary name, so that other processes
     # don't get an incomplete result. Then replace the old one with the new one.
@@ -497,6 +578,157 @@ def storeNodesInfoInTxtFile(cacheDoc):
     nodesStorage.write(str(nodes) + "\n")
     nodesStorage.write(str(nodeMap) + "\n")
     nodesStorage.close()
+    move(tempFilename, STATUS_CACHE_FILE)
+
+def openStatusCacheDb():
+    """
+    open (and create if needed) the incremental status cache, an SQLite file with
+    one record per node, one per (cluster, proc) -> node mapping and the parsing checkpoints.
+    Records have an inpkl flag, cleared when they are written and set once they are in
+    status_cache.pkl
+    returns: an sqlite3 connection
+    """
+    conn = sqlite3.connect(DB_STATUS_CACHE_FILE)
+    conn.execute("CREATE TABLE IF NOT EXISTS checkpoints (name TEXT PRIMARY KEY, value TEXT)")
+    conn.execute("CREATE TABLE IF NOT EXISTS nodes (node TEXT PRIMARY KEY, info BLOB, state TEXT, "
+                 "inpkl INTEGER DEFAULT 0)")
+    conn.execute("CREATE INDEX IF NOT EXISTS nodes_inpkl ON nodes (inpkl)")
+    conn.execute("CREATE TABLE IF NOT EXISTS nodemap (cluster INTEGER, proc INTEGER, node TEXT, "
+                 "inpkl INTEGER DEFAULT 0, PRIMARY KEY (cluster, proc))")
+    conn.execute("CREATE INDEX IF NOT EXISTS nodemap_inpkl ON nodemap (inpkl)")
+    conn.commit()
+    return conn
+
+def readStatusCacheDb(conn):
+    """
+    read the checkpoints of the incremental status cache. Node records and mappings
+    are only read when they are used
+    returns: a dictionary with keys jobLogCheckpoint, fjrParseResCheckpoint, nodes (a LazyNodes),
+    nodeMap (a LazyRecords), or None if the DB is still empty
+    """
+    checkpoints = dict(conn.execute("SELECT name, value FROM checkpoints"))
+    if not checkpoints.get('jobLogCheckpoint'):
+        return None
+
+    def loadNode(node):
+        row = conn.execute("SELECT info FROM nodes WHERE node = ?", (node,)).fetchone()
+        return pickle.loads(bytes(row[0])) if row else None
+
+    def loadStates():
+        return dict(conn.execute("SELECT node, state FROM nodes"))
+
+    def loadProc(proc):
+        row = conn.execute("SELECT node FROM nodemap WHERE cluster = ? AND proc = ?", proc).fetchone()
+        return row[0] if row else None
+
+    cacheDoc = {}
+    cacheDoc['jobLogCheckpoint'] = checkpoints['jobLogCheckpoint']
+    cacheDoc['fjrParseResCheckpoint'] = int(checkpoints.get('fjrParseResCheckpoint', 0))
+    cacheDoc['nodes'] = LazyNodes(loadNode, loadStates)
+    cacheDoc['nodeMap'] = LazyRecords(loadProc)
+    return cacheDoc
+
+def writeStatusCacheDb(conn, cacheDoc, touched):
+    """
+    update the incremental status cache writing only the node records which were modified
+    (touched), the new (cluster, proc) mappings and the checkpoints, all in one transaction.
+    If nodes and nodeMap are complete (first run, or after parsing the job log from the
+    beginning) the DB content is replaced with them
+    :param cacheDoc: a dictionary with keys jobLogCheckpoint, fjrParseResCheckpoint, nodes, nodeMap
+    :param touched: the set of nodes modified since readStatusCacheDb, see parseCondorLog
+    :return: the number of node records and node mappings which were written
+    """
+    nodes = cacheDoc['nodes']
+    nodeMap = cacheDoc['nodeMap']
+    complete = nodes.complete
+    changedNodes = [(node, sqlite3.Binary(pickle.dumps(nodes[node], protocol=2)), nodes[node].get('State'))
+                    for node in (list(nodes) if complete else touched)]
+    newProcs = [(proc[0], proc[1], nodeMap[proc]) for proc in (list(nodeMap) if complete else nodeMap.assigned)]
+    checkpoints = [('jobLogCheckpoint', str(cacheDoc['jobLogCheckpoint'])),
+                   ('fjrParseResCheckpoint', str(cacheDoc['fjrParseResCheckpoint']))]
+    with conn:
+        if complete:
+            conn.execute("DELETE FROM nodes")
+            conn.execute("DELETE FROM nodemap")
+        conn.executemany("INSERT OR REPLACE INTO nodes (node, info, state, inpkl) VALUES (?, ?, ?, 0)", changedNodes)
+        conn.executemany("INSERT OR REPLACE INTO nodemap (cluster, proc, node, inpkl) VALUES (?, ?, ?, 0)", newProcs)
+        conn.executemany("INSERT OR REPLACE INTO checkpoints (name, value) VALUES (?, ?)", checkpoints)
+    logging.debug("status cache DB: %d node records and %d node mappings written%s",
+                  len(changedNodes), len(newProcs), " (all of them)" if complete else "")
+    return len(changedNodes) + len(newProcs)
+
+def refreshPklFile(conn, cacheDoc):
+    """
+    bring status_cache.pkl up to date with the DB. Unless nodes and nodeMap are complete in
+    memory, the previous status_cache.pkl is read and only the records which are not in it
+    yet (inpkl = 0) are read from the DB, or all of them if there is no usable previous file
+    :return: the content written to status_cache.pkl, with plain dictionaries
+    """
+    pklDoc = None
+    if not cacheDoc['nodes'].complete:
+        try:
+            with open(PKL_STATUS_CACHE_FILE, "rb") as fp:
+                pklDoc = pickle.load(fp)
+        except Exception:  # pylint: disable=broad-except
+            logging.exception("can not read %s, rebuilding it from the DB", PKL_STATUS_CACHE_FILE)
+        # the file written by AdjustSites.py only has bootstrapTime
+        if pklDoc is not None and not pklDoc.get('jobLogCheckpoint'):
+            pklDoc = None
+    if cacheDoc['nodes'].complete:
+        nodes, nodeMap = dict(cacheDoc['nodes']), dict(cacheDoc['nodeMap'])
+    elif pklDoc is None:
+        nodes = dict((node, pickle.loads(bytes(blob))) for node, blob in conn.execute("SELECT node, info FROM nodes"))
+        nodeMap = dict(((cluster, proc), node) for cluster, proc, node in
+                       conn.execute("SELECT cluster, proc, node FROM nodemap"))
+    else:
+        nodes, nodeMap = pklDoc['nodes'], pklDoc['nodeMap']
+        for node, blob in conn.execute("SELECT node, info FROM nodes WHERE inpkl = 0"):
+            nodes[node] = pickle.loads(bytes(blob))
+        for cluster, proc, node in conn.execute("SELECT cluster, proc, node FROM nodemap WHERE inpkl = 0"):
+            nodeMap[(cluster, proc)] = node
+    pklDoc = {}
+    pklDoc['jobLogCheckpoint'] = cacheDoc['jobLogCheckpoint']
+    pklDoc['fjrParseResCheckpoint'] = cacheDoc['fjrParseResCheckpoint']
+    pklDoc['nodes'] = nodes
+    pklDoc['nodeMap'] = nodeMap
+    storeNodesInfoInPklFile(pklDoc)
+    with conn:
+        conn.execute("UPDATE nodes SET inpkl = 1 WHERE inpkl = 0")
+        conn.execute("UPDATE nodemap SET inpkl = 1 WHERE inpkl = 0")
+    return pklDoc
+
+def pklRefreshDue(conn, cacheDoc, dagStatusChanged):
+    """
+    status_cache.pkl is rewritten when the DB was rebuilt, when the DAG status changes (e.g. the
+    task is done) or, if anything changed since it was last written, every PKL_REFRESH_INTERVAL
+    """
+    if cacheDoc['nodes'].complete or dagStatusChanged or not os.path.exists(PKL_STATUS_CACHE_FILE):
+        return True
+    if time.time() - os.stat(PKL_STATUS_CACHE_FILE).st_mtime < PKL_REFRESH_INTERVAL:
+        return False
+    return bool(conn.execute("SELECT EXISTS (SELECT 1 FROM nodes WHERE inpkl = 0) "
+                             "OR EXISTS (SELECT 1 FROM nodemap WHERE inpkl = 0)").fetchone()[0])
+
+def rotateJelCheckpoints(jobLogCheckpoint):
+    """
+    remove old jel-<timestamp>.pkl files, keeping the JEL_CHECKPOINTS_TO_KEEP most recent ones
+    and in any case the one currently in use
+    :param jobLogCheckpoint: the name of the checkpoint file in use
+    :return: nothing
+    """
+    checkpoints = []
+    for fn in glob.glob(LOG_PARSING_POINTERS_DIR + 'jel-*.pkl'):
+        m = re.match(r'jel-(\d+)\.pkl$', os.path.basename(fn))
+        if m:
+            checkpoints.append((int(m.group(1)), fn))
+    checkpoints.sort(reverse=True)
+    for _, fn in checkpoints[JEL_CHECKPOINTS_TO_KEEP:]:
+        if os.path.basename(fn) == jobLogCheckpoint:
+            continue
+        try:
+            os.remove(fn)
+        except OSError:
+            logging.exception("could not remove old checkpoint %s", fn)
 
 def summarizeFjrParseResults(checkpoint):
     '''
@@ -533,26 +765,58 @@ def summarizeFjrParseResults(checkpoint):
     else:
         return None, 0
 
+def updateStatusCache(writeTxt=False):
+    """
+    parse condor job_log from last checkpoint until now, update the incremental status_cache.db
+    and, when due (see pklRefreshDue), write the summary in the status_cache.pkl file (and
+    status_cache.txt when asked to). Works on the task in the current directory,
+    can be called by cache_status_daemon.py
+    :param writeTxt: also write the legacy status_cache.txt file, with status_cache.pkl
+    :return: True if anything changed in the status cache
+    """
+    with open(LOCK_FILE, 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        conn = openStatusCacheDb()
+        try:
+            cacheDoc = readStatusCacheDb(conn)
+            if cacheDoc is None:
+                # first run, or first run after the switch to the DB: pick up the checkpoints and
+                # nodes from the pickle file (if any) and write all records to the DB
+                cacheDoc = readOldStatusCacheFile()
+                cacheDoc['nodes'] = LazyNodes(content=cacheDoc['nodes'])
+                cacheDoc['nodeMap'] = LazyRecords(content=cacheDoc['nodeMap'])
+            oldDagStatus = (cacheDoc['nodes'].get('DagStatus') or {}).get('DagStatus')
+            touched = set()
+            cacheDoc = parseCondorLog(cacheDoc, touched)
+            changes = writeStatusCacheDb(conn, cacheDoc, touched)
+            dagStatusChanged = (cacheDoc['nodes'].get('DagStatus') or {}).get('DagStatus') != oldDagStatus
+            # the pickle file is what PreDAG, Publisher and the client read, it has all the nodes:
+            # rewriting it at every run would make each run as expensive as the number of jobs
+            if pklRefreshDue(conn, cacheDoc, dagStatusChanged):
+                pklDoc = refreshPklFile(conn, cacheDoc)
+                if writeTxt:
+                    storeNodesInfoInTxtFile(pklDoc)
+        finally:
+            conn.close()
+        rotateJelCheckpoints(cacheDoc['jobLogCheckpoint'])
+    return bool(changes)
+
 def main():
     """
-    parse condor job_log from last checkpoint until now and write summary in status_cache files
+    update the status cache of the task in the current directory
     :return:
     """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--txt', action='store_true', default=False,
+                        help="also write the legacy %s file, when %s is written" %
+                        (STATUS_CACHE_FILE, PKL_STATUS_CACHE_FILE))
+    args = parser.parse_args()
     try:
-        # this is the old part
-        cacheDoc = storeNodesInfoInFile()
-        # this is new for the picke file but for the time being stick to using
-        # cacheDoc information from old way. At some point shoudl carefull check code
-        # and move on to the more strucutred 3-steps below, most likely when running
-        # in python3 the old status_cache.txt file will be unusable, as we found in crab client
-        #infoN = readOldStatusCacheFile()
-        #infoN = parseCondorLog(info)
-        storeNodesInfoInPklFile(cacheDoc)
-        # in case we still need the text file (e.g. for the UI) when we remove the old code:
-        # storeNodesInfoInTxtFile(cacheDoc)
+        updateStatusCache(writeTxt=args.txt)
     except Exception:
         logging.exception("error during main loop")
 
-main()
-
-logging.debug("cache_status_jel.py exiting")
+if __name__ == '__main__':
+    logging.basicConfig(filename='task_process/cache_status.log', level=logging.DEBUG)
+    main()
+    logging.debug("cache_status_jel.py exiting")
@@ -0,0 +1,267 @@
+#!/usr/bin/python3
+"""
+Schedd-wide replacement for the per-task invocations of cache_status.py.
+One long running process finds all the tasks in the schedd spool which have an
+active task_process, polls their job_log, node_state and fjr_parse_results files
+and, when they changed, updates the task status cache with the same code used by
+cache_status.py, in a bounded number of worker processes.
+
+The daemon runs as root (it is started by the condor_master, see
+cache_status_daemon.config) and never writes in a task spool directory itself:
+each update is done by a forked child which first switches to the owner of the
+task spool directory, so that status_cache.db, the jel-*.pkl checkpoints and the
+lock file keep belonging to the task owner, and the pickles in there are never
+loaded with root privileges.
+
+Fairness: a task has at most one update in flight, and when there are more tasks
+to update than free workers, those updated least recently go first.
+
+While this daemon runs, each update refreshes the task_process/cache_status_daemon
+file in the task, which tells task_proc_wrapper.sh not to run cache_status.py itself.
+
+Usage (from the directory which contains cache_status.py):
+  python3 cache_status_daemon.py --workers 8 --logfile /var/log/crab/cache_status_daemon.log
+"""
+from __future__ import print_function, division
+import os
+import glob
+import time
+import signal
+import logging
+import argparse
+
+import htcondor
+
+import cache_status
+
+TASK_PROCESS_RUNNING = "task_process/task_process_running"
+DAEMON_MARKER_FILE = "task_process/cache_status_daemon"
+WATCHED_FILES = ["job_log", "node_state*", cache_status.FJR_PARSE_RES_FILE]
+# task_proc_wrapper.sh runs cache_status.py itself when the marker is older than 15 minutes,
+# so tasks with nothing new to parse are still visited this often
+MARKER_REFRESH_INTERVAL = 300
+
+
+def dropPrivileges(uid, gid):
+    """
+    switch the current process to uid/gid for good, i.e. also the saved ids
+    so that it can not get root back. Nothing to do if we already are uid
+    :param uid: the user id to switch to
+    :param gid: the group id to switch to
+    """
+    if os.geteuid() == uid:
+        return
+    os.setgroups([])
+    os.setresgid(gid, gid, gid)
+    os.setresuid(uid, uid, uid)
+
+
+def updateTask(taskDir, uid, gid, logger):
+    """
+    body of the worker process: update the status cache of one task as the task owner
+    :param taskDir: the task spool directory
+    :param uid: the owner of the task spool directory
+    :param gid: the group of the task spool directory
+    :param logger: the daemon logger
+    :return: the exit code of the worker, 0 if the update succeeded
+    """
+    start = time.time()
+    try:
+        dropPrivileges(uid, gid)
+        os.chdir(taskDir)
+        with open(DAEMON_MARKER_FILE, 'a'):
+            os.utime(DAEMON_MARKER_FILE, None)
+        changed = cache_status.updateStatusCache(writeTxt=True)
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("failed to update status cache of %s", taskDir)
+        return 1
+    logger.debug("updated %s in %.2f s, changed: %s", taskDir, time.time() - start, changed)
+    return 0
+
+
+def startUpdate(taskDir, uid, gid, logger):
+    """
+    fork a worker process which updates the status cache of one task
+    :return: the pid of the worker
+    """
+    pid = os.fork()
+    if pid:
+        return pid
+    exitCode = 1
+    try:
+        ignoreSignals()
+        exitCode = updateTask(taskDir, uid, gid, logger)
+    finally:
+        logging.shutdown()
+        os._exit(exitCode)  # pylint: disable=protected-access
+
+
+def ignoreSignals():
+    """
+    worker initializer: workers leave it to the main process to decide when to stop,
+    so that a signal sent to the whole process group does not kill an update halfway
+    """
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_IGN)
+
+
+def filesSignature(taskDir):
+    """
+    a cheap fingerprint of the files cache_status.py parses, used to find out
+    if there is anything new to parse for this task
+    :param taskDir: the task spool directory
+    :return: a tuple of (name, size, mtime) tuples
+    """
+    signature = []
+    for pattern in WATCHED_FILES:
+        for fn in sorted(glob.glob(os.path.join(taskDir, pattern))):
+            try:
+                st = os.stat(fn)
+            except OSError:
+                continue
+            signature.append((os.path.basename(fn), st.st_size, st.st_mtime))
+    return tuple(signature)
+
+
+class StatusCacheDaemon(object):
+    """
+    keeps track of the tasks in the schedd spool and of the updates which are running
+    """
+    def __init__(self, spoolGlob, workers, polling, minInterval, logger):
+        self.spoolGlob = spoolGlob
+        self.workers = workers
+        self.polling = polling
+        self.minInterval = minInterval
+        self.logger = logger
+        # taskDir -> {'signature': files signature at the last update, 'lastUpdate': time of last update,
+        #             'uid', 'gid': owner of the task spool directory}
+        self.tasks = {}
+        # taskDir -> pid of the worker updating it
+        self.inFlight = {}
+        self.stopping = False
+
+    def discoverTasks(self):
+        """
+        refresh the list of tasks with an active task_process and the owner of each of them
+        """
+        found = set()
+        for taskDir in glob.glob(self.spoolGlob):
+            if not os.path.exists(os.path.join(taskDir, TASK_PROCESS_RUNNING)):
+                continue
+            try:
+                st = os.stat(taskDir)
+            except OSError:
+                continue
+            if os.geteuid() != 0 and st.st_uid != os.geteuid():
+                self.logger.debug("skipping %s, owned by uid %d and not running as root", taskDir, st.st_uid)
+                continue
+            found.add(taskDir)
+            info = self.tasks.setdefault(taskDir, {'signature': None, 'lastUpdate': 0})
+            info['uid'], info['gid'] = st.st_uid, st.st_gid
+        for taskDir in set(self.tasks) - found:
+            if taskDir not in self.inFlight:
+                self.logger.info("task %s is gone or its task_process exited, forgetting about it", taskDir)
+                del self.tasks[taskDir]
+        return len(found)
+
+    def collectResults(self, block=False):
+        """
+        reap the workers which completed since last time
+        :param block: wait for all the workers to complete
+        """
+        for taskDir, pid in list(self.inFlight.items()):
+            try:
+                donePid, status = os.waitpid(pid, 0 if block else os.WNOHANG)
+            except ChildProcessError:
+                donePid, status = pid, 0
+            if not donePid:
+                continue
+            del self.inFlight[taskDir]
+            # the worker logs its own errors, here we only catch those which killed it
+            # (do not retry immediately, wait for the next file change or minInterval)
+            if os.WIFSIGNALED(status):
+                self.logger.error("worker %d updating %s killed by signal %d", pid, taskDir, os.WTERMSIG(status))
+            elif os.WEXITSTATUS(status):
+                self.logger.debug("worker %d updating %s exited with %d", pid, taskDir, os.WEXITSTATUS(status))
+
+    def scheduleUpdates(self):
+        """
+        start an update for the tasks whose files changed, or whose marker file needs a refresh,
+        as long as there are free workers, oldest updated first
+        """
+        now = time.time()
+        candidates = []
+        for taskDir, info in self.tasks.items():
+            if taskDir in self.inFlight or now - info['lastUpdate'] < self.minInterval:
+                continue
+            signature = filesSignature(taskDir)
+            if signature and (signature != info['signature'] or now - info['lastUpdate'] > MARKER_REFRESH_INTERVAL):
+                candidates.append((info['lastUpdate'], taskDir, signature))
+        candidates.sort()
+        for _, taskDir, signature in candidates[:max(0, self.workers - len(self.inFlight))]:
+            info = self.tasks[taskDir]
+            info['signature'] = signature
+            info['lastUpdate'] = now
+            self.inFlight[taskDir] = startUpdate(taskDir, info['uid'], info['gid'], self.logger)
+        return len(candidates)
+
+    def stop(self, signum, _frame):
+        """ signal handler """
+        self.logger.info("received signal %d, stopping", signum)
+        self.stopping = True
+
+    def run(self):
+        """
+        main loop: rescan the spool every `polling` seconds, in between keep the workers busy
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        # condor_master sends SIGQUIT for a fast shutdown and SIGHUP on reconfig
+        signal.signal(signal.SIGQUIT, self.stop)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        lastScan = 0
+        try:
+            while not self.stopping:
+                if time.time() - lastScan > self.polling:
+                    nTasks = self.discoverTasks()
+                    lastScan = time.time()
+                    self.logger.info("tracking %d tasks, %d updates in flight", nTasks, len(self.inFlight))
+                self.collectResults()
+                self.scheduleUpdates()
+                time.sleep(1)
+        finally:
+            self.collectResults(block=True)
+
+
+def main():
+    """
+    parse arguments and run the daemon until it is stopped by a signal
+    """
+    parser = argparse.ArgumentParser(description="schedd-wide status cache updater")
+    parser.add_argument('--spool-glob', dest='spoolGlob', default=None,
+                        help="glob matching the task spool directories (default: from the SPOOL condor param)")
+    parser.add_argument('--workers', type=int, default=8,
+                        help="maximum number of worker processes")
+    parser.add_argument('--polling', type=int, default=60,
+                        help="seconds between two scans of the spool directory")
+    parser.add_argument('--min-interval', dest='minInterval', type=int, default=60,
+                        help="minimum seconds between two updates of the same task")
+    parser.add_argument('--logfile', default=None,
+                        help="log file (default: stderr)")
+    parser.add_argument('--debug', action='store_true', default=False)
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=args.logfile, level=logging.DEBUG if args.debug else logging.INFO,
+                        format="%(asctime)s:%(levelname)s:%(process)d:%(message)s")
+    logger = logging.getLogger()
+    if os.geteuid() != 0:
+        logger.warning("not running as root, only the tasks of uid %d will be updated", os.geteuid())
+    spoolGlob = args.spoolGlob
+    if not spoolGlob:
+        spoolGlob = os.path.join(htcondor.param['SPOOL'], '*', '*', 'cluster*.proc0.subproc0')
+    logger.info("starting with %d workers on %s", args.workers, spoolGlob)
+    StatusCacheDaemon(spoolGlob, args.workers, args.polling, args.minInterval, logger).run()
+
+
+if __name__ == '__main__':
+    main()
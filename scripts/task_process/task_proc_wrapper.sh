@@ -5,8 +5,15 @@ function log {
 }
 
 function cache_status {
+    # the schedd-wide cache_status_daemon.py keeps this file fresh while it takes care of this task.
+    # Pass "force" to run anyhow, e.g. for the last update before exiting
+    if [[ "$1" != "force" && -n $(find task_process/cache_status_daemon -mmin -15 2>/dev/null) ]]; then
+        log "cache_status.py is run by the schedd status cache daemon, skipping"
+        return
+    fi
     log "Running cache_status.py"
-    python3 task_process/cache_status.py
+    # status_cache.txt is served from WEB_DIR as status_cache, it is written together with status_cache.pkl
+    python3 task_process/cache_status.py --txt
 }
 
 function manage_transfers {
@@ -171,7 +178,7 @@ do
             log "Dag(s) has (have) been in one of the final states for over 24 hours."
             log "Caching the status one last time, removing the task_process/task_process_running file and exiting."
 
-            cache_status
+            cache_status force
             rm task_process/task_process_running
 
             exit 0
@@ -5,10 +5,12 @@
 
 import json
 import logging
-from ast import literal_eval
 
 from Utils.Utilities import makeList
 
+from ast import literal_eval
+
+from ServerUtilities import encodeRunLumi, decodeRunLumi, isLegacyRunLumi, decodeParents
 from CRABInterface.Utilities import getDBinstance
 
 class DataFileMetadata(object):
@@ -24,10 +26,11 @@ class DataFileMetadata(object):
         self.logger = logging.getLogger("CRABLogger.DataFileMetadata")
         self.FileMetaData = getDBinstance(config, 'FileMetaDataDB', 'FileMetaData')
 
-    def getFiles(self, taskname, filetype, howmany=None, lfnList=None):
+    def getFiles(self, taskname, filetype, howmany=None, lfnList=None, lumiRanges=False):
         """ Given a taskname, a filetype and a number return a list of filemetadata from this task
             if a list of lfn is give, it returns metadata for files in that list, otherwise
             returns metadata for at most howmany files (default is all filemetadata for this task)
+            If lumiRanges is True, runlumi is returned as {run: [[firstLumi, lastLumi], ...]}
         """
         self.logger.debug("Calling jobmetadata for task %s and filetype %s" % (taskname, filetype))
         if howmany == None:
@@ -36,15 +39,40 @@ class DataFileMetadata(object):
             binds = {'taskname': taskname, 'filetype': filetype, 'howmany': howmany}
             allRows = self.api.query_load_all_rows(None, None, self.FileMetaData.GetFromTaskAndType_sql, **binds)
         else:
-            allRows = []
             lfns = makeList(lfnList)  # from a string to a python list of strings
-            for lfn in lfns:
-                binds = {'taskname': taskname, 'lfn': lfn}
-                rows = self.api.query_load_all_rows(None, None, self.FileMetaData.GetFromTaskAndLfn_sql, **binds)
-                for row in rows:  # above call returns a generator, but we want a list
-                    allRows.append(row)
-        for row in allRows:
+            allRows = self.getRowsByLfns(taskname, lfns)
+        for filedict in self.formatRows(taskname, allRows, lumiRanges):
+            yield json.dumps(filedict)
+
+    def getFilesByLfns(self, taskname, lfns, lumiRanges=False):
+        """ Same as getFiles with a list of LFN, but the LFNs are already a python list
+            (e.g. from the body of a POST) and can be many thousands
+        """
+        self.logger.debug("Calling jobmetadata for %d LFNs of task %s" % (len(lfns), taskname))
+        for filedict in self.formatRows(taskname, self.getRowsByLfns(taskname, lfns), lumiRanges):
+            yield json.dumps(filedict)
+
+    def getRowsByLfns(self, taskname, lfns):
+        """ Generator over the filemetadata rows of the lfns of taskname. Rows are retrieved
+            with one query for each batch of config.lfnsInQuery (at most 1000) LFNs
+        """
+        batchSize = min(getattr(self.config, 'lfnsInQuery', 500), self.FileMetaData.MaxLfnsInList)
+        for start in range(0, len(lfns), batchSize):
+            batch = lfns[start:start + batchSize]
+            binds = {'taskname': taskname}
+            binds.update(('lfn%d' % i, lfn) for i, lfn in enumerate(batch))
+            sql = self.FileMetaData.getFromTaskAndLfnListSql(len(batch))
+            for row in self.api.query_load_all_rows(None, None, sql, **binds):
+                yield row
+
+    def formatRows(self, taskname, rows, lumiRanges):
+        """ Generator converting rows of the GetFromTaskAnd* queries into filemetadata dictionaries.
+            Rows still in the legacy python literal format are decoded as they are, see migrate
+        """
+        for row in rows:
             row = self.FileMetaData.GetFromTaskAndType_tuple(*row)
+            runlumi = row.runlumi.read()
+            parents = decodeParents(row.parents.read())
             filedict = {
                 'taskname': taskname,
                 'filetype': row.type,
@@ -57,28 +85,60 @@ class DataFileMetadata(object):
                     'publishname': row.publishname,
                     'location': row.location,
                     'tmplocation': row.tmplocation,
-                    'runlumi': literal_eval(row.runlumi.read()),
+                    'runlumi': decodeRunLumi(runlumi, lumiRanges),
                     'adler32': row.adler32,
                     'cksum': row.cksum,
                     'md5': row.md5,
                     'lfn': row.lfn,
                     'filesize': row.filesize,
-                    'parents': literal_eval(row.parents.read()),
+                    'parents': parents,
                     'state': row.state,
                     'created': str(row.parents),
                     'tmplfn': row.tmplfn
             }
-            yield json.dumps(filedict)
+            yield filedict
 
-    def inject(self, **kwargs):
-        """ Insert or update a record in the database
+    def migrate(self, howmany, aftertask=None, afterlfn=None):
+        """ Rewrite runlumi and parents of up to howmany files still in the legacy python literal
+            format in the JSON one, with a single array-bound statement. Files are taken in
+            (taskname, lfn) order, after (aftertask, afterlfn) if given. Called by operators
+            (scripts/Utils/MigrateFileMetadata.py), passing the aftertask and afterlfn returned
+            by each call to the next one, until a call finds no file.
+
+            :return: a list with one {'migrated': number of files rewritten, 'skipped': number of
+                     files found which could not be rewritten, 'aftertask': ..., 'afterlfn': ...}
+                     dictionary, the last two being the key of the last file found
         """
-        self.logger.debug("Calling jobmetadata inject with parameters %s" % kwargs)
+        toMigrate = []
+        nRows = 0
+        rows = self.api.query_load_all_rows(None, None, self.FileMetaData.GetLegacyRunLumi_sql, howmany=howmany,
+                                            aftertask=aftertask, afterlfn=afterlfn)
+        for taskname, lfn, runlumi, parents in rows:
+            aftertask, afterlfn = taskname, lfn
+            nRows += 1
+            runlumi = runlumi.read()
+            if not isLegacyRunLumi(runlumi):
+                continue
+            try:
+                toMigrate.append((taskname, lfn, encodeRunLumi(literal_eval(runlumi)),
+                                  json.dumps(decodeParents(parents.read()))))
+            except (ValueError, SyntaxError) as ex:
+                # left as it is, the next calls start after it
+                self.logger.warning("Can not migrate file %s of task %s: %s" % (lfn, taskname, ex))
+        if toMigrate:
+            self.logger.debug("Migrating runlumi and parents of %d files" % len(toMigrate))
+            binds = {'taskname': [taskname for taskname, _, _, _ in toMigrate],
+                     'lfn': [lfn for _, lfn, _, _ in toMigrate],
+                     'runlumi': [runlumi for _, _, runlumi, _ in toMigrate],
+                     'parents': [parents for _, _, _, parents in toMigrate]}
+            self.api.modifynocheck(self.FileMetaData.UpdateRunLumiParents_sql, **binds)
+        return [{'migrated': len(toMigrate), 'skipped': nRows - len(toMigrate),
+                 'aftertask': aftertask, 'afterlfn': afterlfn}]
 
-        bindnames = set(kwargs.keys()) - set(['outfileruns', 'outfilelumis'])
-        binds = {}
-        for name in bindnames:
-            binds[name] = [kwargs[name]]
+    def injectBinds(self, kwargs):
+        """ The binds of the New_sql statement for a file, from the validated parameters of a PUT
+        """
+        binds = dict((name, kwargs[name]) for name in set(kwargs.keys()) - set(['outfileruns', 'outfilelumis']))
 
         # Modify all incoming metadata to have the structure 'lumi1:events1,lumi2:events2..'
         # instead of 'lumi1,lumi2,lumi3...' if necessary.
@@ -100,10 +160,25 @@ class DataFileMetadata(object):
             lumiEventList.append(lumiDict)
         runList = kwargs['outfileruns']
         # fmd_runlumi column in FILEMETADATA table is CLOB, so need to cast into a string here
-        binds['runlumi'] = [str(dict(zip(runList, lumiEventList)))]
+        binds['runlumi'] = encodeRunLumi(dict(zip(runList, lumiEventList)))
+        binds['outtmplfn'] = binds['outlfn']
+        return binds
+
+    @staticmethod
+    def updateBinds(binds):
+        """ The binds of the Update_sql statement for a file already in the table """
+        return {'outtmplocation': binds['outtmplocation'], 'outsize': binds['outsize'], 'taskname': binds['taskname'],
+                'outlfn': binds['outlfn'], 'outtmplfn': binds['outlfn']}
+
+    def inject(self, **kwargs):
+        """ Insert or update a record in the database
+        """
+        self.logger.debug("Calling jobmetadata inject with parameters %s" % kwargs)
+
+        fileBinds = self.injectBinds(kwargs)
+        binds = dict((name, [value]) for name, value in fileBinds.items())
 
         #Changed to Select if exist, update, else insert
-        binds['outtmplfn'] = binds['outlfn']
         row = self.api.query(None, None, self.FileMetaData.GetCurrent_sql,
                               outlfn=binds['outlfn'][0], taskname=binds['taskname'][0])
         try:
@@ -115,15 +190,54 @@ class DataFileMetadata(object):
             self.api.modify(self.FileMetaData.New_sql, **binds)
             return []
         self.logger.debug('Changing filemetadata information about job %s' % row)
-        update_bind = {}
-        update_bind['outtmplocation'] = binds['outtmplocation']
-        update_bind['outsize'] = binds['outsize']
-        update_bind['taskname'] = binds['taskname']
-        update_bind['outlfn'] = binds['outlfn']
-        update_bind['outtmplfn'] = binds['outlfn']
+        update_bind = dict((name, [value]) for name, value in self.updateBinds(fileBinds).items())
         self.api.modify(self.FileMetaData.Update_sql, **update_bind)
         return []
 
+    def injectMany(self, taskname, files):
+        """ Same as inject for a list of files (the validated parameters of a PUT for each of them):
+            one query finds which files are already in the table, then one array-bound statement
+            inserts the new ones and one updates the others. A file which fails does not make the
+            others fail.
+
+            :return: a list of {'lfn': lfn, 'result': 'inserted', 'updated' or 'failed', 'error': message}
+                     dictionaries, one per file, in the same order of files.
+        """
+        self.logger.debug("Calling jobmetadata injectMany for %d files of task %s" % (len(files), taskname))
+        allBinds = [self.injectBinds(kwargs) for kwargs in files]
+        lfns = [binds['outlfn'] for binds in allBinds]
+        existing = set()
+        batchSize = min(getattr(self.config, 'lfnsInQuery', 500), self.FileMetaData.MaxLfnsInList)
+        uniqueLfns = list(set(lfns))
+        for start in range(0, len(uniqueLfns), batchSize):
+            batch = uniqueLfns[start:start + batchSize]
+            binds = {'taskname': taskname}
+            binds.update(('lfn%d' % i, lfn) for i, lfn in enumerate(batch))
+            for row in self.api.query_load_all_rows(None, None, self.FileMetaData.getCurrentListSql(len(batch)), **binds):
+                existing.add(row[0])
+
+        results = [{'lfn': lfn, 'result': 'updated' if lfn in existing else 'inserted', 'error': None} for lfn in lfns]
+        # if the same file comes more than once, the last one wins, as with sequential PUTs
+        lastIndex = dict((lfn, n) for n, lfn in enumerate(lfns))
+        for n, lfn in enumerate(lfns):
+            if lastIndex[lfn] != n:
+                allBinds[n] = None
+        for sql, isNew, makeBinds in ((self.FileMetaData.New_sql, True, dict),
+                                      (self.FileMetaData.Update_sql, False, self.updateBinds)):
+            indices = [n for n, binds in enumerate(allBinds) if binds is not None and (lfns[n] in existing) != isNew]
+            errors = []
+            counts = self.api.modifyperrow(sql, [makeBinds(allBinds[n]) for n in indices], errors=errors)
+            messages = dict(errors)
+            for offset, (n, count) in enumerate(zip(indices, counts)):
+                if not count:
+                    results[n]['result'] = 'failed'
+                    results[n]['error'] = messages.get(offset, 'no row modified')
+        # duplicates share the outcome of the file which was written
+        for n, lfn in enumerate(lfns):
+            if allBinds[n] is None:
+                results[n] = dict(results[lastIndex[lfn]])
+        return results
+
     def changeState(self, **kwargs): #kwargs are (taskname, outlfn, filestate)
         """ UNUSED method that change the fmd_filestate column of a filemetadata record
         """
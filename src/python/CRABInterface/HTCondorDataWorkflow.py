@@ -22,7 +22,7 @@ from Utils.Throttled import UserThrottle
 throttle = UserThrottle(limit=3)
 
 from CRABInterface.Utilities import conn_handler
-from ServerUtilities import FEEDBACKMAIL, PUBLICATIONDB_STATES, getEpochFromDBTime
+from ServerUtilities import FEEDBACKMAIL, PUBLICATIONDB_STATES, getEpochFromDBTime, decodeRunLumi, decodeParents
 from Databases.FileMetaDataDB.Oracle.FileMetaData.FileMetaData import GetFromTaskAndType
 
 import HTCondorUtils
@@ -153,8 +153,9 @@ class HTCondorDataWorkflow(DataWorkflow):
         res['runsAndLumis'] = {}
         for row in rows:
             jobidstr = row[GetFromTaskAndType.JOBID]
-            retRow = {'parents': row[GetFromTaskAndType.PARENTS].read(),
-                      'runlumi': row[GetFromTaskAndType.RUNLUMI].read(),
+            # the client expects the python literal format of runlumi and parents
+            retRow = {'parents': str(decodeParents(row[GetFromTaskAndType.PARENTS].read())),
+                      'runlumi': str(decodeRunLumi(row[GetFromTaskAndType.RUNLUMI].read())),
                       'events': row[GetFromTaskAndType.INEVENTS],
                       'type': row[GetFromTaskAndType.TYPE],
                       'lfn': row[GetFromTaskAndType.LFN],
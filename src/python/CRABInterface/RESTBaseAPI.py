@@ -91,6 +91,34 @@ class RESTBaseAPI(DatabaseRESTApi):
         cherrypy.request.db["handle"]["connection"].commit()
         return rows([{ "modified": c.rowcount }])
 
+    def modifyperrow(self, sql, binds, errors=None):
+        """Execute an array-bound modify statement with a single executemany call
+           and commit. Contrary to `modify`, rows which fail or do not modify
+           anything do not abort the whole batch: the number of rows modified
+           by each bind is returned so that the caller can report per-row success.
+
+           Note that this function only support Oracle DB Connector.
+
+        :arg str sql: SQL modify statement.
+        :arg list binds: Bind variables by position: list of dictionaries, one per row.
+        :arg list errors: if given, (row index, error message) tuples of the failed rows are appended to it.
+        :result: list with the number of rows modified by each bind (0 if it failed)."""
+        if cherrypy.request.db['handle']['type'].__name__ == 'MySQLdb':
+            raise NotImplementedError
+        if not binds:
+            return []
+        c, _ = self.executemany(sql, binds, batcherrors=True, arraydmlrowcounts=True)
+        failed = set(error.offset for error in c.getbatcherrors())
+        for error in c.getbatcherrors():
+            self.logger.error("Row %d of executemany failed: %s", error.offset, error.message)
+            if errors is not None:
+                errors.append((error.offset, error.message))
+        counts = c.getarraydmlrowcounts()
+        trace = cherrypy.request.db["handle"]["trace"]
+        trace and cherrypy.log("%s commit" % trace)  # pylint: disable=expression-not-assigned
+        cherrypy.request.db["handle"]["connection"].commit()
+        return [0 if idx in failed or idx >= len(counts) else counts[idx] for idx in range(len(binds))]
+
     def execute(self, sql, *binds, **kwbinds):
         """overrides WMCore/REST/Server.py/DatabaseRESTApi.execute() function
            in order to measure time used by cursor.execute(). Code is copied
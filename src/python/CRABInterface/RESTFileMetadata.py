@@ -1,6 +1,8 @@
+import json
+
 # WMCore dependecies here
 from WMCore.REST.Error import InvalidParameter
-from WMCore.REST.Server import RESTEntity, restcall
+from WMCore.REST.Server import RESTEntity, RESTArgs, restcall
 from WMCore.REST.Validation import validate_str, validate_strlist, validate_num
 
 # CRABServer dependecies here
@@ -8,7 +10,7 @@ from CRABInterface.RESTExtensions import authz_login_valid, authz_operator
 #from CRABInterface.Regexps import *
 from CRABInterface.Regexps import RX_CHECKSUM, RX_CMSSITE, RX_CMSSW, RX_FILESTATE, \
     RX_GLOBALTAG, RX_HOURS, RX_JOBID, RX_LFN, RX_LUMILIST, RX_OUTDSLFN, RX_OUTTYPES, \
-    RX_PARENTLFN, RX_PUBLISH, RX_RUNS, RX_TASKNAME, RX_ANYTHING
+    RX_PARENTLFN, RX_PUBLISH, RX_RUNS, RX_TASKNAME, RX_ANYTHING, RX_SUBPOSTFILEMETADATA, RX_LUMIFORMAT
 from CRABInterface.DataFileMetadata import DataFileMetadata
 
 class RESTFileMetadata(RESTEntity):
@@ -23,43 +25,52 @@ class RESTFileMetadata(RESTEntity):
         authz_login_valid()
 
         if method in ['PUT']:
-            validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
-            validate_strlist("outfilelumis", param, safe, RX_LUMILIST)
-            validate_strlist("outfileruns", param, safe, RX_RUNS)
-            if len(safe.kwargs["outfileruns"]) != len(safe.kwargs["outfilelumis"]):
-                raise InvalidParameter("The number of runs and the number of lumis lists are different")
-            validate_strlist("inparentlfns", param, safe, RX_PARENTLFN)
-            # inparentlfns will be inserted in Oracle as CLOB, so it must be a string
-            safe.kwargs['inparentlfns'] = str(safe.kwargs['inparentlfns'])
-            validate_str("globalTag", param, safe, RX_GLOBALTAG, optional=True)
-            validate_str("jobid", param, safe, RX_JOBID, optional=True)
-            validate_num("outsize", param, safe, optional=False)
-            validate_str("publishdataname", param, safe, RX_PUBLISH, optional=False)
-            validate_str("appver", param, safe, RX_CMSSW, optional=False)
-            validate_str("outtype", param, safe, RX_OUTTYPES, optional=False)
-            validate_str("checksummd5", param, safe, RX_CHECKSUM, optional=False)
-            validate_num("checksumcksum", param, safe, optional=False)
-            validate_str("checksumadler32", param, safe, RX_CHECKSUM, optional=False)
-            validate_str("outlocation", param, safe, RX_CMSSITE, optional=False)
-            validate_str("outtmplocation", param, safe, RX_CMSSITE, optional=False)
-            validate_str("acquisitionera", param, safe, RX_TASKNAME, optional=False)
-            validate_str("outdatasetname", param, safe, RX_OUTDSLFN, optional=False)
-            # need to use RX_PARENTLFN becasue same API is also used for input metadata
-            validate_str("outlfn", param, safe, RX_PARENTLFN, optional=False)
-            validate_str("outtmplfn", param, safe, RX_LFN, optional=True)
-            validate_num("events", param, safe, optional=False)
-            validate_str("filestate", param, safe, RX_FILESTATE, optional=True)
-            validate_num("directstageout", param, safe, optional=True)
-            safe.kwargs["directstageout"] = 'T' if safe.kwargs["directstageout"] else 'F' #'F' if not provided
+            self.validateFileRecord(param, safe)
         elif method in ['POST']:
+            validate_str("subresource", param, safe, RX_SUBPOSTFILEMETADATA, optional=True)
+            safe.kwargs['howmany'] = None
+            safe.kwargs['aftertask'] = None
+            safe.kwargs['afterlfn'] = None
+            if safe.kwargs['subresource'] == 'migrate':
+                # rewrite files stored in the legacy format, for operators: not about a single task
+                authz_operator()
+                validate_num("howmany", param, safe, optional=True, minval=1, maxval=10000)
+                if safe.kwargs['howmany'] is None:
+                    safe.kwargs['howmany'] = 1000
+                # where the previous call stopped
+                validate_str("aftertask", param, safe, RX_TASKNAME, optional=True)
+                validate_str("afterlfn", param, safe, RX_PARENTLFN, optional=True)
+                for name in ['taskname', 'outlfn', 'filestate', 'lumiformat', 'files']:
+                    safe.kwargs[name] = None
+                safe.kwargs['lfns'] = []
+                return
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
-            validate_str("outlfn", param, safe, RX_LFN, optional=False)
-            validate_str("filestate", param, safe, RX_FILESTATE, optional=False)
+            if safe.kwargs['subresource'] == 'getbylfns':
+                # a GET with the list of LFNs in the body, to avoid the URL length limit
+                validate_strlist("lfns", param, safe, RX_PARENTLFN)
+                validate_str("lumiformat", param, safe, RX_LUMIFORMAT, optional=True)
+                safe.kwargs['outlfn'] = None
+                safe.kwargs['filestate'] = None
+                safe.kwargs['files'] = None
+            elif safe.kwargs['subresource'] == 'bulkinject':
+                # many PUTs in one: a JSON list of file records in the body
+                self.validateFileRecords(param, safe)
+                safe.kwargs['outlfn'] = None
+                safe.kwargs['filestate'] = None
+                safe.kwargs['lfns'] = []
+                safe.kwargs['lumiformat'] = None
+            else:
+                validate_str("outlfn", param, safe, RX_LFN, optional=False)
+                validate_str("filestate", param, safe, RX_FILESTATE, optional=False)
+                safe.kwargs['lfns'] = []
+                safe.kwargs['lumiformat'] = None
+                safe.kwargs['files'] = None
         elif method in ['GET']:
             validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
             validate_str("filetype", param, safe, RX_OUTTYPES, optional=True)
             validate_num("howmany", param, safe, optional=True)
             validate_str("lfnList", param, safe, RX_ANYTHING, optional=True)
+            validate_str("lumiformat", param, safe, RX_LUMIFORMAT, optional=True)
         elif method in ['DELETE']:
             authz_operator()
             validate_str("taskname", param, safe, RX_TASKNAME, optional=True)
@@ -68,6 +79,70 @@ class RESTFileMetadata(RESTEntity):
                 raise InvalidParameter("You have to specify a taskname or a number of hours. Files of this task or created before the number of hours"+\
                                         " will be deleted. Only one of the two parameters can be specified.")
 
+    @staticmethod
+    def validateFileRecord(param, safe):
+        """Validate the parameters of a file metadata record, as sent with a PUT"""
+        validate_str("taskname", param, safe, RX_TASKNAME, optional=False)
+        validate_strlist("outfilelumis", param, safe, RX_LUMILIST)
+        validate_strlist("outfileruns", param, safe, RX_RUNS)
+        if len(safe.kwargs["outfileruns"]) != len(safe.kwargs["outfilelumis"]):
+            raise InvalidParameter("The number of runs and the number of lumis lists are different")
+        validate_strlist("inparentlfns", param, safe, RX_PARENTLFN)
+        # inparentlfns will be inserted in Oracle as CLOB, so it must be a string
+        safe.kwargs['inparentlfns'] = json.dumps(safe.kwargs['inparentlfns'])
+        validate_str("globalTag", param, safe, RX_GLOBALTAG, optional=True)
+        validate_str("jobid", param, safe, RX_JOBID, optional=True)
+        validate_num("outsize", param, safe, optional=False)
+        validate_str("publishdataname", param, safe, RX_PUBLISH, optional=False)
+        validate_str("appver", param, safe, RX_CMSSW, optional=False)
+        validate_str("outtype", param, safe, RX_OUTTYPES, optional=False)
+        validate_str("checksummd5", param, safe, RX_CHECKSUM, optional=False)
+        validate_num("checksumcksum", param, safe, optional=False)
+        validate_str("checksumadler32", param, safe, RX_CHECKSUM, optional=False)
+        validate_str("outlocation", param, safe, RX_CMSSITE, optional=False)
+        validate_str("outtmplocation", param, safe, RX_CMSSITE, optional=False)
+        validate_str("acquisitionera", param, safe, RX_TASKNAME, optional=False)
+        validate_str("outdatasetname", param, safe, RX_OUTDSLFN, optional=False)
+        # need to use RX_PARENTLFN becasue same API is also used for input metadata
+        validate_str("outlfn", param, safe, RX_PARENTLFN, optional=False)
+        validate_str("outtmplfn", param, safe, RX_LFN, optional=True)
+        validate_num("events", param, safe, optional=False)
+        validate_str("filestate", param, safe, RX_FILESTATE, optional=True)
+        validate_num("directstageout", param, safe, optional=True)
+        safe.kwargs["directstageout"] = 'T' if safe.kwargs["directstageout"] else 'F' #'F' if not provided
+
+    def validateFileRecords(self, param, safe):
+        """Validate the 'files' parameter of the bulkinject subresource: a JSON list of file
+           records, each one with the same parameters as a PUT and validated in the same way.
+           The validated records go in safe.kwargs['files']. Errors tell which record is wrong.
+        """
+        try:
+            records = json.loads(param.kwargs.pop('files', None) or 'null')
+        except ValueError as ex:
+            raise InvalidParameter("The files parameter is not valid JSON") from ex
+        if not isinstance(records, list) or not records:
+            raise InvalidParameter("The files parameter must be a non empty list of file records")
+        maxFiles = getattr(self.config, 'maxFilesInBulkInject', 1000)
+        if len(records) > maxFiles:
+            raise InvalidParameter("Too many file records: %d, the maximum is %d" % (len(records), maxFiles))
+        validated = []
+        for n, record in enumerate(records):
+            if not isinstance(record, dict):
+                raise InvalidParameter("File record %d is not a dictionary" % n)
+            recordParam = RESTArgs([], record)
+            recordSafe = RESTArgs([], {})
+            lfn = record.get('outlfn')
+            try:
+                self.validateFileRecord(recordParam, recordSafe)
+            except InvalidParameter as ex:
+                raise InvalidParameter("File record %d (%s): %s" % (n, lfn, ex.info)) from ex
+            if recordParam.kwargs:
+                raise InvalidParameter("File record %d (%s): unexpected parameters %s" % (n, lfn, list(recordParam.kwargs)))
+            if recordSafe.kwargs['taskname'] != safe.kwargs['taskname']:
+                raise InvalidParameter("File record %d (%s): it belongs to a different task" % (n, lfn))
+            validated.append(recordSafe.kwargs)
+        safe.kwargs['files'] = validated
+
     ## A few notes about how the following methods (put, post, get, delete) work when decorated with restcall.
     ## * The order of the arguments is irrelevant. For example, these two definitions are equivalent:
     ##   def get(self, a, b) or def get(self, b, a)
@@ -88,13 +163,29 @@ class RESTFileMetadata(RESTEntity):
                            directstageout=directstageout)
 
     @restcall
-    def post(self, taskname, outlfn, filestate):
-        """Modifies and existing job metadata information"""
+    def post(self, taskname, subresource, outlfn, filestate, lfns, lumiformat, files, howmany, aftertask, afterlfn):
+        """Modifies and existing job metadata information, or, with subresource=getbylfns,
+           retrieves the job metadata information of the lfns list. The latter is the same
+           as get with lfnList, but allows for thousands of LFNs since they are in the body.
+           With subresource=bulkinject, inserts or updates many files at once, as many PUTs would.
+           With subresource=migrate (operators only), rewrites up to howmany files stored in
+           the legacy python literal format in the JSON one, starting after the file
+           (aftertask, afterlfn) where the previous call stopped.
+
+           :return: for getbylfns a generator looping through the resulting db rows,
+                    for bulkinject the result for each file, see DataFileMetadata.injectMany,
+                    for migrate the number of files rewritten, see DataFileMetadata.migrate."""
 
+        if subresource == 'migrate':
+            return self.jobmetadata.migrate(howmany, aftertask, afterlfn)
+        if subresource == 'getbylfns':
+            return self.jobmetadata.getFilesByLfns(taskname, lfns, lumiRanges=(lumiformat == 'ranges'))
+        if subresource == 'bulkinject':
+            return self.jobmetadata.injectMany(taskname, files)
         return self.jobmetadata.changeState(taskname=taskname, outlfn=outlfn, filestate=filestate)
 
     @restcall
-    def get(self, taskname, filetype, howmany, lfnList):
+    def get(self, taskname, filetype, howmany, lfnList, lumiformat):
         """Retrieves a specific job metadata information.
 
            :arg str taskname: unique name identifier of the task;
@@ -103,8 +194,10 @@ class RESTFileMetadata(RESTEntity):
            # ? maybe better a subresource field to tell one case from the other ?
            :arg int howmany: how many rows to retrieve;
            :arg str lfnList: list of LFNs for which to retrieve metadata (a single LFN is also OK);
+           :arg str lumiformat: 'ranges' to get runlumi as {run: [[firstLumi, lastLumi], ...]}
+                                instead of {run: {lumi: events}} (default, 'lumis');
            :return: generator looping through the resulting db rows."""
-        return self.jobmetadata.getFiles(taskname, filetype, howmany, lfnList)
+        return self.jobmetadata.getFiles(taskname, filetype, howmany, lfnList, lumiRanges=(lumiformat == 'ranges'))
 
     @restcall
     def delete(self, taskname, hours):
@@ -22,6 +22,8 @@ class RESTFileTransfers(RESTEntity):
         RESTEntity.__init__(self, app, api, config, mount)
         self.transferDB = getDBinstance(config, 'FileTransfersDB', 'FileTransfers')
         self.logger = logging.getLogger("CRABLogger.FileTransfers")
+        # max number of rows sent to the DB in one array-bound statement by the update* subresources
+        self.bulkChunkSize = getattr(config, 'bulkChunkSize', 1000)
 
     def validate(self, apiobj, method, api, param, safe):
         """Validating all the input parameter as enforced by the WMCore.REST module"""
@@ -157,14 +159,13 @@ class RESTFileTransfers(RESTEntity):
                 instances = makeList(kwargs['list_of_fts_instance'])
                 fts_id = makeList(kwargs['list_of_fts_id'])
 
-                for num in range(len(ids)):
-                    binds['id'] = [ids[num]]
-                    binds['transfer_state'] = [TRANSFERDB_STATUSES[states[num]]]
-                    binds['fts_instance'] = [str(instances[num])]
-                    binds['fts_id'] = [str(fts_id[num])]
-                    binds['fail_reason'] = [reasons[num]]
-                    binds['retry_value'] = [int(retry[num])]
-                    self.api.modifynocheck(self.transferDB.UpdateTransfers_sql, **binds)
+                binds['id'] = ids
+                binds['transfer_state'] = [TRANSFERDB_STATUSES[state] for state in states[:len(ids)]]
+                binds['fts_instance'] = [str(instance) for instance in instances[:len(ids)]]
+                binds['fts_id'] = [str(ftsid) for ftsid in fts_id[:len(ids)]]
+                binds['fail_reason'] = reasons[:len(ids)]
+                binds['retry_value'] = [int(r) for r in retry[:len(ids)]]
+                self.bulkModify(self.api.modifynocheck, self.transferDB.UpdateTransfers_sql, binds)
             else:
                 ids = makeList(kwargs['list_of_ids'])
                 states = makeList(kwargs['list_of_transfer_state'])
@@ -173,14 +174,13 @@ class RESTFileTransfers(RESTEntity):
                 if kwargs['list_of_retry_value'] is not None:
                     reasons = makeList(kwargs['list_of_failure_reason'])
                     retry = makeList(kwargs['list_of_retry_value'])
-                for num in range(len(ids)):
-                    binds['id'] = [ids[num]]
-                    binds['transfer_state'] = [TRANSFERDB_STATUSES[states[num]]]
-                    binds['fts_instance'] = [None]
-                    binds['fts_id'] = [None]
-                    binds['fail_reason'] = [reasons[num]]
-                    binds['retry_value'] = [int(retry[num])]
-                    self.api.modifynocheck(self.transferDB.UpdateTransfers_sql, **binds)
+                binds['id'] = ids
+                binds['transfer_state'] = [TRANSFERDB_STATUSES[state] for state in states[:len(ids)]]
+                binds['fts_instance'] = [None]
+                binds['fts_id'] = [None]
+                binds['fail_reason'] = reasons[:len(ids)]
+                binds['retry_value'] = [int(r) for r in retry[:len(ids)]]
+                self.bulkModify(self.api.modifynocheck, self.transferDB.UpdateTransfers_sql, binds)
 
         elif subresource == 'updateRucioInfo':
             binds['last_update'] = [timeNow]
@@ -191,11 +191,10 @@ class RESTFileTransfers(RESTEntity):
                 blocknames = makeList(kwargs['list_of_dbs_blockname'])
             if kwargs['list_of_block_complete'] is not None:
                 blockcompletes = makeList(kwargs['list_of_block_complete'])
-            for num in range(len(ids)):
-                binds['id'] = [ids[num]]
-                binds['dbs_blockname'] = [blocknames[num]]
-                binds['block_complete'] = [blockcompletes[num]]
-                self.api.modifynocheck(self.transferDB.UpdateRucioInfo_sql, **binds)
+            binds['id'] = ids
+            binds['dbs_blockname'] = blocknames[:len(ids)]
+            binds['block_complete'] = blockcompletes[:len(ids)]
+            self.bulkModify(self.api.modifynocheck, self.transferDB.UpdateRucioInfo_sql, binds)
 
         elif subresource == 'updatePublication':
             ###############################################
@@ -208,6 +207,8 @@ class RESTFileTransfers(RESTEntity):
             # 2 items are required in list_of_ids. Keys:
             # (str) id: Document id which is in database.
             # (str) publication_state: publication_state which is one of: ['FAILED', 'DONE', 'RETRY']
+            # Returns one {'id': id, 'updated': number of rows updated} per id, 0 for the ids
+            # which could not be updated: one bad id does not prevent the others from being updated.
             # ---------------------------------------------
             # Always required variables:
             # (str) asoworker: ASO Worker name for which acquire Publication.
@@ -223,13 +224,13 @@ class RESTFileTransfers(RESTEntity):
             if kwargs['list_of_retry_value'] is not None:
                 reasons = makeList(kwargs['list_of_failure_reason'])
                 retry = makeList(kwargs['list_of_retry_value'])
-            for num in range(len(ids)):
-                binds['publication_state'] = [PUBLICATIONDB_STATUSES[states[num]]]
-                binds['id'] = [ids[num]]
-                binds['fail_reason'] = [reasons[num]]
-                binds['retry_value'] = [int(retry[num])]
-                binds['publish'] = [kwargs["publish_flag"] or -1]
-                self.api.modify(self.transferDB.UpdatePublication_sql, **binds)
+            binds['publication_state'] = [PUBLICATIONDB_STATUSES[state] for state in states[:len(ids)]]
+            binds['id'] = ids
+            binds['fail_reason'] = reasons[:len(ids)]
+            binds['retry_value'] = [int(r) for r in retry[:len(ids)]]
+            binds['publish'] = [kwargs["publish_flag"] or -1]
+            counts = self.bulkModify(self.api.modifyperrow, self.transferDB.UpdatePublication_sql, binds)
+            return [{'id': oneId, 'updated': count} for oneId, count in zip(ids, counts)]
 
         elif subresource == 'retryPublication':
             ###############################################
@@ -290,6 +291,29 @@ class RESTFileTransfers(RESTEntity):
                 binds['new_transfer_state'] = [TRANSFERDB_STATUSES['KILL']]
                 self.api.modify(self.transferDB.KillTransfers_sql, **binds)
 
+    def bulkModify(self, method, sql, binds):
+        """ Execute sql for all the rows described by binds with array-bound executemany
+            calls of at most self.bulkChunkSize rows each, instead of one call per row.
+
+            :arg method: self.api.modify, self.api.modifynocheck or self.api.modifyperrow
+            :arg str sql: the SQL statement
+            :arg dict binds: bind name -> list of values, one per row. The number of rows
+                             is the length of binds['id'], lists with a single element
+                             are used for all rows.
+            :return: with modifyperrow, the number of rows modified by each row of binds
+                     (0 if it failed), else an empty list
+        """
+        nRows = len(binds['id'])
+        rowBinds = {k: v * nRows if len(v) == 1 else v for k, v in binds.items()}
+        counts = []
+        for start in range(0, nRows, self.bulkChunkSize):
+            chunk = {k: v[start:start + self.bulkChunkSize] for k, v in rowBinds.items()}
+            if method == self.api.modifyperrow:  # pylint: disable=comparison-with-callable
+                counts += method(sql, [dict(zip(chunk, row)) for row in zip(*chunk.values())])
+            else:
+                method(sql, **chunk)
+        return counts
+
     @restcall
     def get(self, subresource, username, vogroup, vorole, taskname, destination, source, asoworker, grouping, limit):
         """ Retrieve all docs from DB for specific parameters.
@@ -4,7 +4,7 @@
 
 from __future__ import print_function
 # WMCore dependecies here
-from WMCore.REST.Server import RESTEntity, restcall
+from WMCore.REST.Server import RESTEntity, RESTArgs, restcall
 from WMCore.REST.Validation import validate_str, validate_num, validate_strlist
 from WMCore.REST.Error import InvalidParameter, UnsupportedMethod
 
@@ -15,6 +15,7 @@ from CRABInterface.Regexps import RX_USERNAME, RX_TASKNAME, RX_SUBGETUSERTRANSFE
 
 from ServerUtilities import TRANSFERDB_STATUSES, PUBLICATIONDB_STATUSES
 # external dependecies here
+import json
 import time
 import logging
 
@@ -37,30 +38,7 @@ class RESTFileUserTransfers(RESTEntity):
         if method in ['PUT']:
             # P.S. Validation is done in function and it double check if all required keys are available
             print(param, safe)
-            validate_str("id", param, safe, RX_ANYTHING, optional=False)
-            validate_str("username", param, safe, RX_ANYTHING, optional=False)
-            validate_str("taskname", param, safe, RX_ANYTHING, optional=False)
-            validate_str("destination", param, safe, RX_ANYTHING, optional=False)
-            validate_str("destination_lfn", param, safe, RX_ANYTHING, optional=False)
-            validate_str("source", param, safe, RX_ANYTHING, optional=False)
-            validate_str("source_lfn", param, safe, RX_ANYTHING, optional=False)
-            validate_num("filesize", param, safe, optional=False)
-            validate_num("publish", param, safe, optional=False)
-            validate_str("job_id", param, safe, RX_JOBID, optional=False)
-            validate_num("job_retry_count", param, safe, optional=False)
-            validate_str("type", param, safe, RX_ANYTHING, optional=False)
-            validate_str("asoworker", param, safe, RX_ANYTHING, optional=True)
-            validate_num("transfer_retry_count", param, safe, optional=True)
-            validate_num("transfer_max_retry_count", param, safe, optional=True)
-            validate_num("publication_retry_count", param, safe, optional=True)
-            validate_num("publication_max_retry_count", param, safe, optional=True)
-            validate_num("start_time", param, safe, optional=False)
-            validate_str("dbs_blockname", param, safe, RX_BLOCK, optional=True)
-            validate_str("block_complete", param, safe, RX_STATUS, optional=True)
-            validate_str("transfer_state", param, safe, RX_ANYTHING, optional=False)
-            validate_str("publication_state", param, safe, RX_ANYTHING, optional=False)
-            validate_str("fts_id", param, safe, RX_ANYTHING, optional=True)
-            validate_str("fts_instance", param, safe, RX_ANYTHING, optional=True)
+            self.validateTransferDoc(param, safe)
         if method in ['POST']:
             # POST is for update, so we should allow anyone anything?
             # as of Feb 2023 this is only used inside PostJob
@@ -78,11 +56,19 @@ class RESTFileUserTransfers(RESTEntity):
             validate_num("transfer_retry_count", param, safe, optional=True)
             validate_str("dbs_blockname", param, safe, RX_BLOCK, optional=True)
             validate_str("block_complete", param, safe, RX_STATUS, optional=True)
-            validate_num("publish", param, safe, optional=False)
+            validate_num("publish", param, safe, optional=(safe.kwargs['subresource'] in ['upsertDocs', 'getByIds']))
             validate_str("publication_state", param, safe, RX_ANYTHING, optional=True)
             validate_str("job_id", param, safe, RX_JOBID, optional=True)
             validate_num("job_retry_count", param, safe, optional=True)
             validate_strlist("listOfIds", param, safe, RX_ANYTHING)  # Interesting... TODO. Have optional in strlist
+            # getByIds is a POST only to have the ids in the body, the URL would be too long
+            validate_strlist("ids", param, safe, RX_TASKNAME)
+            if len(safe.kwargs['ids']) > self.transferDB.MaxIdsInList:
+                raise InvalidParameter("Too many ids: %d, the maximum is %d" % (len(safe.kwargs['ids']), self.transferDB.MaxIdsInList))
+            if safe.kwargs['subresource'] == 'upsertDocs':
+                self.validateTransferDocs(param, safe)
+            else:
+                safe.kwargs['docs'] = None
         elif method in ['GET']:
             validate_str("subresource", param, safe, RX_SUBGETUSERTRANSFER, optional=False)
             validate_str("id", param, safe, RX_TASKNAME, optional=True)
@@ -91,6 +77,132 @@ class RESTFileUserTransfers(RESTEntity):
         elif method in ['DELETE']:
             raise UnsupportedMethod('This method is not supported in this API!')
 
+    @staticmethod
+    def validateTransferDoc(param, safe):
+        """Validate the parameters of a new file transfer document, as sent with a PUT"""
+        validate_str("id", param, safe, RX_ANYTHING, optional=False)
+        validate_str("username", param, safe, RX_ANYTHING, optional=False)
+        validate_str("taskname", param, safe, RX_ANYTHING, optional=False)
+        validate_str("destination", param, safe, RX_ANYTHING, optional=False)
+        validate_str("destination_lfn", param, safe, RX_ANYTHING, optional=False)
+        validate_str("source", param, safe, RX_ANYTHING, optional=False)
+        validate_str("source_lfn", param, safe, RX_ANYTHING, optional=False)
+        validate_num("filesize", param, safe, optional=False)
+        validate_num("publish", param, safe, optional=False)
+        validate_str("job_id", param, safe, RX_JOBID, optional=False)
+        validate_num("job_retry_count", param, safe, optional=False)
+        validate_str("type", param, safe, RX_ANYTHING, optional=False)
+        validate_str("asoworker", param, safe, RX_ANYTHING, optional=True)
+        validate_num("transfer_retry_count", param, safe, optional=True)
+        validate_num("transfer_max_retry_count", param, safe, optional=True)
+        validate_num("publication_retry_count", param, safe, optional=True)
+        validate_num("publication_max_retry_count", param, safe, optional=True)
+        validate_num("start_time", param, safe, optional=False)
+        validate_str("dbs_blockname", param, safe, RX_BLOCK, optional=True)
+        validate_str("block_complete", param, safe, RX_STATUS, optional=True)
+        validate_str("transfer_state", param, safe, RX_ANYTHING, optional=False)
+        validate_str("publication_state", param, safe, RX_ANYTHING, optional=False)
+        validate_str("fts_id", param, safe, RX_ANYTHING, optional=True)
+        validate_str("fts_instance", param, safe, RX_ANYTHING, optional=True)
+
+    def validateTransferDocs(self, param, safe):
+        """Validate the 'docs' parameter of the upsertDocs subresource: a JSON list of file
+           transfer documents, each one with the same parameters as a PUT and validated in the
+           same way. The validated documents go in safe.kwargs['docs']. Errors tell which
+           document is wrong.
+        """
+        try:
+            docs = json.loads(param.kwargs.pop('docs', None) or 'null')
+        except ValueError as ex:
+            raise InvalidParameter("The docs parameter is not valid JSON") from ex
+        if not isinstance(docs, list) or not docs:
+            raise InvalidParameter("The docs parameter must be a non empty list of documents")
+        if len(docs) > self.transferDB.MaxIdsInList:
+            raise InvalidParameter("Too many documents: %d, the maximum is %d" % (len(docs), self.transferDB.MaxIdsInList))
+        validated = []
+        for n, doc in enumerate(docs):
+            if not isinstance(doc, dict):
+                raise InvalidParameter("Document %d is not a dictionary" % n)
+            docParam = RESTArgs([], doc)
+            docSafe = RESTArgs([], {})
+            docId = doc.get('id')
+            try:
+                self.validateTransferDoc(docParam, docSafe)
+            except InvalidParameter as ex:
+                raise InvalidParameter("Document %d (%s): %s" % (n, docId, ex.info)) from ex
+            if docParam.kwargs:
+                raise InvalidParameter("Document %d (%s): unexpected parameters %s" % (n, docId, list(docParam.kwargs)))
+            validated.append(docSafe.kwargs)
+        safe.kwargs['docs'] = validated
+
+    def newTransferBinds(self, doc):
+        """ The binds of the AddNewFileTransfer_sql statement for a validated document """
+        binds = {}
+        for key in ['id', 'username', 'taskname', 'destination', 'destination_lfn',
+                    'source', 'source_lfn', 'filesize', 'publish', 'start_time',
+                    'job_id', 'job_retry_count', 'type', 'dbs_blockname', 'block_complete']:
+            binds[key] = doc[key]
+        # Make a change to a number for TRANSFER_STATE and PUBLICATION_STATE
+        binds['publication_state'] = PUBLICATIONDB_STATUSES[doc['publication_state']]
+        binds['transfer_state'] = TRANSFERDB_STATUSES[doc['transfer_state']]
+        # Optional Keys. If they are not set by document submitter, it will use default 2
+        for key in ['transfer_max_retry_count', 'publication_max_retry_count']:
+            binds[key] = doc.get(key) or 2
+        binds['last_update'] = int(time.time())
+        return binds
+
+    def upsertDocs(self, docs):
+        """ Insert the documents which are not in the database yet and update the others, as a PUT
+            or an updateDoc POST would, then set tm_aso_worker of the documents which have an
+            asoworker, as an updateTransfers POST to filetransfers would (the other two reset it).
+            One query finds the documents which exist, then each statement is run once for all
+            documents, a document which fails does not make the others fail.
+
+            :return: a list of {'id': id, 'result': 'inserted', 'updated' or 'failed', 'error': message}
+                     dictionaries, one per document, in the same order of docs.
+        """
+        ids = [doc['id'] for doc in docs]
+        binds = dict(('id%d' % i, docId) for i, docId in enumerate(set(ids)))
+        existing = set(row[0] for row in self.api.query_load_all_rows(None, None, self.transferDB.getIdListSql(len(binds)), **binds))
+        results = [{'id': docId, 'result': 'updated' if docId in existing else 'inserted', 'error': None} for docId in ids]
+        now = int(time.time())
+
+        newDocs = [n for n, docId in enumerate(ids) if docId not in existing]
+        errors = []
+        counts = self.api.modifyperrow(self.transferDB.AddNewFileTransfer_sql,
+                                       [self.newTransferBinds(docs[n]) for n in newDocs], errors=errors)
+        oldDocs = [n for n, docId in enumerate(ids) if docId in existing]
+        updateBinds = []
+        for n in oldDocs:
+            binds = dict((key, docs[n][key]) for key in ['id', 'taskname', 'username', 'start_time', 'source',
+                                                         'source_lfn', 'filesize', 'dbs_blockname', 'block_complete',
+                                                         'publish', 'transfer_retry_count', 'job_id', 'job_retry_count'])
+            binds['transfer_state'] = TRANSFERDB_STATUSES[docs[n]['transfer_state']]
+            binds['publication_state'] = PUBLICATIONDB_STATUSES[docs[n]['publication_state']]
+            binds['last_update'] = now
+            updateBinds.append(binds)
+        updateErrors = []
+        counts += self.api.modifyperrow(self.transferDB.UpdateUserTransfersById_sql, updateBinds, errors=updateErrors)
+        errors += [(len(newDocs) + offset, message) for offset, message in updateErrors]
+        messages = dict(errors)
+        for offset, (n, count) in enumerate(zip(newDocs + oldDocs, counts)):
+            if not count:
+                results[n]['result'] = 'failed'
+                results[n]['error'] = messages.get(offset, 'no row modified')
+
+        workerDocs = [n for n, doc in enumerate(docs) if doc.get('asoworker') and results[n]['result'] != 'failed']
+        workerBinds = [{'id': ids[n], 'transfer_state': TRANSFERDB_STATUSES[docs[n]['transfer_state']],
+                        'last_update': now, 'asoworker': docs[n]['asoworker'], 'fail_reason': '',
+                        'retry_value': 0, 'fts_id': None, 'fts_instance': None} for n in workerDocs]
+        workerErrors = []
+        counts = self.api.modifyperrow(self.transferDB.UpdateTransfers_sql, workerBinds, errors=workerErrors)
+        messages = dict(workerErrors)
+        for offset, (n, count) in enumerate(zip(workerDocs, counts)):
+            if not count:
+                results[n]['result'] = 'failed'
+                results[n]['error'] = "asoworker not set: %s" % messages.get(offset, 'no row modified')
+        return results
+
     @restcall
     def put(self, **kwargs):
         """ Insert a new file transfer in database. It raises an error if you try to upload
@@ -119,39 +231,56 @@ class RESTFileUserTransfers(RESTEntity):
         # job_retry_count: Job run retry count
         ## type: Job output type
         ###############################################
-        # Also we need to ensure that specific variables are defined which are needed to store
-        binds = {}
-        for key in ['id', 'username', 'taskname', 'destination', 'destination_lfn',
-                    'source', 'source_lfn', 'filesize', 'publish', 'start_time',
-                    'job_id', 'job_retry_count', 'type', 'dbs_blockname', 'block_complete']:
-            binds[key] = [kwargs[key]]
-            del kwargs[key]
-        # Make a change to a number for TRANSFER_STATE and PUBLICATION_STATE
-        binds['publication_state'] = [PUBLICATIONDB_STATUSES[kwargs['publication_state']]]
-        binds['transfer_state'] = [TRANSFERDB_STATUSES[kwargs['transfer_state']]]
-        # Optional Keys. If they are not set by document submitter, it will use default 2
-        for key in ['transfer_max_retry_count', 'publication_max_retry_count']:
-            if key in kwargs and kwargs[key]:
-                binds[key] = [kwargs[key]]
-            else:
-                binds[key] = [2]
+        # Also we need to ensure that specific variables are defined which are needed to store.
         # TODO for future, we could also allow custom FTS instance, which is one of the things Andrew asked.
         # I foresee to be it nice feature.
         # Also this could be moved into rest configuration as it would be controlled by crab and not ASO.
         # ASO would do only its jobs by submitting and making some clever decisions on transfers
         # Also we add last update key to current timestamp.
-        binds['last_update'] = [int(time.time())]
+        binds = dict((key, [value]) for key, value in self.newTransferBinds(kwargs).items())
         self.api.modify(self.transferDB.AddNewFileTransfer_sql, **binds)
         return []
 
 
     @restcall
     def post(self, subresource, id, username, taskname, start_time, source, source_lfn, filesize,
-             transfer_state, transfer_retry_count, dbs_blockname, block_complete, publish, publication_state, job_id, job_retry_count, listOfIds):
+             transfer_state, transfer_retry_count, dbs_blockname, block_complete, publish, publication_state, job_id, job_retry_count, listOfIds,
+             docs, ids):
         """This is used for user to allow kill transfers for specific task, retryPublication or retryTransfers.
-            So far we do not allow retryPublications or retryTransfers for themselfs."""
+            So far we do not allow retryPublications or retryTransfers for themselfs.
+            With subresource=upsertDocs, PostJob inserts or updates all the documents of a job at once.
+            With subresource=getByIds, PostJob retrieves all the documents of a job at once."""
         binds = {}
         binds['last_update'] = [int(time.time())]
+        if subresource == 'getByIds':
+            ###############################################
+            # getByIds API
+            # ---------------------------------------------
+            # Description:
+            # Same as the getById GET for a list of documents, e.g. all documents of a job.
+            # A POST only to have the ids in the body. Ids which are not in database are
+            # simply not in the result.
+            # ---------------------------------------------
+            # Always required variables:
+            # ids: list of ids (at most 1000)
+            ###############################################
+            if not ids:
+                raise InvalidParameter('ids is not defined')
+            binds = dict(('id%d' % i, docId) for i, docId in enumerate(ids))
+            return self.api.query(None, None, self.transferDB.getByIdListSql(len(ids)), **binds)
+        if subresource == 'upsertDocs':
+            ###############################################
+            # upsertDocs API
+            # ---------------------------------------------
+            # Description:
+            # PostJob calls this API with all the documents of a job, instead of a PUT
+            # or an updateDoc POST, and a filetransfers updateTransfers POST, for each of them.
+            # ---------------------------------------------
+            # Always required variables:
+            # docs: JSON list of documents with the same keys as a PUT, plus optional
+            #       transfer_retry_count and asoworker
+            ###############################################
+            return self.upsertDocs(docs)
         if subresource == 'updateDoc':
             binds['id'] = [id]
             binds['taskname'] = [taskname]
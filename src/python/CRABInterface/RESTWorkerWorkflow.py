@@ -35,6 +35,9 @@ class RESTWorkerWorkflow(RESTEntity):
             validate_str("workflow", param, safe, RX_TASKNAME, optional=True)
             validate_str("status", param, safe, RX_STATUS, optional=True)
             validate_str("command", param, safe, RX_STATUS, optional=True)
+            validate_strlist("workflows", param, safe, RX_TASKNAME)
+            validate_strlist("statuses", param, safe, RX_STATUS)
+            validate_strlist("commands", param, safe, RX_STATUS)
             validate_str("getstatus", param, safe, RX_STATUS, optional=True)
             validate_str("failure", param, safe, RX_MANYLINES_SHORT, optional=True)
             validate_strlist("resubmittedjobs", param, safe, RX_JOBID)
@@ -49,6 +52,7 @@ class RESTWorkerWorkflow(RESTEntity):
             # 4) taskname + status == (1)
             # 5)            status + limit + getstatus + workername
             # 6) taskname + runs + lumis
+            # 7) workflows + statuses + commands (bulkstate)
         elif method in ['GET']:
             validate_str("workername", param, safe, RX_WORKER_NAME, optional=True)
             validate_str("getstatus", param, safe, RX_STATUS, optional=True)
@@ -59,8 +63,11 @@ class RESTWorkerWorkflow(RESTEntity):
 
 
     @restcall
-    def post(self, workflow, status, command, subresource, failure, resubmittedjobs, getstatus, workername, limit, clusterid):
+    def post(self, workflow, status, command, workflows, statuses, commands, subresource, failure, resubmittedjobs,
+             getstatus, workername, limit, clusterid):
         """ Updates task information """
+        if subresource == 'bulkstate':
+            return self.bulkstate(workflows, statuses, commands)
         methodmap = {"state": {"args": (self.Task.SetStatusTask_sql,), "method": self.api.modify, "kwargs": {"status": [status],
                      "command": [command], "taskname": [workflow]}},
                      #TODO MM - I don't see where this start API is used
@@ -82,6 +89,22 @@ class RESTWorkerWorkflow(RESTEntity):
         methodmap[subresource]['method'](*methodmap[subresource]['args'], **methodmap[subresource]['kwargs'])
         return []
 
+    def bulkstate(self, workflows, statuses, commands):
+        """ Set status and command of many tasks with a single array-bound statement.
+            The i-th task gets the i-th status and command. Tasks that could not be
+            updated are reported as such and do not make the whole request fail.
+
+            :return: list of {'workflow': taskname, 'updated': bool} in the same order of workflows
+        """
+        if not workflows:
+            raise InvalidParameter("No workflows specified for the bulkstate subresource")
+        if len(statuses) != len(workflows) or len(commands) != len(workflows):
+            raise InvalidParameter("workflows, statuses and commands must have the same length")
+        binds = [{'status': status, 'command': command, 'taskname': workflow}
+                 for workflow, status, command in zip(workflows, statuses, commands)]
+        counts = self.api.modifyperrow(self.Task.SetStatusTask_sql, binds)
+        return [{'workflow': workflow, 'updated': count > 0} for workflow, count in zip(workflows, counts)]
+
     @restcall
     def get(self, workername, getstatus, limit):
         """ Retrieve all columns for a specified task or
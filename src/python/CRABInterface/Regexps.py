@@ -105,7 +105,11 @@ RX_DATE = re.compile(r"^(19|20)\d\d[- /.](0[1-9]|1[012])[- /.](0[1-9]|[12][0-9]|
 ## user dn
 RX_DN = re.compile(r"^/(?:C|O|DC)=.*/CN=.")
 ## worker subresources
-RX_SUBPOSTWORKER = re.compile(r"^(state|start|failure|success|process|lumimask)$")
+RX_SUBPOSTWORKER = re.compile(r"^(state|bulkstate|start|failure|success|process|lumimask)$")
+
+## filemetadata subresources
+RX_SUBPOSTFILEMETADATA = re.compile(r"^(changestate|getbylfns|bulkinject|migrate)$")
+RX_LUMIFORMAT = re.compile(r"^(lumis|ranges)$")
 
 # Schedulers
 RX_SCHEDULER = re.compile(r"^(condor)$")
@@ -139,7 +143,7 @@ RX_PUBLISH_STATE = re.compile(r"^[01234]")
 RX_ASO_WORKERNAME = RX_WORKER_NAME
 
 RX_SUBGETUSERTRANSFER = re.compile(r"^(getById|getTransferStatus|getPublicationStatus)$")
-RX_SUBPOSTUSERTRANSFER = re.compile(r"^(killTransfers|retryPublication|retryTransfers|killTransfersById|updateDoc)$")
+RX_SUBPOSTUSERTRANSFER = re.compile(r"^(killTransfers|retryPublication|retryTransfers|killTransfersById|updateDoc|upsertDocs|getByIds)$")
 
 # CUDAVersion style,  i.e. 11.4, 515.43.04
 RX_CUDA_VERSION = re.compile(r"^\d+\.\d+(\.\d+)?$")
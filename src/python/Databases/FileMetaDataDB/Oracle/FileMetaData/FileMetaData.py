@@ -95,6 +95,43 @@ class FileMetaData(object):
                     AND fmd_lfn = :lfn 
              """
 
+    # same as GetFromTaskAndLfn_sql for many LFNs at once. The %s placeholder must be replaced with the
+    # list of the LFN bind variables names, e.g. ':lfn0, :lfn1, :lfn2', see getFromTaskAndLfnListSql()
+    GetFromTaskAndLfnList_sql = """SELECT \
+                           job_id AS jobid, \
+                           fmd_outdataset AS outdataset, \
+                           fmd_acq_era AS acquisitionera, \
+                           fmd_sw_ver AS swversion, \
+                           fmd_in_events AS inevents, \
+                           fmd_global_tag AS globaltag, \
+                           fmd_publish_name AS publishname, \
+                           fmd_location AS location, \
+                           fmd_tmp_location AS tmplocation, \
+                           fmd_runlumi AS runlumi, \
+                           fmd_adler32 AS adler32, \
+                           fmd_cksum AS cksum, \
+                           fmd_md5 AS md5, \
+                           fmd_lfn AS lfn, \
+                           fmd_size AS filesize, \
+                           fmd_parent AS parents, \
+                           fmd_filestate AS state, \
+                           fmd_creation_time AS created, \
+                           fmd_tmplfn AS tmplfn, \
+                           fmd_type AS type, \
+                           fmd_direct_stageout AS directstageout
+                    FROM filemetadata \
+                    WHERE tm_taskname = :taskname \
+                    AND fmd_lfn IN (%s)
+             """
+
+    # Oracle does not allow more than 1000 elements in an IN list
+    MaxLfnsInList = 1000
+
+    @classmethod
+    def getFromTaskAndLfnListSql(cls, nLfns):
+        """ Return the GetFromTaskAndLfnList_sql query with nLfns bind variables named lfn0, lfn1, ... """
+        return cls.GetFromTaskAndLfnList_sql % ', '.join(':lfn%d' % i for i in range(nLfns))
+
     New_sql = "INSERT INTO filemetadata ( \
                tm_taskname, job_id, fmd_outdataset, fmd_acq_era, fmd_sw_ver, fmd_in_events, fmd_global_tag,\
                fmd_publish_name, fmd_location, fmd_tmp_location, fmd_runlumi, fmd_adler32, fmd_cksum, fmd_md5, fmd_lfn, fmd_size,\
@@ -106,8 +143,31 @@ class FileMetaData(object):
     Update_sql = """UPDATE filemetadata SET fmd_tmp_location = :outtmplocation, fmd_size = :outsize, fmd_tmplfn = :outtmplfn \
                     WHERE tm_taskname = :taskname AND fmd_lfn = :outlfn"""
 
+    # used to migrate runlumi and parents from python literals to JSON, see DataFileMetadata.migrate:
+    # find up to :howmany files still in the legacy format (runlumi starting with {') which come after
+    # (:aftertask, :afterlfn), then rewrite them. Paging on the key makes sure that files which can
+    # not be migrated are not selected again and again
+    GetLegacyRunLumi_sql = """SELECT tm_taskname, fmd_lfn, fmd_runlumi, fmd_parent FROM ( \
+                                  SELECT tm_taskname, fmd_lfn, fmd_runlumi, fmd_parent FROM filemetadata \
+                                  WHERE DBMS_LOB.SUBSTR(fmd_runlumi, 2, 1) = '{''' \
+                                  AND (:aftertask IS NULL OR tm_taskname > :aftertask \
+                                       OR (tm_taskname = :aftertask AND fmd_lfn > :afterlfn)) \
+                                  ORDER BY tm_taskname, fmd_lfn) \
+                              WHERE rownum <= :howmany"""
+
+    UpdateRunLumiParents_sql = """UPDATE filemetadata SET fmd_runlumi = :runlumi, fmd_parent = :parents \
+                                  WHERE tm_taskname = :taskname AND fmd_lfn = :lfn"""
+
     #the field selected here is not used, the query is only executed to check if a filemetadata for the file was already uploaded or not
     GetCurrent_sql = "SELECT fmd_lfn from filemetadata WHERE tm_taskname = :taskname AND fmd_lfn = :outlfn"
 
+    # same as GetCurrent_sql for many LFNs at once, see getCurrentListSql()
+    GetCurrentList_sql = "SELECT fmd_lfn from filemetadata WHERE tm_taskname = :taskname AND fmd_lfn IN (%s)"
+
+    @classmethod
+    def getCurrentListSql(cls, nLfns):
+        """ Return the GetCurrentList_sql query with nLfns bind variables named lfn0, lfn1, ... """
+        return cls.GetCurrentList_sql % ', '.join(':lfn%d' % i for i in range(nLfns))
+
     DeleteTaskFiles_sql = "DELETE FROM filemetadata WHERE tm_taskname = :taskname"
     DeleteFilesByTime_sql = "DELETE FROM filemetadata WHERE fmd_creation_time < sysdate - (:hours/24)"
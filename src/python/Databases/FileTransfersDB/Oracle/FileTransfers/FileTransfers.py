@@ -265,6 +265,25 @@ class FileTransfers():
                    tm_last_update, tm_start_time, tm_end_time, tm_dbs_blockname, tm_block_complete \
                    FROM filetransfersdb where tm_id = :id"
 
+    # same as GetById_sql for many ids at once, see getByIdListSql()
+    GetByIdList_sql = GetById_sql.replace("tm_id = :id", "tm_id IN (%s)")
+
+    # only tells which ids are in the table
+    GetIdList_sql = "SELECT tm_id FROM filetransfersdb WHERE tm_id IN (%s)"
+
+    # Oracle does not allow more than 1000 elements in an IN list
+    MaxIdsInList = 1000
+
+    @classmethod
+    def getByIdListSql(cls, nIds):
+        """ Return the GetByIdList_sql query with nIds bind variables named id0, id1, ... """
+        return cls.GetByIdList_sql % ', '.join(':id%d' % i for i in range(nIds))
+
+    @classmethod
+    def getIdListSql(cls, nIds):
+        """ Return the GetIdList_sql query with nIds bind variables named id0, id1, ... """
+        return cls.GetIdList_sql % ', '.join(':id%d' % i for i in range(nIds))
+
 # As jobs can be retried we should look only at the last ones. For that specific case this needs to be relooked.
     GetTaskStatusForTransfers_sql = "SELECT tm_id, tm_jobid, tm_transfer_state, tm_start_time, \
                                      tm_last_update, tm_fts_id, tm_fts_instance, tm_aso_worker \
@@ -31,6 +31,9 @@ def format_file_3(file_):
           }
     file_lumi_list = []
     for run, lumis in file_['runlumi'].items():
+        if isinstance(lumis, list):
+            # lumi ranges [[firstLumi, lastLumi], ...]
+            lumis = [lumi for first, last in lumis for lumi in range(first, last + 1)]
         for lumi in lumis:
             file_lumi_list.append({'lumi_section_num': int(lumi), 'run_num': int(run)})
     nf['file_lumi_list'] = file_lumi_list
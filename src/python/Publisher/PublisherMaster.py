@@ -216,7 +216,7 @@ class Master(object):
         self.max_files_per_block = self.config.max_files_per_block
         self.crabServer = CRABRest(hostname=restHost, localcert=self.config.serviceCert,
                                    localkey=self.config.serviceKey, retry=3,
-                                   userAgent='CRABPublisher')
+                                   userAgent='CRABPublisher', pooled=getattr(self.config, 'pooledConnections', False))
         self.crabServer.setDbInstance(dbInstance=dbInstance)
         self.startTime = time.time()
 
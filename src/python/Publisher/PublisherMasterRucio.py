@@ -249,24 +249,26 @@ class Master():  # pylint: disable=too-many-instance-attributes
     def getInfoFromFMD(self, workflow, lfns, logger):
         """
         Download and read the files describing what needs to be published
-        do on a small number of LFNs at a time (numFilesAtOneTime) to avoid
-        hitting the URL length limit in CMSWEB/Apache
+        LFNs are sent in the body of a POST, numFilesAtOneTime at a time, to avoid
+        hitting the URL length limit in CMSWEB/Apache and the REST timeout
         input: lfns : a list of LFNs
         returns: a list of dictionaries, one per file, sorted by CRAB JobID
         """
         out = []
         dataDict = {}
         dataDict['taskname'] = workflow
+        dataDict['subresource'] = 'getbylfns'
+        dataDict['lumiformat'] = 'ranges'  # much smaller response, ranges are expanded in format_file_3
         i = 0
-        numFilesAtOneTime = 10
+        numFilesAtOneTime = getattr(self.config, 'fmdFilesInQuery', 1000)
         logger.debug('FMDATA: will retrieve data for %d files', len(lfns))
         while i < len(lfns):
-            dataDict['lfnList'] = lfns[i: i + numFilesAtOneTime]
-            data = encodeRequest(dataDict)
+            dataDict['lfns'] = lfns[i: i + numFilesAtOneTime]
+            data = encodeRequest(dataDict, listParams=['lfns'])
             i += numFilesAtOneTime
             try:
                 t1 = time.time()
-                res = self.crabServer.get(api='filemetadata', data=data)
+                res = self.crabServer.post(api='filemetadata', data=data)
                 # res is a 3-plu: (result, exit code, status)
                 res = res[0]
                 t2 = time.time()
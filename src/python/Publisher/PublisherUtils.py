@@ -98,30 +98,7 @@ def mark_good(files=None, crabServer=None, asoworker=None, logger=None):
 
     msg = f"Marking {len(files)} file(s) as published."
     logger.info(msg)
-
-    nMarked = 0
-    for lfn in files:
-        source_lfn = lfn
-        docId = getHashLfn(source_lfn)
-        data = {}
-        data['asoworker'] = asoworker
-        data['subresource'] = 'updatePublication'
-        data['list_of_ids'] = [docId]
-        data['list_of_publication_state'] = ['DONE']
-        data['list_of_retry_value'] = [1]
-        data['list_of_failure_reason'] = ['']
-
-        try:
-            result = crabServer.post(api='filetransfers', data=encodeRequest(data))
-            logger.debug("updated DocumentId: %s lfn: %s Result %s", docId, source_lfn, result)
-        except Exception as ex:
-            logger.error("Error updating status for DocumentId: %s lfn: %s", docId, source_lfn)
-            logger.error("Error reason: %s", ex)
-            logger.error("Error reason: %s", ex)
-
-        nMarked += 1
-        if nMarked % 10 == 0:
-            logger.info('marked %d files', nMarked)
+    updatePublicationState(files, crabServer, 'DONE', '', asoworker, logger)
 
 
 def mark_failed(files=None, crabServer=None, failure_reason="", asoworker=None, logger=None):
@@ -131,30 +108,63 @@ def mark_failed(files=None, crabServer=None, failure_reason="", asoworker=None,
     """
     msg = f"Marking {len(files)} file(s) as failed"
     logger.info(msg)
+    updatePublicationState(files, crabServer, 'FAILED', failure_reason, asoworker, logger)
 
-    nMarked = 0
-    for lfn in files:
-        source_lfn = lfn
-        docId = getHashLfn(source_lfn)
+
+def updatePublicationState(files, crabServer, state, failure_reason, asoworker, logger, chunkSize=200, maxWorkers=4):
+    """
+    Set the publication state of the files with one updatePublication call (which takes
+    lists of ids, states, retries and reasons) per chunk of chunkSize files, running up
+    to maxWorkers calls concurrently. The REST tells which ids it could not update, only
+    those are reported as failed. If the call for a chunk fails as a whole, the files of
+    that chunk are tried again one at a time, so that one bad file does not leave the
+    others unmarked.
+    files must be a list of SOURCE_LFN's i.e. /store/temp/user/...
+    """
+    # the REST splits the lists on commas, a comma in the reason would shift the other reasons
+    failure_reason = failure_reason.replace(',', ';')
+
+    def makeRequest(lfns):
         data = {}
         data['asoworker'] = asoworker
         data['subresource'] = 'updatePublication'
-        data['list_of_ids'] = [docId]
-        data['list_of_publication_state'] = ['FAILED']
-        data['list_of_retry_value'] = [1]
-        data['list_of_failure_reason'] = [failure_reason]
-
+        data['list_of_ids'] = [getHashLfn(lfn) for lfn in lfns]
+        data['list_of_publication_state'] = [state] * len(lfns)
+        data['list_of_retry_value'] = [1] * len(lfns)
+        data['list_of_failure_reason'] = [failure_reason] * len(lfns)
         logger.debug("data: %s ", data)
-        try:
-            result = crabServer.post(api='filetransfers', data=encodeRequest(data))
-            logger.debug("updated DocumentId: %s lfn: %s Result %s", docId, source_lfn, result)
-        except Exception as ex:
-            logger.error("Error updating status for DocumentId: %s lfn: %s", docId, source_lfn)
-            logger.error("Error reason: %s", ex)
-
-        nMarked += 1
-        if nMarked % 10 == 0:
-            logger.info('marked %d files', nMarked)
+        return ('POST', 'filetransfers', encodeRequest(data))
+
+    def notUpdated(result):
+        # one {'id': id, 'updated': count} per id, older REST versions return nothing
+        return set(item['id'] for item in result[0]['result'] if isinstance(item, dict) and not item.get('updated'))
+
+    chunks = [files[start:start + chunkSize] for start in range(0, len(files), chunkSize)]
+    results = crabServer.mapRequests([makeRequest(chunk) for chunk in chunks], maxWorkers=maxWorkers)
+
+    nMarked = 0
+    toRetry = []
+    for chunk, result in zip(chunks, results):
+        if isinstance(result, Exception):
+            logger.warning("Error updating status of %d files at once, trying them one at a time: %s", len(chunk), result)
+            toRetry.extend(chunk)
+            continue
+        logger.debug("updated %d documents, result %s", len(chunk), result)
+        failed = notUpdated(result)
+        for source_lfn in chunk:
+            if getHashLfn(source_lfn) in failed:
+                logger.error("Error updating status for DocumentId: %s lfn: %s", getHashLfn(source_lfn), source_lfn)
+            else:
+                nMarked += 1
+    results = crabServer.mapRequests([makeRequest([lfn]) for lfn in toRetry], maxWorkers=maxWorkers)
+    for source_lfn, result in zip(toRetry, results):
+        if isinstance(result, Exception) or notUpdated(result):
+            logger.error("Error updating status for DocumentId: %s lfn: %s", getHashLfn(source_lfn), source_lfn)
+            if isinstance(result, Exception):
+                logger.error("Error reason: %s", result)
+        else:
+            nMarked += 1
+    logger.info('marked %d files', nMarked)
 
 
 def getDBSInputInformation(taskname=None, crabServer=None):
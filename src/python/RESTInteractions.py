@@ -5,8 +5,12 @@ Handles client interactions with remote REST interface
 import os
 import time
 import random
+import threading
+import http.client
+from concurrent.futures import ThreadPoolExecutor
 
 from urllib.parse import quote as urllibQuote
+from urllib.parse import urlparse
 
 import logging
 from http.client import HTTPException
@@ -59,6 +63,133 @@ def terminalError(ex):
     return terminal
 
 
+class CurlPool(object):
+    """
+    A process wide pool of pycurl handles, keyed by (host, cert, key).
+    A curl easy handle keeps its connections alive, so taking it back from the
+    pool for the next request to the same host with the same credentials avoids
+    a new TCP connection and TLS handshake. On top of that all handles share
+    the DNS and TLS session caches via a CurlShare object, so that even new
+    connections can resume a previous TLS session.
+
+    Handles are used by one thread at a time (they are removed from the pool
+    while a request runs). After a fork the child starts with an empty pool and
+    never touches (nor closes) the handles, and connections, of the parent.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.share = None
+        self.idle = {}
+        self.stale = []
+        self.stats = {}
+        self._reset()
+
+    def _reset(self):
+        """ (re)initialize the pool for the current process """
+        if self.idle:
+            # handles inherited from the parent process: keep them referenced and untouched
+            self.stale.append(self.idle)
+        self.pid = os.getpid()
+        self.idle = {}
+        self.share = pycurl.CurlShare()
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_DNS)
+        self.share.setopt(pycurl.SH_SHARE, pycurl.LOCK_DATA_SSL_SESSION)
+        self.stats = {'requests': 0, 'handshakes': 0, 'reuses': 0, 'totalTime': 0., 'handshakeTime': 0.}
+
+    def acquire(self, poolKey):
+        """ return an idle curl handle for poolKey or a new one """
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            handles = self.idle.get(poolKey)
+            if handles:
+                curl = handles.pop()
+                curl.reset()
+                return curl
+            return pycurl.Curl()
+
+    def release(self, poolKey, curl):
+        """ put back the curl handle in the pool and update the counters """
+        connects = curl.getinfo(pycurl.NUM_CONNECTS)
+        totalTime = curl.getinfo(pycurl.TOTAL_TIME)
+        handshakeTime = curl.getinfo(pycurl.APPCONNECT_TIME) - curl.getinfo(pycurl.CONNECT_TIME) if connects else 0.
+        with self.lock:
+            if self.pid != os.getpid():
+                return
+            self.stats['requests'] += 1
+            self.stats['totalTime'] += totalTime
+            if connects:
+                self.stats['handshakes'] += connects
+                self.stats['handshakeTime'] += max(handshakeTime, 0.)
+            else:
+                self.stats['reuses'] += 1
+            self.idle.setdefault(poolKey, []).append(curl)
+
+    def discard(self, curl):
+        """ close a handle which failed, its connection may be in a bad state """
+        with self.lock:
+            if self.pid == os.getpid():
+                curl.close()
+
+    def getStats(self):
+        """ return a copy of the counters for this process, including the average latency per request """
+        with self.lock:
+            if self.pid != os.getpid():
+                self._reset()
+            stats = dict(self.stats)
+        stats['avgTime'] = stats['totalTime'] / stats['requests'] if stats['requests'] else 0.
+        return stats
+
+
+CURL_POOL = CurlPool()
+
+
+class PooledRequestHandler(RequestHandler):
+    """
+    A WMCore RequestHandler which takes its curl handles from CURL_POOL instead
+    of creating (and closing) a new one, i.e. a new connection, for every request.
+    """
+
+    def request(self, url, params, headers=None, verb='GET', verbose=0, ckey=None, cert=None, capath=None,
+                doseq=True, encode=False, decode=False, cainfo=None, cookie=None):
+        """ Same as RequestHandler.request but using a pooled curl handle """
+        poolKey = (urlparse(url).netloc, cert, ckey)
+        curl = CURL_POOL.acquire(poolKey)
+        try:
+            bbuf, hbuf = self.set_opts(curl, url, params, headers, ckey, cert, capath,
+                                       verbose, verb, doseq, encode, cainfo, cookie)
+            curl.setopt(pycurl.SHARE, CURL_POOL.share)
+            curl.setopt(pycurl.FORBID_REUSE, 0)
+            curl.perform()
+        except Exception:
+            CURL_POOL.discard(curl)
+            raise
+        CURL_POOL.release(poolKey, curl)
+        header = self.parse_header(hbuf.getvalue())
+        if header.status < 300:
+            data = '' if verb == 'HEAD' else self.parse_body(bbuf.getvalue(), decode)
+        else:
+            data = bbuf.getvalue()
+            msg = 'url=%s, code=%s, reason=%s, headers=%s, result=%s' % (url, header.status, header.reason, header.header, data)
+            exc = http.client.HTTPException(msg)
+            setattr(exc, 'req_data', params)
+            setattr(exc, 'req_headers', headers)
+            setattr(exc, 'url', url)
+            setattr(exc, 'result', data)
+            setattr(exc, 'status', header.status)
+            setattr(exc, 'reason', header.reason)
+            setattr(exc, 'headers', header.header)
+            raise exc
+        return header, data
+
+
+def getPoolStats():
+    """ Return the counters (requests, handshakes, reuses, latency) of the pooled HTTPS transport in this process """
+    return CURL_POOL.getStats()
+
+
 class HTTPRequests(dict):
     """
     This code is a simplified version of WMCore.Services.Requests - we don't
@@ -73,9 +204,11 @@ class HTTPRequests(dict):
     """
 
     def __init__(self, hostname='localhost', localcert=None, localkey=None, version=__version__,
-                 retry=0, logger=None, verbose=False, userAgent='CRAB?'):
+                 retry=0, logger=None, verbose=False, userAgent='CRAB?', pooled=False):
         """
         Initialise an HTTP handler
+        If pooled is True, connections are kept alive and reused across requests
+        (and across HTTPRequests objects) of this process, see CurlPool
         """
         dict.__init__(self)
         #set up defaults
@@ -95,6 +228,7 @@ class HTTPRequests(dict):
                 self['host'] = self['host'].replace(".cern.ch", ".cern.ch:8443", 1)
         self.setdefault("cert", localcert)
         self.setdefault("key", localkey)
+        self.setdefault("pooled", pooled)
         # get the URL opener
         self.setdefault("conn", self.getUrlOpener())
         self.setdefault("version", version)
@@ -109,6 +243,8 @@ class HTTPRequests(dict):
         that a sub class can override it to have different type of connection
         i.e. - if it needs authentication, or some fancy handler
         """
+        if self['pooled']:
+            return PooledRequestHandler(config={'timeout': 300, 'connecttimeout' : 300})
         return RequestHandler(config={'timeout': 300, 'connecttimeout' : 300})
 
     def get(self, uri=None, data=None):
@@ -231,9 +367,9 @@ class CRABRest:
     Add two methods to set and get the DB instance
     """
     def __init__(self, hostname='localhost', localcert=None, localkey=None, version=__version__,
-                 retry=0, logger=None, verbose=False, userAgent='CRAB?'):
+                 retry=0, logger=None, verbose=False, userAgent='CRAB?', pooled=False):
         self.server = HTTPRequests(hostname, localcert, localkey, version,
-                                   retry, logger, verbose, userAgent)
+                                   retry, logger, verbose, userAgent, pooled)
         instance = 'prod'
         self.uriNoApi = '/crabserver/' + instance + '/'
 
@@ -258,3 +394,27 @@ class CRABRest:
     def delete(self, api=None, data=None):
         uri = self.uriNoApi + api
         return self.server.delete(uri, data)
+
+    def mapRequests(self, requests, maxWorkers=8):
+        """
+        Run a batch of requests concurrently using up to maxWorkers threads.
+        Each request is retried as in HTTPRequests.makeRequest.
+
+        :arg list requests: list of (verb, api, data) tuples, verb being one of
+                            'GET', 'POST', 'PUT', 'DELETE'
+        :arg int maxWorkers: maximum number of requests in flight at the same time
+        :return: a list with one element per request, in the same order of the input:
+                 the (result, status, reason) tuple returned by the request, or the
+                 exception it raised
+        """
+        def runRequest(request):
+            verb, api, data = request
+            try:
+                return self.server.makeRequest(uri=self.uriNoApi + api, data=data, verb=verb)
+            except Exception as ex:  # pylint: disable=broad-except
+                return ex
+
+        if not requests:
+            return []
+        with ThreadPoolExecutor(max_workers=max(1, min(maxWorkers, len(requests)))) as executor:
+            return list(executor.map(runRequest, requests))
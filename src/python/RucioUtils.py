@@ -1,4 +1,7 @@
 """ a small set of utilities to work with Rucio used in various places """
+import os
+import json
+import time
 import logging
 
 from TaskWorker.WorkerExceptions import TaskWorkerException
@@ -93,3 +96,70 @@ def getWritePFN(rucioClient=None, siteName='', lfn='',  # pylint: disable=danger
     logger.info(f"Will use {pfn} as stageout location")
 
     return pfn
+
+
+WRITE_PFN_CACHE_FILE = 'write_pfn_cache.json'
+
+
+class WritePFNCache():
+    """
+    Persistent cache of getWritePFN results, as LFN prefix -> PFN prefix rules per site and
+    list of operations. Each Rucio lookup for an LFN gives a rule for the directory which
+    contains it (e.g. /store/user/x/task/ -> davs://host/eos/cms/store/user/x/task/), which is
+    then used for all the LFNs in that directory or below.
+    The cache is kept in the task directory, next to taskinformation.pkl, and is reused by
+    the DagmanCreator instances which PreDAG runs for the processing and tail stages.
+    Rules expire after `ttl` seconds, so that protocol changes in Rucio reach running tasks.
+    """
+
+    def __init__(self, rucioClient, fileName=WRITE_PFN_CACHE_FILE, ttl=6*3600, logger=None):
+        self.rucioClient = rucioClient
+        self.fileName = fileName
+        self.ttl = ttl
+        self.logger = logger
+        # "site|operation,operation" -> list of {'lfnPrefix', 'pfnPrefix', 'scheme', 'created'}
+        self.rules = {}
+        try:
+            with open(fileName, 'r', encoding='utf-8') as fd:
+                self.rules = json.load(fd)
+        except (IOError, ValueError):
+            pass
+
+    def getWritePFN(self, siteName, lfn, operations):
+        """
+        same as the getWritePFN function, for which it is a drop in replacement
+        """
+        key = '%s|%s' % (siteName, ','.join(operations))
+        now = time.time()
+        best = None
+        for rule in self.rules.get(key, []):
+            if now - rule['created'] < self.ttl and lfn.startswith(rule['lfnPrefix']):
+                if best is None or len(rule['lfnPrefix']) > len(best['lfnPrefix']):
+                    best = rule
+        if best:
+            return best['pfnPrefix'] + lfn[len(best['lfnPrefix']):]
+
+        pfn = getWritePFN(self.rucioClient, siteName=siteName, lfn=lfn, operations=operations, logger=self.logger)
+        lfnPrefix = lfn[:lfn.rfind('/') + 1]
+        name = lfn[len(lfnPrefix):]
+        if lfnPrefix and name and pfn.endswith(name):
+            # rules are only replaced, not accumulated, so the list stays short
+            rules = [rule for rule in self.rules.get(key, [])
+                     if rule['lfnPrefix'] != lfnPrefix and now - rule['created'] < self.ttl]
+            rules.append({'lfnPrefix': lfnPrefix, 'pfnPrefix': pfn[:len(pfn) - len(name)],
+                          'scheme': pfn.split(':', 1)[0], 'created': now})
+            self.rules[key] = rules
+            self.save()
+        else:
+            self.logger.info("Can not derive a prefix rule from %s -> %s, not caching it", lfn, pfn)
+        return pfn
+
+    def save(self):
+        """ write the cache file, atomically since PreDAGs of different stages may run at the same time """
+        tmpName = '%s.%d' % (self.fileName, os.getpid())
+        try:
+            with open(tmpName, 'w', encoding='utf-8') as fd:
+                json.dump(self.rules, fd)
+            os.rename(tmpName, self.fileName)
+        except (IOError, OSError) as ex:
+            self.logger.warning("Could not save %s: %s", self.fileName, ex)
@@ -16,6 +16,7 @@ from __future__ import absolute_import
 import os
 import sys
 import re
+import json
 import time
 import fcntl
 import hashlib
@@ -24,6 +25,7 @@ import datetime
 import traceback
 import subprocess
 import contextlib
+from ast import literal_eval
 
 if sys.version_info >= (3, 0):
     from http.client import HTTPException  # Python 3 and Python 2 in modern CMSSW
@@ -535,6 +537,67 @@ def encodeRequest(configreq, listParams=None):
     return str(encoded)
 
 
+def encodeRunLumi(runlumi):
+    """ Encode the runlumi information of a file, i.e. a {run: {lumi: events}} dictionary (where events
+        can be 'None'), in the compact JSON format used in the FILEMETADATA table:
+            {run: {"r": [[firstLumi, lastLumi], ...], "e": [events, ...]}}
+        where "r" are the ranges of consecutive lumis and "e" has the events of each lumi in increasing
+        lumi order, or is omitted if the events are not known (e.g. for input files).
+    """
+    encoded = {}
+    for run, lumis in runlumi.items():
+        ordered = sorted((int(lumi), events) for lumi, events in lumis.items())
+        ranges = []
+        for lumi, _ in ordered:
+            if ranges and ranges[-1][1] == lumi - 1:
+                ranges[-1][1] = lumi
+            else:
+                ranges.append([lumi, lumi])
+        entry = {'r': ranges}
+        events = [None if events in (None, 'None') else int(events) for _, events in ordered]
+        if any(ev is not None for ev in events):
+            entry['e'] = events
+        encoded[str(run)] = entry
+    return json.dumps(encoded, separators=(',', ':'))
+
+
+def isLegacyRunLumi(runlumiString):
+    """ Tell if runlumiString is in the python literal format, i.e. str({run: {lumi: events}}),
+        used in the FILEMETADATA table before encodeRunLumi was introduced
+    """
+    return runlumiString.startswith("{'")
+
+
+def decodeRunLumi(runlumiString, lumiRanges=False):
+    """ Decode the runlumi information of a file as stored in the FILEMETADATA table, either
+        by encodeRunLumi or in the legacy python literal format.
+        Returns {run: {lumi: events}} with strings as keys and values ('None' when the events
+        are unknown), or {run: [[firstLumi, lastLumi], ...]} if lumiRanges is True.
+    """
+    if isLegacyRunLumi(runlumiString):
+        if not lumiRanges:
+            return literal_eval(runlumiString)
+        runlumiString = encodeRunLumi(literal_eval(runlumiString))
+    encoded = json.loads(runlumiString)
+    if lumiRanges:
+        return dict((run, entry['r']) for run, entry in encoded.items())
+    decoded = {}
+    for run, entry in encoded.items():
+        lumis = [str(lumi) for first, last in entry['r'] for lumi in range(first, last + 1)]
+        events = ['None' if ev is None else str(ev) for ev in entry['e']] if 'e' in entry else ['None'] * len(lumis)
+        decoded[run] = dict(zip(lumis, events))
+    return decoded
+
+
+def decodeParents(parentsString):
+    """ Decode the list of parent LFNs of a file as stored in the FILEMETADATA table, either
+        as JSON or in the legacy python literal format
+    """
+    if parentsString.startswith("['"):
+        return literal_eval(parentsString)
+    return json.loads(parentsString)
+
+
 def oracleOutputMapping(result, key=None):
     """ If key is defined, it will use id as a key and will return dictionary which contains all items with this specific key
         Otherwise it will return a list of dictionaries.
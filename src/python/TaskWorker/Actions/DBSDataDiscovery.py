@@ -6,6 +6,9 @@ Performing the data discovery through CMS DBS service.
 import os
 import logging
 import sys
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from WMCore.DataStructs.LumiList import LumiList
 from WMCore.Services.DBS.DBSReader import DBSReader
@@ -16,6 +19,7 @@ from RucioUtils import getNativeRucioClient
 
 from ServerUtilities import MAX_LUMIS_IN_BLOCK, parseDBSInstance, isDatasetUserDataset
 from TaskWorker.WorkerExceptions import TaskWorkerException, TapeDatasetException
+from TaskWorker import DiscoveryCache as dc
 from TaskWorker.Actions.DataDiscovery import DataDiscovery
 from TaskWorker.Actions.RucioActions import RucioAction
 
@@ -31,6 +35,8 @@ class DBSDataDiscovery(DataDiscovery):
     def __init__(self, config, crabserver='', procnum=-1, rucioClient=None): # pylint: disable=redefined-outer-name
         DataDiscovery.__init__(self, config, crabserver, procnum)
         self.rucioClient = rucioClient
+        # on-disk cache of DBS/Rucio answers shared by all slaves, None if not configured
+        self.discoveryCache = dc.DiscoveryCache.fromConfig(config, self.logger)
 
     def checkDatasetStatus(self, dataset, kwargs):
         """ as the name says """
@@ -84,9 +90,26 @@ class DBSDataDiscovery(DataDiscovery):
         """ Make sure no single blocks has too many lumis. See
             https://hypernews.cern.ch/HyperNews/CMS/get/dmDevelopment/2022/1/1/1/1/1/1/2.html
         """
+        blocks = list(blocks)
+        lumisInBlock = {}
+        openBlocks = set()
+        if self.discoveryCache:
+            # open blocks can still get more lumis, only the counts of closed blocks are cached
+            for dataset in set(block.split('#')[0] for block in blocks):
+                openBlocks |= self.listOpenBlocks(dataset)
+            cached = self.discoveryCache.getMany(dc.BLOCKSUMMARY, [f"{self.dbsInstance}:{block}" for block in blocks
+                                                                   if block not in openBlocks])
+            lumisInBlock = {key.split(':', 1)[1]: nLumis for key, nLumis in cached.items()}
+        missing = [block for block in blocks if block not in lumisInBlock]
+        if missing:
+            newLumisInBlock = self.getBlocksLumiCount(missing)
+            if self.discoveryCache:
+                self.discoveryCache.putMany(dc.BLOCKSUMMARY, {f"{self.dbsInstance}:{block}": nLumis
+                                                              for block, nLumis in newLumisInBlock.items()
+                                                              if block not in openBlocks})
+            lumisInBlock.update(newLumisInBlock)
         for block in blocks:
-            blockInfo = self.dbs.getDBSSummaryInfo(block=block)
-            if blockInfo.get('NumberOfLumis', 0) > MAX_LUMIS_IN_BLOCK:
+            if lumisInBlock[block] > MAX_LUMIS_IN_BLOCK:
                 msg = f"Block {block} contains more than {MAX_LUMIS_IN_BLOCK} lumis."
                 msg += "\nThis blows up CRAB server memory"
                 msg += "\nCRAB can only split this by ignoring lumi information. You can do this"
@@ -95,23 +118,182 @@ class DBSDataDiscovery(DataDiscovery):
                 msg += "\nhttps://twiki.cern.ch/twiki/bin/view/CMSPublic/CRAB3FAQ"
                 raise TaskWorkerException(msg)
 
-    @staticmethod
-    def lumi_overlap(d1,d2):
+    def getBlocksLumiCount(self, blocks):
         """
-        This finds if there are common run and lumis in two lists in the form of
-        {
-        '1': [1,2,3,4,6,7,8,9,10],
-        '2': [1,4,5,20]
-        }
+        get from DBS the number of lumis in each block, running up to
+        config.TaskWorker.dbsLookupThreads getDBSSummaryInfo calls at the same time.
+        DBS client objects can not be shared among threads, each thread makes its own DBSReader
+        returns: a dictionary {block: number of lumis}
         """
-        common_runs = d1.keys() & d2.keys()
-        if len(common_runs) == 0: return False
-
-        for run in common_runs:
-            common_lumis = set(d1[run]).intersection(set(d2[run]))
-            if len(common_lumis)>0 : return	True
+        nThreads = max(1, min(getattr(self.config.TaskWorker, 'dbsLookupThreads', 8), len(blocks)))
+        if nThreads == 1:
+            return {block: self.dbs.getDBSSummaryInfo(block=block).get('NumberOfLumis', 0) for block in blocks}
+        threadData = threading.local()
+        def lookup(block):
+            if not hasattr(threadData, 'dbs'):
+                threadData.dbs = DBSReader(self.dbsUrl)
+            return threadData.dbs.getDBSSummaryInfo(block=block).get('NumberOfLumis', 0)
+        with ThreadPoolExecutor(max_workers=nThreads) as executor:
+            return dict(zip(blocks, executor.map(lookup, blocks)))
+
+    def listBlocksReplicas(self, scope, blockNames):
+        """
+        get from Rucio the replicas of each block, running up to
+        config.TaskWorker.rucioLookupThreads list_dataset_replicas calls at the same time.
+        A failed lookup is retried once, blocks which fail twice are left out of the result
+        and logged, they are treated like blocks with no replica.
+        Rucio client objects can not be shared among threads: one thread uses self.rucioClient,
+        each of the others makes its own
+        returns: a dictionary {blockName: [replica dictionaries as returned by Rucio]}
+        """
+        threadData = threading.local()
+        spareClients = [self.rucioClient]
+        def lookup(blockName, rucioClient=None):
+            try:
+                if rucioClient is None:
+                    if not hasattr(threadData, 'rucioClient'):
+                        try:
+                            threadData.rucioClient = spareClients.pop()
+                        except IndexError:
+                            threadData.rucioClient = getNativeRucioClient(config=self.config, logger=self.logger)
+                    rucioClient = threadData.rucioClient
+                return list(rucioClient.list_dataset_replicas(scope=scope, name=blockName, deep=True))
+            except Exception as exc:  # pylint: disable=broad-except
+                return exc
+
+        blockNames = list(blockNames)
+        cached = {}
+        if self.discoveryCache:
+            cached = self.discoveryCache.getMany(dc.REPLICAS, [f"{scope}:{blockName}" for blockName in blockNames])
+            cached = {key.split(':', 1)[1]: replicas for key, replicas in cached.items()}
+            blockNames = [blockName for blockName in blockNames if blockName not in cached]
+        if not blockNames:
+            return cached
+        nThreads = max(1, min(getattr(self.config.TaskWorker, 'rucioLookupThreads', 8), len(blockNames)))
+        with ThreadPoolExecutor(max_workers=nThreads) as executor:
+            responses = dict(zip(blockNames, executor.map(lookup, blockNames)))
+        replicasMap = {}
+        failures = {}
+        for blockName, response in responses.items():
+            if isinstance(response, Exception):
+                # the pool is over, self.rucioClient is free again
+                response = lookup(blockName, self.rucioClient)
+            if isinstance(response, Exception):
+                failures[blockName] = response
+            else:
+                replicasMap[blockName] = response
+        if failures:
+            blockName, exc = next(iter(failures.items()))
+            self.logger.warning("Rucio lookup failed for %d out of %d blocks, e.g. for %s with\n%s",
+                                len(failures), len(blockNames), blockName, exc)
+        if self.discoveryCache:
+            self.discoveryCache.putMany(dc.REPLICAS, {f"{scope}:{blockName}": replicas
+                                                      for blockName, replicas in replicasMap.items()})
+        replicasMap.update(cached)
+        return replicasMap
+
+    def listFileBlocks(self, dataset):
+        """ DBSReader.listFileBlocks, through the discovery cache """
+        key = f"{self.dbsInstance}:{dataset}"
+        blocks = self.discoveryCache.get(dc.BLOCKS, key) if self.discoveryCache else None
+        if blocks is None:
+            blocks = self.dbs.listFileBlocks(dataset)
+            if self.discoveryCache:
+                self.discoveryCache.put(dc.BLOCKS, key, blocks)
+        return blocks
+
+    def listOpenBlocks(self, dataset):
+        """
+        the blocks of dataset which are still open, i.e. can still get more files, through the
+        discovery cache. Used to decide what can be cached for long
+        returns: a set of block names
+        """
+        key = f"{self.dbsInstance}:{dataset}"
+        openBlocks = self.discoveryCache.get(dc.OPENBLOCKS, key) if self.discoveryCache else None
+        if openBlocks is None:
+            openBlocks = [block['block_name'] for block in self.dbs.dbs.listBlocks(dataset=dataset, detail=True)
+                          if int(block['open_for_writing'])]
+            if self.discoveryCache:
+                self.discoveryCache.put(dc.OPENBLOCKS, key, openBlocks)
+        return set(openBlocks)
+
+    def getFileValidity(self, dataset):
+        """
+        is_file_valid of all the files of dataset, through the discovery cache
+        returns: a dictionary {lfn: is_file_valid}
+        """
+        key = f"{self.dbsInstance}:{dataset}"
+        validity = self.discoveryCache.get(dc.FILEVALIDITY, key) if self.discoveryCache else None
+        if validity is None:
+            validity = {f['logical_file_name']: f['is_file_valid']
+                        for f in self.dbs.dbs.listFiles(dataset=dataset, validFileOnly=0, detail=True)}
+            if self.discoveryCache:
+                self.discoveryCache.put(dc.FILEVALIDITY, key, validity)
+        return validity
+
+    def listDatasetFileDetails(self, dataset, datasetBlocks, getParents, getLumis):
+        """
+        DBSReader.listDatasetFileDetails(validFileOnly=0), through the discovery cache.
+        Blocks can be added to a dataset: a cached answer is only used if it was obtained when the
+        dataset had (at least) all the blocks in datasetBlocks. Open blocks can get more files: the
+        details of a dataset with open blocks are only cached for a short time. Files can be
+        invalidated at any time: the validity in long lived answers is replaced with a fresh one
+        """
+        if not self.discoveryCache:
+            return self.dbs.listDatasetFileDetails(dataset, getParents=getParents, getLumis=getLumis, validFileOnly=0)
+        key = f"{self.dbsInstance}:{dataset}:parents={getParents}:lumis={getLumis}"
+        kind = dc.OPENFILEDETAILS if self.listOpenBlocks(dataset) else dc.FILEDETAILS
+        cached = self.discoveryCache.get(kind, key)
+        if cached and set(datasetBlocks) <= set(cached['blocks']):
+            self.logger.info("Using cached file details for %s", dataset)
+            filedetails = dc.expandFileDetails(cached['filedetails'])
+            if kind == dc.FILEDETAILS:
+                validity = self.getFileValidity(dataset)
+                for lfn, infos in filedetails.items():
+                    infos['ValidFile'] = validity.get(lfn, infos.get('ValidFile'))
+            return filedetails
+        filedetails = self.dbs.listDatasetFileDetails(dataset, getParents=getParents, getLumis=getLumis, validFileOnly=0)
+        self.discoveryCache.put(kind, key, {'blocks': list(datasetBlocks),
+                                            'filedetails': dc.compactFileDetails(filedetails)})
+        self.discoveryCache.put(dc.FILEVALIDITY, f"{self.dbsInstance}:{dataset}",
+                                {lfn: infos.get('ValidFile') for lfn, infos in filedetails.items()})
+        return filedetails
+
+    def logTiming(self, timing):
+        """
+        log how long each phase took. timing is a list of (phase, time.time() at the end of the phase)
+        whose first element marks the start of the first phase
+        """
+        durations = [f"{phase}: {end - start:.1f}s" for (_, start), (phase, end) in zip(timing, timing[1:])]
+        self.logger.info("Data discovery time per phase: %s", ", ".join(durations))
 
-        return False
+    @staticmethod
+    def matchSecondaryFiles(filedetails, secondaryFiledetails):
+        """
+        fill the 'Parents' list of each file in filedetails with the names of the files in
+        secondaryFiledetails which have at least one (run, lumi) in common with it.
+        Both arguments are dictionaries {fileName: {'Lumis': {run: [lumis]}, ...}}
+        as returned by DBSReader.listDatasetFileDetails.
+        An inverted index {run: {lumi: [secondary file numbers]}} is built once, so that
+        the cost grows with the number of lumis and not with the product of the numbers of files
+        """
+        secondaryNames = list(secondaryFiledetails)
+        lumiIndex = {}
+        for fileNumber, secondaryName in enumerate(secondaryNames):
+            for run, lumis in secondaryFiledetails[secondaryName]['Lumis'].items():
+                runIndex = lumiIndex.setdefault(run, {})
+                for lumi in lumis:
+                    runIndex.setdefault(lumi, []).append(fileNumber)
+        for infos in filedetails.values():
+            fileNumbers = set()
+            for run, lumis in infos['Lumis'].items():
+                runIndex = lumiIndex.get(run)
+                if not runIndex:
+                    continue
+                for lumi in lumis:
+                    fileNumbers.update(runIndex.get(lumi, ()))
+            # same order as in secondaryFiledetails, as it used to be with the nested loop
+            infos['Parents'] = [secondaryNames[fileNumber] for fileNumber in sorted(fileNumbers)]
 
     def execute(self, *args, **kwargs):
         """
@@ -142,6 +324,7 @@ class DBSDataDiscovery(DataDiscovery):
             dbsurl = dbsurl.replace(hostname, self.config.Services.DBSHostName)
         self.logger.info("will connect to DBS at URL: %s", dbsurl)
         self.dbs = DBSReader(dbsurl)
+        self.dbsUrl = dbsurl  # pylint: disable=W0201
         # with new DBS, we can not get the instance from serverinfo api
         # instead, we parse it from the URL
         # if url is 'https://cmsweb.cern.ch/dbs/prod/global/DBSReader'
@@ -166,20 +349,24 @@ class DBSDataDiscovery(DataDiscovery):
         # the isUserDataset flag is used to look for data location in DBS instead of Rucio
         isUserDataset = isDatasetUserDataset(inputDataset, self.dbsInstance)
 
+        # (phase, end time) to report how long each step took
+        timing = [('start', time.time())]
+
         self.checkDatasetStatus(inputDataset, kwargs)
         if secondaryDataset:
             self.checkDatasetStatus(secondaryDataset, kwargs)
 
         try:
             # Get the list of blocks for the locations.
-            blocks = self.dbs.listFileBlocks(inputDataset)
+            blocks = self.listFileBlocks(inputDataset)
+            datasetBlocks = list(blocks)
             self.logger.debug("Datablock from DBS: %s ", blocks)
             if inputBlocks:
                 blocks = [x for x in blocks if x in inputBlocks]
                 self.logger.debug("Matched inputBlocks: %s ", blocks)
             secondaryBlocks = []
             if secondaryDataset:
-                secondaryBlocks = self.dbs.listFileBlocks(secondaryDataset)
+                secondaryBlocks = self.listFileBlocks(secondaryDataset)
         except DBSReaderError as dbsexc:
             # dataset not found in DBS is a known use case
             if str(dbsexc).find('No matching data'):
@@ -187,6 +374,7 @@ class DBSDataDiscovery(DataDiscovery):
                     f"CRAB could not find dataset {inputDataset} in this DBS instance: {dbsurl}"
                 ) from dbsexc
             raise
+        timing.append(('DBS dataset status and blocks', time.time()))
         ## Create a map for block's locations: for each block get the list of locations.
         ## Note: listFileBlockLocation() gets first the locations from PhEDEx, and if no
         ## locations are found it gets the original locations from DBS. So it should
@@ -219,10 +407,10 @@ class DBSDataDiscovery(DataDiscovery):
                 scope = f"user.{self.username}"
             self.logger.info("Looking up data location with Rucio in %s scope.", scope)
             try:
-                for blockName in list(blocks):
+                replicasMap = self.listBlocksReplicas(scope, blocks)
+                for blockName, response in replicasMap.items():
                     partialReplicas = set()
                     fullReplicas = set()
-                    response = self.rucioClient.list_dataset_replicas(scope=scope, name=blockName, deep=True)
                     sizeBytes = 0
                     for item in response:
                         # same as complete='y' used for PhEDEx
@@ -279,6 +467,8 @@ class DBSDataDiscovery(DataDiscovery):
                     " and contact the experts if the error persists."
                     )
 
+        timing.append(('block locations', time.time()))
+
         if secondaryDataset:
             if secondaryDataset.endswith('USER'):
                 self.logger.info("Secondary dataset is USER. Looking up data locations using origin site in DBS")
@@ -293,9 +483,9 @@ class DBSDataDiscovery(DataDiscovery):
             else:
                 self.logger.info("Trying data location of secondary dataset blocks with Rucio")
                 try:
-                    for blockName in list(secondaryBlocks):
+                    secondaryReplicasMap = self.listBlocksReplicas(scope, secondaryBlocks)
+                    for blockName, response in secondaryReplicasMap.items():
                         replicas = set()
-                        response = self.rucioClient.list_dataset_replicas(scope=scope, name=blockName, deep=True)
                         for item in response:
                             # same as complete='y' used for PhEDEx
                             if item['state'].upper() == 'AVAILABLE':
@@ -308,6 +498,7 @@ class DBSDataDiscovery(DataDiscovery):
             if not secondaryLocationsMap:
                 msg = f"No locations found for secondaryDataset {secondaryDataset}."
                 raise TaskWorkerException(msg)
+            timing.append(('secondary block locations', time.time()))
 
 
         # From now on code is not dependent from having used Rucio or PhEDEx
@@ -363,25 +554,22 @@ class DBSDataDiscovery(DataDiscovery):
             self.checkBlocksSize(blocksWithLocation) # Interested only in blocks with locations, 'blocks' may contain invalid ones and trigger an Exception
             if secondaryDataset:
                 self.checkBlocksSize(secondaryBlocksWithLocation)
+            timing.append(('DBS blocks size check', time.time()))
         try:
-            filedetails = self.dbs.listDatasetFileDetails(inputDataset, getParents=True, getLumis=needLumiInfo, validFileOnly=0)
+            filedetails = self.listDatasetFileDetails(inputDataset, datasetBlocks, getParents=True, getLumis=needLumiInfo)
             if inputBlocks:
                 for key, infos in filedetails.copy().items():
                     if not infos['BlockName'] in inputBlocks:
                         del filedetails[key]
+            timing.append(('DBS file details', time.time()))
             if secondaryDataset:
-                moredetails = self.dbs.listDatasetFileDetails(secondaryDataset, getParents=False, getLumis=needLumiInfo, validFileOnly=0)
+                moredetails = self.listDatasetFileDetails(secondaryDataset, secondaryBlocks, getParents=False, getLumis=needLumiInfo)
                 self.logger.info("Beginning to match files from secondary dataset")
 
-                for dummyFilename, infos in filedetails.items():
-                    primary_lumis = infos['Lumis']
-                    infos['Parents'] = []
-                    for secfilename, secinfos in moredetails.items():
-                        if self.lumi_overlap(primary_lumis,secinfos['Lumis']):
-                            infos['Parents'].append(secfilename)
-                
+                self.matchSecondaryFiles(filedetails, moredetails)
                 self.logger.info("Done matching files from secondary dataset")
                 kwargs['task']['tm_use_parent'] = 1
+                timing.append(('secondary dataset file details and matching', time.time()))
         except Exception as ex:
             self.logger.exception(ex)
             raise TaskWorkerException(
@@ -408,6 +596,7 @@ class DBSDataDiscovery(DataDiscovery):
                                       (f"https://cmsweb.cern.ch/das/request?instance={self.dbsInstance}&input=dataset={inputDataset}"))
 
         self.logger.debug("Got %s files", len(result.result.getFiles()))
+        timing.append(('output formatting', time.time()))
 
         # lock input data on disk before final submission
         # (submission can still fail in Splitting step, but it happens rarely and usually users fix
@@ -433,6 +622,8 @@ class DBSDataDiscovery(DataDiscovery):
                 msg = 'Locking of input data failed. Details in TaskWorker log. Submit anyhow'
                 self.logger.info(msg)
                 self.uploadWarning(msg, self.userproxy, self.taskName)
+            timing.append(('input data lock', time.time()))
+        self.logTiming(timing)
         return result
 
 
@@ -6,14 +6,17 @@ Generates the condor submit files and the master DAG.
 
 import os
 import re
+import gzip
 import json
+import time
 import shutil
 import pickle
 import random
+import string
 import tarfile
 import hashlib
-import tempfile
 from ast import literal_eval
+from concurrent.futures import ProcessPoolExecutor
 
 from ServerUtilities import MAX_DISK_SPACE, MAX_IDLE_JOBS, MAX_POST_JOBS, TASKLIFETIME
 from ServerUtilities import getLock, downloadFromS3
@@ -21,8 +24,9 @@ from ServerUtilities import getLock, downloadFromS3
 import TaskWorker.WorkerExceptions
 import TaskWorker.DataObjects.Result
 from TaskWorker.Actions.TaskAction import TaskAction
+from TaskWorker.FilesetStore import saveFileset, FILESET_DB
 from TaskWorker.WorkerExceptions import TaskWorkerException
-from RucioUtils import getWritePFN
+from RucioUtils import WritePFNCache, WRITE_PFN_CACHE_FILE
 from CMSGroupMapper import get_egroup_users
 
 import classad
@@ -354,6 +358,128 @@ def getLocation(default_name, checkout_location):
     return loc
 
 
+def compileTemplate(template):
+    """
+    Turn a str.format template with named fields (like DAG_FRAGMENT) into an
+    equivalent %-format string plus the ordered tuple of its fields, so that
+    the template is parsed once and not once per node.
+    """
+    parts = []
+    fields = []
+    for literal, field, formatSpec, conversion in string.Formatter().parse(template):
+        parts.append(literal.replace('%', '%%'))
+        if field is not None:
+            assert not formatSpec and not conversion, "only plain {name} fields are supported"
+            parts.append('%s')
+            fields.append(field)
+    return ''.join(parts), tuple(fields)
+
+
+def renderTemplate(compiled, specs):
+    """ render a compiled template for each dictionary in specs and join the results """
+    fmt, fields = compiled
+    return ''.join([fmt % tuple([spec[field] for field in fields]) for spec in specs])
+
+
+DAG_FRAGMENT_COMPILED = compileTemplate(DAG_FRAGMENT)
+
+# the jobs payloads are serialized in chunks of this many jobs, each one in a worker process
+PAYLOAD_CHUNK_SIZE = 1000
+
+
+def tarHeaderTemplate(mtime):
+    """ ustar header of an empty regular file, to be completed by tarMember """
+    tarinfo = tarfile.TarInfo('')
+    tarinfo.mtime = mtime
+    tarinfo.mode = 0o644
+    return tarinfo.tobuf(tarfile.USTAR_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def tarMember(template, name, data):
+    """
+    header and data, padded to the tar block size, of a regular file with the given content.
+    Only name, size and checksum of the header change from one file to the next, filling them
+    in the template is much faster than building the header with tarfile for each file
+    """
+    header = bytearray(template)
+    name = name.encode('utf-8')
+    assert len(name) <= 100, "tar member name too long: %s" % name
+    header[0:len(name)] = name
+    header[124:136] = b'%011o\0' % len(data)
+    # the checksum is computed with the checksum field itself filled with spaces
+    header[148:156] = b' ' * 8
+    header[148:156] = b'%06o\0 ' % sum(header)
+    return bytes(header) + data + tarfile.NUL * (-len(data) % tarfile.BLOCKSIZE)
+
+
+def makeJobPayloads(nodes, mtime):
+    """
+    Serialize the lumi mask and the input files list of a chunk of jobs and pack them as
+    tar members, each group of members compressed into one gzip stream.
+    :param nodes: list of (count, runAndLumiMask, inputFiles) with the python objects
+    :param mtime: modification time of the tar members
+    :return: a tuple (gzipped job_lumis_<count>.json members, gzipped job_input_file_list_<count>.txt members)
+    """
+    template = tarHeaderTemplate(mtime)
+    lumis = []
+    inputs = []
+    for count, runAndLumiMask, inputFiles in nodes:
+        lumis.append(tarMember(template, 'job_lumis_%s.json' % count, json.dumps(runAndLumiMask).encode('utf-8')))
+        inputs.append(tarMember(template, 'job_input_file_list_%s.txt' % count, json.dumps(inputFiles).encode('utf-8')))
+    return gzip.compress(b''.join(lumis), compresslevel=6), gzip.compress(b''.join(inputs), compresslevel=6)
+
+
+def readTarMembers(archive):
+    """
+    :return: the uncompressed tar members (without the end of archive marker) of an existing
+             .tar.gz file, or b'' if it does not exist
+    """
+    try:
+        with gzip.open(archive, 'rb') as fd:
+            raw = fd.read()
+    except (IOError, EOFError):
+        return b''
+    # walk the headers up to the first empty block, which is where the end of archive marker starts
+    offset = 0
+    while offset + tarfile.BLOCKSIZE <= len(raw) and raw[offset:offset + tarfile.BLOCKSIZE].strip(tarfile.NUL):
+        size = int(raw[offset + 124:offset + 136].strip(b' \0') or b'0', 8)
+        offset += tarfile.BLOCKSIZE + size + (-size % tarfile.BLOCKSIZE)
+    return raw[:offset]
+
+
+def writeJobPayloads(dagSpecs, processes, logger):
+    """
+    Write the lumi mask and the input files list of each job in the run_and_lumis.tar.gz and
+    input_files.tar.gz archives (adding to them if they exist, as for tail stage subdags).
+    The jobs are serialized in chunks, in a pool of `processes` worker processes when there is
+    more than one chunk. Each chunk is a gzip stream of its own and the archives are the
+    concatenation of those streams, which gzip and tarfile read as one: there is no need to
+    write one temporary file per job and the files readers see are the same as before.
+    """
+    mtime = int(time.time())
+    nodes = [(dagSpec['count'], dagSpec['runAndLumiMask'], dagSpec['inputFiles']) for dagSpec in dagSpecs]
+    chunks = [nodes[start:start + PAYLOAD_CHUNK_SIZE] for start in range(0, len(nodes), PAYLOAD_CHUNK_SIZE)]
+    if processes > 1 and len(chunks) > 1:
+        with ProcessPoolExecutor(max_workers=min(processes, len(chunks))) as pool:
+            payloads = list(pool.map(makeJobPayloads, chunks, [mtime] * len(chunks)))
+    else:
+        payloads = [makeJobPayloads(chunk, mtime) for chunk in chunks]
+    logger.debug("Serialized the payloads of %d jobs in %d chunks", len(nodes), len(chunks))
+
+    # end of archive marker: two empty blocks, padded to the record size as tarfile does
+    endOfArchive = gzip.compress(tarfile.NUL * tarfile.RECORDSIZE)
+    for n, archive in enumerate(['run_and_lumis.tar.gz', 'input_files.tar.gz']):
+        previous = readTarMembers(archive)
+        tmpName = archive + '.tmp'
+        with open(tmpName, 'wb') as fd:
+            if previous:
+                fd.write(gzip.compress(previous, compresslevel=6))
+            for payload in payloads:
+                fd.write(payload[n])
+            fd.write(endOfArchive)
+        os.rename(tmpName, archive)
+
+
 class DagmanCreator(TaskAction):
     """
     Given a task definition, create the corresponding DAG files for submission
@@ -363,6 +489,7 @@ class DagmanCreator(TaskAction):
     def __init__(self, config, crabserver, procnum=-1, rucioClient=None):
         TaskAction.__init__(self, config, crabserver, procnum)
         self.rucioClient = rucioClient
+        self.writePFNCache = None
 
     def populateGlideinMatching(self, info):
         scram_arch = info['tm_job_arch']
@@ -597,17 +724,18 @@ class DagmanCreator(TaskAction):
         lastDirectDest = None
         lastDirectPfn = None
         for job in jobgroup.getJobs():
+            # inputFiles and runAndLumiMask are serialized to json later, by writeJobPayloads
             if task['tm_use_parent'] == 1:
-                inputFiles = json.dumps([
+                inputFiles = [
                     {
                         'lfn': inputfile['lfn'],
                         'parents': [{'lfn': parentfile} for parentfile in inputfile['parents']]
                     }
                     for inputfile in job['input_files']
-                ])
+                ]
             else:
-                inputFiles = json.dumps([inputfile['lfn'] for inputfile in job['input_files']])
-            runAndLumiMask = json.dumps(job['mask']['runAndLumis'])
+                inputFiles = [inputfile['lfn'] for inputfile in job['input_files']]
+            runAndLumiMask = job['mask']['runAndLumis']
             firstEvent = str(job['mask']['FirstEvent'])
             lastEvent = str(job['mask']['LastEvent'])
             firstLumi = str(job['mask']['FirstLumi'])
@@ -641,8 +769,8 @@ class DagmanCreator(TaskAction):
                 # we only care about 'write', which should be used with plain gfal.
                 # there is no need to get the PFN for 'third_party_copy_write',
                 # which should be used with FTS.
-                lastDirectPfn = getWritePFN(self.rucioClient, siteName=task['tm_asyncdest'], lfn=directDest,
-                                            operations=['write'], logger=self.logger)
+                lastDirectPfn = self.writePFNCache.getWritePFN(siteName=task['tm_asyncdest'], lfn=directDest,
+                                                               operations=['write'])
                 lastDirectDest = directDest
             pfns = ["log/cmsRun_{0}.log.tar.gz".format(count)] + remoteOutputFiles
             pfns = ", ".join(["%s/%s" % (lastDirectPfn, pfn) for pfn in pfns])
@@ -734,6 +862,9 @@ class DagmanCreator(TaskAction):
         self.logger.debug(str(kwargs))
         dagSpecs = []
         subdags = []
+        # the cache file is in the task directory, so PreDAG finds the one written at submission
+        self.writePFNCache = WritePFNCache(self.rucioClient, ttl=getattr(self.config.TaskWorker, 'writePFNCacheTTL', 6*3600),
+                                           logger=self.logger)
 
         # disable direct stageout for rucio tasks
         if kwargs['task']['tm_output_lfn'].startswith('/store/user/rucio') or \
@@ -834,7 +965,14 @@ class DagmanCreator(TaskAction):
         ignoreLocality = kwargs['task']['tm_ignore_locality'] == 'T'
         self.logger.debug("Ignore locality: %s", ignoreLocality)
 
-        for jobgroup in splitterResult[0]:
+        jobgroups = splitterResult[0]
+        # unless the jobs are needed again later (DryRunUploader), drop each jobgroup from the splitting
+        # output as soon as we get to it, so that its jobs can be freed once their DAG specs are made
+        # and the whole splitting output is never in memory together with all the DAG specs
+        releaseJobgroups = kwargs['task'].get('tm_dry_run') != 'T'
+        for jobgroupIndex, jobgroup in enumerate(jobgroups):
+            if releaseJobgroups:
+                jobgroups[jobgroupIndex] = None
             jobs = jobgroup.getJobs()
 
             jgblocks = set() #job group blocks
@@ -948,6 +1086,8 @@ class DagmanCreator(TaskAction):
                                                              jobgroup, list(jgblocks)[0], availablesites,
                                                              datasites, outfiles, startjobid, parent=parent, stage=stage)
             dagSpecs += jobgroupDagSpecs
+        if releaseJobgroups:
+            del jobgroups[:]
 
         def getBlacklistMsg():
             tmp = ""
@@ -998,8 +1138,7 @@ class DagmanCreator(TaskAction):
                                 resthost=restHostForSchedd)
         if stage == 'probe':
             dagSpecs = dagSpecs[:getattr(self.config.TaskWorker, 'numAutomaticProbes', 5)]
-        for dagSpec in dagSpecs:
-            dag += DAG_FRAGMENT.format(**dagSpec)
+        dag += renderTemplate(DAG_FRAGMENT_COMPILED, dagSpecs)
         if stage in ('probe', 'processing'):
             # default for probe DAG: only one processing DAG after 100% of the probe jobs have completed
             subdagCompletions = [100]
@@ -1020,50 +1159,15 @@ class DagmanCreator(TaskAction):
                     fd.write("")
                 subdags.append(subdag)
 
-        ## Create a tarball with all the job lumi files.
+        ## Create a tarball with all the job lumi files and one with the input files lists.
         with getLock('splitting_data'):
             self.logger.debug("Acquired lock on run and lumi tarball")
-
-            try:
-                tempDir = tempfile.mkdtemp()
-                tempDir2 = tempfile.mkdtemp()
-
-                try:
-                    tfd = tarfile.open('run_and_lumis.tar.gz', 'r:gz')
-                    tfd.extractall(tempDir)
-                    tfd.close()
-                except (tarfile.ReadError, IOError):
-                    self.logger.debug("First iteration: creating run and lumi from scratch")
-                try:
-                    tfd2 = tarfile.open('input_files.tar.gz', 'r:gz')
-                    tfd2.extractall(tempDir2)
-                    tfd2.close()
-                except (tarfile.ReadError, IOError):
-                    self.logger.debug("First iteration: creating inputfiles from scratch")
-                tfd = tarfile.open('run_and_lumis.tar.gz', 'w:gz')
-                tfd2 = tarfile.open('input_files.tar.gz', 'w:gz')
-                for dagSpec in dagSpecs:
-                    job_lumis_file = os.path.join(tempDir, 'job_lumis_'+ str(dagSpec['count']) +'.json')
-                    with open(job_lumis_file, "w", encoding='utf-8') as fd:
-                        fd.write(str(dagSpec['runAndLumiMask']))
-                    ## Also creating a tarball with the dataset input files.
-                    ## Each .txt file in the tarball contains a list of dataset files to be used for the job.
-                    job_input_file_list = os.path.join(tempDir2, 'job_input_file_list_'+ str(dagSpec['count']) +'.txt')
-                    with open(job_input_file_list, "w", encoding='utf-8') as fd2:
-                        fd2.write(str(dagSpec['inputFiles']))
-            finally:
-                tfd.add(tempDir, arcname='')
-                tfd.close()
-                shutil.rmtree(tempDir)
-                tfd2.add(tempDir2, arcname='')
-                tfd2.close()
-                shutil.rmtree(tempDir2)
+            writeJobPayloads(dagSpecs, getattr(self.config.TaskWorker, 'dagWriterProcesses', 4), self.logger)
 
         if stage in ('probe', 'conventional'):
             name = "RunJobs.dag"
-            ## Cache data discovery
-            with open("datadiscovery.pkl", "wb") as fd:
-                pickle.dump(splitterResult[1], fd)
+            ## Cache data discovery, in a format which PreDAG can load partially
+            saveFileset(splitterResult[1])
 
             ## Cache task information
             with open("taskinformation.pkl", "wb") as fd:
@@ -1226,7 +1330,7 @@ class DagmanCreator(TaskAction):
         params = {}
 
         inputFiles = ['gWMS-CMSRunAnalysis.sh', 'submit_env.sh', 'CMSRunAnalysis.sh', 'cmscp.py', 'cmscp.sh', 'RunJobs.dag', 'Job.submit', 'dag_bootstrap.sh',
-                      'AdjustSites.py', 'site.ad', 'site.ad.json', 'datadiscovery.pkl', 'taskinformation.pkl', 'taskworkerconfig.pkl',
+                      'AdjustSites.py', 'site.ad', 'site.ad.json', FILESET_DB, 'taskinformation.pkl', 'taskworkerconfig.pkl',
                       'run_and_lumis.tar.gz', 'input_files.tar.gz']
 
         self.extractMonitorFiles(inputFiles, **kw)
@@ -1244,6 +1348,9 @@ class DagmanCreator(TaskAction):
             inputFiles.append("debug_files.tar.gz")
 
         info, splitterResult, subdags, dagSpecs = self.createSubdag(*args, **kw)
+        # written by createSubdag when the stageout PFN prefixes are known
+        if os.path.exists(WRITE_PFN_CACHE_FILE):
+            inputFiles.append(WRITE_PFN_CACHE_FILE)
 
         self.prepareLocal(dagSpecs, info, kw, inputFiles, subdags)
 
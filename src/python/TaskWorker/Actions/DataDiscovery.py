@@ -2,6 +2,7 @@ from __future__ import print_function
 import os
 import json
 import logging
+from array import array
 
 from WMCore.DataStructs.Run import Run
 from WMCore.DataStructs.File import File
@@ -31,8 +32,11 @@ class DataDiscovery(TaskAction):  # pylint: disable=abstract-method
         wmfiles = []
         event_counter = 0
         lumi_counter = 0
-        uniquelumis = set()
+        # {run: array of lumis}, duplicates included. Arrays of C ints take a fraction
+        # of the memory of lists of python ints, or of a set of (run, lumi) tuples
         datasetLumis = {}
+        # all files in a block have the same locations, translate them once per block
+        blockPSNs = {}
         blocksWithNoLocations = set()
         ## Loop over the sorted list of files.
         configDict = {"cacheduration": 1, "pycurl": True} # cache duration is in hours
@@ -58,20 +62,20 @@ class DataDiscovery(TaskAction):  # pylint: disable=abstract-method
                 checksums = {'Checksum': infos['Checksum'], 'Adler32': infos['Adler32'], 'Md5': infos['Md5']}
                 wmfile = File(lfn=lfn, events=infos['NumberOfEvents'], size=size, checksums=checksums, parents=infos['Parents'])
                 wmfile['block'] = infos['BlockName']
-                try:
-                    wmfile['locations'] = resourceCatalog.PNNstoPSNs(locations[wmfile['block']])
-                except Exception as ex:
-                    self.logger.error("Impossible translating %s to a CMS name through CMS Resource Catalog",
-                                      locations[wmfile['block']])
-                    self.logger.error("got this exception:\n %s", ex)
-                    raise
+                if wmfile['block'] not in blockPSNs:
+                    try:
+                        blockPSNs[wmfile['block']] = resourceCatalog.PNNstoPSNs(locations[wmfile['block']])
+                    except Exception as ex:
+                        self.logger.error("Impossible translating %s to a CMS name through CMS Resource Catalog",
+                                          locations[wmfile['block']])
+                        self.logger.error("got this exception:\n %s", ex)
+                        raise
+                wmfile['locations'] = list(blockPSNs[wmfile['block']])
                 wmfile['workflow'] = requestname
                 event_counter += infos['NumberOfEvents']
                 for run, lumis in infos['Lumis'].items():
-                    datasetLumis.setdefault(run, []).extend(lumis)
+                    datasetLumis.setdefault(run, array('I')).extend(lumis)
                     wmfile.addRun(Run(run, *lumis))
-                    for lumi in lumis:
-                        uniquelumis.add((run, lumi))
                     lumi_counter += len(lumis)
                 wmfiles.append(wmfile)
 
@@ -82,7 +86,8 @@ class DataDiscovery(TaskAction):  # pylint: disable=abstract-method
             self.logger.warning(msg)
             self.uploadWarning(msg, task['user_proxy'], task['tm_taskname'])
 
-        uniquelumis = len(uniquelumis)
+        # one run at a time, so that only one temporary set is alive
+        uniquelumis = sum(len(set(lumis)) for lumis in datasetLumis.values())
         self.logger.debug('Tot events found: %d', event_counter)
         self.logger.debug('Tot lumis found: %d', uniquelumis)
         self.logger.debug('Duplicate lumis found: %d', (lumi_counter - uniquelumis))
@@ -2,6 +2,7 @@
 
 import os
 import time
+import resource
 import logging
 import tempfile
 import traceback
@@ -123,6 +124,7 @@ class TaskHandler():
         for action in self.getWorks():
             self.logger.debug("Starting %s on %s", str(action), self.taskname)
             t0 = time.time()
+            maxRss0 = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
             retryCount = 0
             #execute the current action dealing with retriesz
             maxRetries = 5
@@ -139,6 +141,10 @@ class TaskHandler():
             t1 = time.time()
             #log entry below is used for logs parsing, therefore, changing it might require to update logstash configuration
             self.logger.info("Finished %s on %s in %d seconds", str(action), self.taskname, t1 - t0)
+            # ru_maxrss is in kB and is the peak for the whole life of this slave, so it only
+            # grows when an action needs more memory than any other action before it
+            maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+            self.logger.info("Peak memory after %s on %s: %d MB (%+d MB)", str(action), self.taskname, maxRss, maxRss - maxRss0)
 
             # if there is a next action to do, the result field of the Result object returned by this action (!)
             # will contain the needed input for the next action. I also hate this, but could not find a better way
@@ -98,21 +98,18 @@ import shutil
 import hashlib
 from shutil import move
 from http.client import HTTPException
-import requests
-from requests.auth import HTTPBasicAuth
 
-import htcondor
 import classad
-from WMCore import Lexicon
-from WMCore.DataStructs.LumiList import LumiList
-from WMCore.Services.WMArchive.DataMap import createArchiverDoc
 
 from TaskWorker import __version__
+from TaskWorker.JobStateStore import JobStateStore
 from TaskWorker.Actions.RetryJob import RetryJob
 from TaskWorker.Actions.RetryJob import JOB_RETURN_CODES
 from ServerUtilities import isFailurePermanent, mostCommon, TRANSFERDB_STATES, PUBLICATIONDB_STATES, encodeRequest, oracleOutputMapping
 from ServerUtilities import getLock, getHashLfn
-from RESTInteractions import CRABRest
+# htcondor, requests, RESTInteractions and the WMCore modules are imported where they are
+# used: many post-job runs (e.g. deferred ones) never need some of them and they are slow
+# to import, see test/benchmarks/bench_wrapperStartup.py
 
 ASO_JOB = None
 G_JOB_REPORT_NAME = None
@@ -121,6 +118,8 @@ G_WMARCHIVE_REPORT_NAME = None
 G_WMARCHIVE_REPORT_NAME_NEW = None
 G_ERROR_SUMMARY_FILE_NAME = "error_summary.json"
 G_FJR_PARSE_RESULTS_FILE_NAME = "task_process/fjr_parse_results.txt"
+G_MAX_FILES_IN_BULK_INJECT = 500
+G_COMPLETED_JOBS_LOG = "automatic_splitting/completed_jobs"  # NB this name is shared with PreDAG
 G_FAKE_OUTDATASET = '/FakeDataset/fakefile-FakePublish-5b6a581e4ddd41b130711a045d5fecb9/USER'
 
 
@@ -344,6 +343,7 @@ class ASOServerJob():
         self.logger = logger
         self.publishname = pubname
         self.docs_in_transfer = None
+        self.job_state = JobStateStore()
         self.crab_retry = crab_retry
         self.retry_timeout = retry_timeout
         self.job_id = job_id
@@ -370,7 +370,8 @@ class ASOServerJob():
         self.rest_url = rest_host + '/crabserver/' + db_instance + '/'  # used in logging
         self.found_doc_in_db = False
         try:
-            self.crabserver = CRABRest(self.rest_host, proxy, proxy, retry=2, userAgent='CRABSchedd')
+            from RESTInteractions import CRABRest  # pylint: disable=import-outside-toplevel
+            self.crabserver = CRABRest(self.rest_host, proxy, proxy, retry=2, userAgent='CRABSchedd', pooled=True)
             self.crabserver.setDbInstance(self.db_instance)
         except Exception as ex:
             msg = "Failed to connect to ASO database via CRABRest: %s" % (str(ex))
@@ -380,13 +381,11 @@ class ASOServerJob():
     # = = = = = ASOServerJob = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
     def save_docs_in_transfer(self):
-        """ The function is used to save into a file the documents we are transfering so
+        """ The function is used to save into the job state store the documents we are transfering so
             we do not have to query the DB to get this list every time the postjob is restarted.
         """
         try:
-            filename = 'transfer_info/docs_in_transfer.%s.%d.json' % (self.job_id, self.crab_retry)
-            with open(filename, 'w') as fd:
-                json.dump(self.docs_in_transfer, fd)
+            self.job_state.saveDocsInTransfer(self.job_id, self.crab_retry, self.docs_in_transfer)
         except:
             #Only printing a generic message, the full stacktrace is printed in execute()
             self.logger.error("Failed to save the docs in transfer. Aborting the postjob")
@@ -395,12 +394,12 @@ class ASOServerJob():
     # = = = = = ASOServerJob = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
     def load_docs_in_transfer(self):
-        """ Function that loads the object saved as a json by save_docs_in_transfer
+        """ Function that loads the object saved by save_docs_in_transfer
         """
         try:
-            filename = 'transfer_info/docs_in_transfer.%s.%d.json' % (self.job_id, self.crab_retry)
-            with open(filename) as fd:
-                self.docs_in_transfer = json.load(fd)
+            self.docs_in_transfer = self.job_state.getDocsInTransfer(self.job_id, self.crab_retry)
+            if self.docs_in_transfer is None:
+                raise KeyError("No docs in transfer saved for job %s retry %d" % (self.job_id, self.crab_retry))
         except Exception as ex:
             #Only printing a generic message, the full stacktrace is printed in execute()
             self.logger.error("Failed to load the docs in transfer. Aborting the postjob")
@@ -634,6 +633,18 @@ class ASOServerJob():
                 outdataset = G_FAKE_OUTDATASET
             file_info['outputdataset'] = outdataset
 
+        # Look up the documents of all the files of this job at once. The first file is the logs archive.
+        source_lfns = [os.path.join(self.source_dir, 'log', filename) for filename in self.filenames[:1]]
+        source_lfns += [os.path.join(self.source_dir, filename) for filename in self.filenames[1:]]
+        try:
+            docs_in_db = self.getDocsByIDs([getHashLfn(source_lfn) for source_lfn in source_lfns])
+        except Exception as ex:
+            msg = "Error loading documents from ASO database: %s" % (str(ex))
+            msg += "\n%s" % (traceback.format_exc())
+            self.logger.error(msg)
+            return False
+        docs_to_commit = []
+
         found_log = False
         # need to process output fils grouped by where they are
         # files may be at different sites if local stageout failed for some
@@ -750,7 +761,9 @@ class ASOServerJob():
                 # job retry) is not yet in ASO database, we need to do the upload.
                 needs_commit = True
                 try:
-                    doc = self.getDocByID(doc_id)
+                    if doc_id not in docs_in_db:
+                        raise NotFound('Document not found in database!')
+                    doc = docs_in_db[doc_id]
                     # The document was already uploaded to ASO database. It could have been
                     # uploaded from the WN in the current job retry or in a previous job retry,
                     # or by the postjob in a previous job retry.
@@ -845,17 +858,14 @@ class ASOServerJob():
                         msg += "\nTraceback unavailable."
                     self.logger.error(msg)
                     return False
-                # If after all we need to upload a new document to ASO database, let's do it.
+                # If after all we need to upload a new document to ASO database, let's do it
+                # (all together, once all files have been looked at).
                 if needs_commit:
                     doc.update(doc_new_info)
                     doc['publish'] = publish
                     msg = "ASO job description: %s" % (pprint.pformat(doc))
                     self.logger.info(msg)
-                    commit_result_msg = self.updateOrInsertDoc(doc, needs_transfer)
-                    if 'error' in commit_result_msg:
-                        msg = "Error injecting document to ASO database:\n%s" % (commit_result_msg)
-                        self.logger.info(msg)
-                        return False
+                    docs_to_commit.append((doc, needs_transfer, doc_id in docs_in_db))
                 # Record all files for which we want the post-job to monitor their transfer.
                 if needs_transfer:
                     doc_info = {'doc_id'     : doc_id,
@@ -863,9 +873,16 @@ class ASOServerJob():
                                 'delayed_publicationflag_update' : delayed_publicationflag_update
                                }
                     docs_in_transfer.append(doc_info)
-                    # Make sure that the fjr has the record of the ASO start transfer time stamp
-                    self.recordASOStartTime()
 
+        if docs_to_commit:
+            commit_result_msg = self.upsertDocs(docs_to_commit)
+            if 'error' in commit_result_msg:
+                msg = "Error injecting document to ASO database:\n%s" % (commit_result_msg)
+                self.logger.info(msg)
+                return False
+        if docs_in_transfer:
+            # Make sure that the fjr has the record of the ASO start transfer time stamp
+            self.recordASOStartTime()
 
         self.logger.info("====== Finished to check uploads to ASO database.")
 
@@ -882,20 +899,52 @@ class ASOServerJob():
             if not docInfo:
                 self.found_doc_in_db = False
                 raise NotFound('Document not found in database')
-            # transfer_state and publication_state is a number in database.
-            docInfo[0]['transfer_state'] = TRANSFERDB_STATES[docInfo[0]['transfer_state']]
-            docInfo[0]['publication_state'] = PUBLICATIONDB_STATES[docInfo[0]['publication_state']]
-            # Also change id to doc_id
-            docInfo[0]['job_id'] = docInfo[0]['id']
             self.found_doc_in_db = True  # This is needed for further if there is a need to update doc info in DB
-            return docInfo[0]
+            return self.formatDocFromDB(docInfo[0])
         self.found_doc_in_db = False
         raise NotFound('Document not found in database!')
 
-    def updateOrInsertDoc(self, doc, toTransfer):
-        """ need a docstring here """
-        returnMsg = {}
-        if not self.found_doc_in_db:
+    def getDocsByIDs(self, doc_ids):
+        """
+        Same as getDocByID for many documents, with one query for each chunk of chunkSize ids.
+        The ids are sent in the body of a POST, in the URL of a GET they would hit the length limit
+        returns: a dictionary {doc_id: document} with the documents which are in the database
+        """
+        chunkSize = 500
+        docInfo = []
+        try:
+            for start in range(0, len(doc_ids), chunkSize):
+                data = encodeRequest({'subresource': 'getByIds', 'ids': doc_ids[start:start + chunkSize]}, ['ids'])
+                docInfo += oracleOutputMapping(self.crabserver.post(api='fileusertransfers', data=data))
+        except HTTPException as hte:
+            if hte.headers.get('X-Error-Http', -1) != '400' or 'subresource' not in hte.headers.get('X-Error-Info', ''):
+                raise
+            self.logger.info("REST does not support getByIds, looking up one document at a time")
+            docs = {}
+            for doc_id in doc_ids:
+                try:
+                    docs[doc_id] = self.getDocByID(doc_id)
+                except NotFound:
+                    pass
+            return docs
+        return dict((doc['id'], self.formatDocFromDB(doc)) for doc in docInfo)
+
+    @staticmethod
+    def formatDocFromDB(doc):
+        """ adapt a document returned by oracleOutputMapping to what inject_to_aso expects """
+        # transfer_state and publication_state is a number in database.
+        doc['transfer_state'] = TRANSFERDB_STATES[doc['transfer_state']]
+        doc['publication_state'] = PUBLICATIONDB_STATES[doc['publication_state']]
+        # Also change id to doc_id
+        doc['job_id'] = doc['id']
+        return doc
+
+    def makeTransferDoc(self, doc, found_in_db):
+        """
+        The document to upload to the transfers database for an ASO job description doc,
+        with a PUT if it is not there yet, else with an updateDoc POST.
+        """
+        if not found_in_db:
             # This means that it was not founded in DB and we will have to insert new doc
             newDoc = {'id': doc['_id'],
                       'username': doc['user'],
@@ -913,6 +962,121 @@ class ASOServerJob():
                       'job_retry_count': doc['job_retry_count'],
                       'type': doc['type'],
                       }
+        else:
+            # This means it is in database and we need only update specific fields.
+            newDoc = {'id': doc['id'],
+                      'username': doc['username'],
+                      'taskname': doc['taskname'],
+                      'start_time': self.aso_start_timestamp,
+                      'source': doc['source'],
+                      'source_lfn': doc['source_lfn'],
+                      'filesize': doc['filesize'],
+                      'transfer_state': doc.get('state', 'NEW').upper(),
+                      'publish': doc['publish'],
+                      'publication_state': 'NEW' if doc['publish'] else 'NOT_REQUIRED',
+                      'job_id': doc['jobid'],
+                      'job_retry_count': doc['job_retry_count'],
+                      'transfer_retry_count': 0,
+                      'subresource': 'updateDoc'}
+        return newDoc
+
+    def makeTransferLine(self, newDoc, doc, toTransfer):
+        """
+        The line for task_process/transfers.txt (if toTransfer) or transfers_direct.txt
+        describing the document newDoc (see makeTransferDoc) made from doc.
+        """
+        if not 'publishname' in newDoc:
+            newDoc['publishname'] = self.publishname
+        if not 'checksums' in newDoc:
+            newDoc['checksums'] = doc['checksums']
+        if not 'destination_lfn' in newDoc:
+            newDoc['destination_lfn'] = doc['destination_lfn']
+        if not 'destination' in newDoc:
+            newDoc['destination'] = doc['destination']
+        if toTransfer:
+            if not 'outputdataset' in newDoc:
+                newDoc['outputdataset'] = doc['outputdataset']
+            # Rucio ASO requires the "type" field to handle the log transfers.
+            if not 'type' in newDoc:
+                newDoc['type'] = doc['type']
+        return json.dumps(newDoc) + "\n"
+
+    def writeTransferLines(self, lines, toTransfer):
+        """
+        Append lines to task_process/transfers.txt (if toTransfer) or transfers_direct.txt
+        with a single write: other PostJobs append to the same file at the same time and
+        the readers must never see part of the lines of a job.
+        """
+        fileName = 'task_process/transfers.txt' if toTransfer else 'task_process/transfers_direct.txt'
+        fd = os.open(fileName, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, ''.join(lines).encode('utf-8'))
+        finally:
+            os.close(fd)
+        if not os.path.exists('task_process/RestInfoForFileTransfers.json'):
+        #if not os.path.exists('task_process/rest_filetransfers.txt'):
+            restInfo = {'host':self.rest_host,
+                        'dbInstance': self.db_instance,
+                        'proxyfile': self.proxy}
+            with open('task_process/RestInfoForFileTransfers.json', 'w') as fp:
+                json.dump(restInfo, fp)
+
+    def upsertDocs(self, docs):
+        """
+        Same as updateOrInsertDoc for a list of (doc, toTransfer, found_in_db) tuples, with one
+        upsertDocs call to the REST, then one write of all the lines to each of transfers.txt
+        and transfers_direct.txt. If the REST does not know upsertDocs yet, fall back to
+        updateOrInsertDoc for each document.
+        """
+        returnMsg = {}
+        newDocs = [self.makeTransferDoc(doc, found_in_db) for doc, _, found_in_db in docs]
+        restDocs = []
+        for newDoc, (doc, _, _) in zip(newDocs, docs):
+            restDoc = dict(newDoc)
+            restDoc.pop('subresource', None)
+            # documents already in the database do not have these in newDoc, but they are required
+            for key in ['destination', 'destination_lfn', 'type']:
+                restDoc.setdefault(key, doc[key])
+            # make sure that asoworker field in transfersdb is always filled, see updateOrInsertDoc
+            restDoc['asoworker'] = 'schedd'
+            restDocs.append(restDoc)
+        try:
+            result = self.crabserver.post(api='fileusertransfers',
+                                          data=encodeRequest({'subresource': 'upsertDocs', 'docs': json.dumps(restDocs)}))
+        except HTTPException as hte:
+            if hte.headers.get('X-Error-Http', -1) == '400' and 'subresource' in hte.headers.get('X-Error-Info', ''):
+                self.logger.info("REST does not support upsertDocs, uploading one document at a time")
+                for doc, toTransfer, found_in_db in docs:
+                    self.found_doc_in_db = found_in_db
+                    returnMsg = self.updateOrInsertDoc(doc, toTransfer)
+                    if 'error' in returnMsg:
+                        break
+                return returnMsg
+            msg = "Error uploading documents to database."
+            msg += " Transfer submission failed."
+            msg += "\n%s" % (str(hte.headers))
+            returnMsg['error'] = msg
+            return returnMsg
+        failed = dict((item['id'], item['error']) for item in result[0]['result'] if item['result'] == 'failed')
+        if failed:
+            msg = "Error uploading documents to database."
+            msg += " Transfer submission failed for:"
+            for doc_id, error in failed.items():
+                msg += "\n%s: %s" % (doc_id, error)
+            returnMsg['error'] = msg
+        # as when documents are uploaded one at a time, the ones which made it are recorded
+        for toTransfer in (True, False):
+            lines = [self.makeTransferLine(newDoc, doc, toTransfer) for newDoc, (doc, docToTransfer, _) in zip(newDocs, docs)
+                     if docToTransfer == toTransfer and newDoc['id'] not in failed]
+            if lines:
+                self.writeTransferLines(lines, toTransfer)
+        return returnMsg
+
+    def updateOrInsertDoc(self, doc, toTransfer):
+        """ need a docstring here """
+        returnMsg = {}
+        newDoc = self.makeTransferDoc(doc, self.found_doc_in_db)
+        if not self.found_doc_in_db:
             try:
                 self.crabserver.put(api='fileusertransfers', data=encodeRequest(newDoc))
             except HTTPException as hte:
@@ -938,21 +1102,6 @@ class ASOServerJob():
                 msg += "\n%s" % (str(hte.headers))
                 returnMsg['error'] = msg
         else:
-            # This means it is in database and we need only update specific fields.
-            newDoc = {'id': doc['id'],
-                      'username': doc['username'],
-                      'taskname': doc['taskname'],
-                      'start_time': self.aso_start_timestamp,
-                      'source': doc['source'],
-                      'source_lfn': doc['source_lfn'],
-                      'filesize': doc['filesize'],
-                      'transfer_state': doc.get('state', 'NEW').upper(),
-                      'publish': doc['publish'],
-                      'publication_state': 'NEW' if doc['publish'] else 'NOT_REQUIRED',
-                      'job_id': doc['jobid'],
-                      'job_retry_count': doc['job_retry_count'],
-                      'transfer_retry_count': 0,
-                      'subresource': 'updateDoc'}
             try:
                 self.crabserver.post(api='fileusertransfers', data=encodeRequest(newDoc))
             except HTTPException as hte:
@@ -974,49 +1123,7 @@ class ASOServerJob():
                 msg += " Transfer submission failed."
                 msg += "\n%s" % (str(hte.headers))
                 returnMsg['error'] = msg
-        if toTransfer:
-            if not 'publishname' in newDoc:
-                newDoc['publishname'] = self.publishname
-            if not 'checksums' in newDoc:
-                newDoc['checksums'] = doc['checksums']
-            if not 'destination_lfn' in newDoc:
-                newDoc['destination_lfn'] = doc['destination_lfn']
-            if not 'destination' in newDoc:
-                newDoc['destination'] = doc['destination']
-            if not 'outputdataset' in newDoc:
-                newDoc['outputdataset'] = doc['outputdataset']
-            # Rucio ASO requires the "type" field to handle the log transfers.
-            if not 'type' in newDoc:
-                newDoc['type'] = doc['type']
-            with open('task_process/transfers.txt', 'a+') as transfers_file:
-                transfer_dump = json.dumps(newDoc)
-                transfers_file.write(transfer_dump+"\n")
-            if not os.path.exists('task_process/RestInfoForFileTransfers.json'):
-            #if not os.path.exists('task_process/rest_filetransfers.txt'):
-                restInfo = {'host':self.rest_host,
-                            'dbInstance': self.db_instance,
-                            'proxyfile': self.proxy}
-                with open('task_process/RestInfoForFileTransfers.json', 'w') as fp:
-                    json.dump(restInfo, fp)
-        else:
-            if not 'publishname' in newDoc:
-                newDoc['publishname'] = self.publishname
-            if not 'checksums' in newDoc:
-                newDoc['checksums'] = doc['checksums']
-            if not 'destination_lfn' in newDoc:
-                newDoc['destination_lfn'] = doc['destination_lfn']
-            if not 'destination' in newDoc:
-                newDoc['destination'] = doc['destination']
-            with open('task_process/transfers_direct.txt', 'a+') as transfers_file:
-                transfer_dump = json.dumps(newDoc)
-                transfers_file.write(transfer_dump+"\n")
-            if not os.path.exists('task_process/RestInfoForFileTransfers.json'):
-            #if not os.path.exists('task_process/rest_filetransfers.txt'):
-                restInfo = {'host':self.rest_host,
-                            'dbInstance': self.db_instance,
-                            'proxyfile': self.proxy}
-                with open('task_process/RestInfoForFileTransfers.json','w') as fp:
-                    json.dump(restInfo, fp)
+        self.writeTransferLines([self.makeTransferLine(newDoc, doc, toTransfer)], toTransfer)
         return returnMsg
 
     # = = = = = ASOServerJob = = = = = = = = = = = = = = = = = = = = = = = = = = = =
@@ -1352,7 +1459,8 @@ class PostJob():
         # ID is -1 (and the $RETURN argument macro is -1004). This is just the first
         # number in self.dag_jobid.
         self.dag_clusterid       = None
-        self.schedd = htcondor.Schedd()
+        # htcondor.Schedd(), made when first needed (see the schedd property)
+        self._schedd             = None
 
         # Set a logger for the post-job. Use a memory handler by default. Once we know
         # the name of the log file where all the logging should go, we will flush the
@@ -1368,51 +1476,26 @@ class PostJob():
         self.logger.addHandler(self.memory_handler)
         self.logger.propagate = False
         self.postjob_log_file_name = None
+        # deferrals, retries and automatic splitting data of all the jobs of the task
+        self.job_state = JobStateStore()
 
     # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
-    def get_defer_num(self):
-
-        DEFER_INFO_FILE = 'defer_info/defer_num.%s.%d.txt' % (self.job_id, self.dag_retry)
-        defer_num = 0
+    @property
+    def schedd(self):
+        if self._schedd is None:
+            import htcondor  # pylint: disable=import-outside-toplevel
+            self._schedd = htcondor.Schedd()
+        return self._schedd
 
-        #read retry number
-        if os.path.exists(DEFER_INFO_FILE):
-            try:
-                with open(DEFER_INFO_FILE) as fd:
-                    line = fd.readline().strip()
-                    #Protect from empty files, see https://github.com/dmwm/CRABServer/issues/5199
-                    if line:
-                        defer_num = int(line)
-                    else:
-                        #if the line is empty we are sure it's the first try. See comment 10 lines below
-                        defer_num = 0
-            except IOError as e:
-                self.logger.error("I/O error(%d): %s", e.errno, e.strerror)
-                raise
-            except ValueError:
-                self.logger.error("Could not convert data to an integer.")
-                raise
-            except:
-                self.logger.exception("Unexpected error: %s", sys.exc_info()[0])
-                raise
-        else:
-            #create the file if it does not exist
-            with open(DEFER_INFO_FILE, 'w') as dummyFD:
-                pass
+    # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
+    def get_defer_num(self):
 
-        #update retry number
+        # read and increase the deferral number in one transaction, so it is never lost nor counted twice
         try:
-            #open in rb+ mode instead of w so if the schedd crashes between the open and the write
-            #we do not end up with an empty (corrupted) file. (Well, this can only happens the first try)
-            with open(DEFER_INFO_FILE, 'r+') as fd:
-                #put some spaces to overwrite possibly longer numbers (should never happen, but..)
-                fd.write(str(defer_num + 1) + ' '*10)
-        except IOError as e:
-            self.logger.error("I/O error(%d): %s", e.errno, e.strerror)
-            raise
-        except:
+            defer_num = self.job_state.nextDeferNum(self.job_id, self.dag_retry)
+        except Exception:
             self.logger.exception("Unexpected error: %s", sys.exc_info()[0])
             raise
 
@@ -1523,6 +1606,8 @@ class PostJob():
 
     def reportReadBranches(self, branchList=None, username=None, inputDataset=None, taskName=None):
         """ send to MONIT / ElasticSearch the list of Read Branches """
+        import requests  # pylint: disable=import-outside-toplevel
+        from requests.auth import HTTPBasicAuth  # pylint: disable=import-outside-toplevel
 
         # get secrets
         secrets = None
@@ -1737,6 +1822,12 @@ class PostJob():
         # the jobs has failed).
         retval = self.check_abort_dag(retval)
 
+        # Let PreDAG know how many jobs of this stage are done.
+        try:
+            self.recordCompletion(retval)
+        except Exception:
+            self.logger.exception("Failed to record the job completion for automatic splitting.")
+
         # If return value is not 0 (success) write env variables to a file if it is not
         # present and print job ads in PostJob log file.
         # All this information is useful for debugging purpose.
@@ -1843,6 +1934,29 @@ class PostJob():
 
     # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
+    def recordCompletion(self, retval):
+        """
+        For automatic splitting, append the job id and its state (finished, or failed if
+        DAGMan will not retry it) to the completed jobs log which PreDAG reads to know
+        when enough probe or processing jobs are done. The line is written with a single
+        write on a file opened in append mode, so lines of concurrent post-jobs do not mix.
+        """
+        if self.stage not in ('probe', 'processing'):
+            return
+        if retval == JOB_RETURN_CODES.OK:
+            state = 'finished'
+        elif retval == JOB_RETURN_CODES.RECOVERABLE_ERROR and self.dag_retry < self.max_retries:
+            return
+        else:
+            state = 'failed'
+        if not os.path.exists(os.path.dirname(G_COMPLETED_JOBS_LOG)):
+            os.makedirs(os.path.dirname(G_COMPLETED_JOBS_LOG))
+        fd = os.open(G_COMPLETED_JOBS_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, ("%s %s\n" % (self.job_id, state)).encode())
+        finally:
+            os.close(fd)
+
     def saveAutomaticSplittingData(self):
         """
         Sets the run, lumi information in the task information for the
@@ -1852,25 +1966,22 @@ class PostJob():
         if self.stage not in ('probe', 'processing'):
             return
 
-        throughputFileName = "automatic_splitting/throughputs/{0}".format(self.job_id)
-        if not os.path.exists(os.path.dirname(throughputFileName)):
-            os.makedirs(os.path.dirname(throughputFileName))
-        with open(throughputFileName, 'w') as fd:
-            report = self.job_report['steps']['cmsRun']
-            throughput = float(report['performance']['cpu'].get('EventThroughput', 0))
+        report = self.job_report['steps']['cmsRun']
+        throughput = float(report['performance']['cpu'].get('EventThroughput', 0))
 
-            def valid(fi):
-                return fi['input_source_class'] == 'PoolSource' and fi.get('input_type', '') == "primaryFiles"
+        def valid(fi):
+            return fi['input_source_class'] == 'PoolSource' and fi.get('input_type', '') == "primaryFiles"
 
-            outsize = sum(fi['outsize'] for fi in self.output_files_info)  # in bytes
-            events = sum(fi.get('events', 0) for fi in report['input']['source'] if valid(fi))
+        outsize = sum(fi['outsize'] for fi in self.output_files_info)  # in bytes
+        events = sum(fi.get('events', 0) for fi in report['input']['source'] if valid(fi))
 
-            eventsize = (outsize // events + 1) if events > 0 else 0  # do not round to zero small eventsize
+        eventsize = (outsize // events + 1) if events > 0 else 0  # do not round to zero small eventsize
 
-            json.dump([throughput, eventsize], fd)
+        self.job_state.saveThroughput(self.job_id, throughput, eventsize)
 
         if self.stage == 'probe':
             return
+        from WMCore.DataStructs.LumiList import LumiList  # pylint: disable=import-outside-toplevel
         self.logger.info("====== Starting to parse the lumi file")
         try:
             tmpdir = tempfile.mkdtemp()
@@ -2083,10 +2194,11 @@ class PostJob():
             self.transfer_outputs = 0
 
         # Initialize the object we will use for making requests to the REST interface.
+        from RESTInteractions import CRABRest  # pylint: disable=import-outside-toplevel
         self.crabserver = CRABRest(self.rest_host, \
                                    os.environ['X509_USER_PROXY'], \
                                    os.environ['X509_USER_PROXY'], \
-                                   retry=2, logger=self.logger, userAgent='CRABSchedd')
+                                   retry=2, logger=self.logger, userAgent='CRABSchedd', pooled=True)
         self.crabserver.setDbInstance(self.db_instance)
 
 
@@ -2444,6 +2556,7 @@ class PostJob():
         Upload the (primary) input files metadata. We care about the number of events
         and about the lumis for the report.
         """
+        from WMCore import Lexicon  # pylint: disable=import-outside-toplevel
         if os.environ.get('TEST_POSTJOB_NO_STATUS_UPDATE', False):
             return
         temp_storage_site = self.executed_site
@@ -2453,6 +2566,7 @@ class PostJob():
             self.logger.info("Skipping input filemetadata upload as no inputs were found")
             return
         direct_stageout = int(self.job_report.get('direct_stageout', 0))
+        records = []
         for ifile in self.job_report['steps']['cmsRun']['input']['source']:
             if ifile['input_source_class'] != 'PoolSource' or ifile.get('input_type', '') != "primaryFiles":
                 continue
@@ -2493,25 +2607,12 @@ class PostJob():
             for run, lumis in ifile['runs'].items():
                 outfileruns.append(str(run))
                 outfilelumis.append(','.join(map(str, lumis)))
+            configreq['outfileruns'] = outfileruns
+            configreq['outfilelumis'] = outfilelumis
+            records.append(configreq)
 
-            # make a real list of (k,v) pairs as rest_api requires (not sure pylint is right to complain !)
-            configreq = [item for item in configreq.items()]  # pylint: disable=unnecessary-comprehension
-            #configreq['outfileruns'] = [run for run in outfileruns]
-            #configreq['outfilelumis'] = [lumis for lumis in outfilelumis]
-            for run in outfileruns:
-                configreq.append(("outfileruns", run))
-            for lumis in outfilelumis:
-                configreq.append(("outfilelumis", lumis))
-
-            rest_api = 'filemetadata'
-            msg = "Uploading input metadata for %s to https://%s: %s" % (lfn, self.rest_url+rest_api, configreq)
-            self.logger.debug(msg)
-            try:
-                self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
-            except HTTPException as hte:
-                msg = "Error uploading input file metadata: %s" % (str(hte.headers))
-                self.logger.error(msg)
-                raise
+        if records:
+            self.upload_files_metadata(records, 'input')
 
     # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
@@ -2522,6 +2623,7 @@ class PostJob():
         if os.environ.get('TEST_POSTJOB_NO_STATUS_UPDATE', False):
             return
         output_datasets = set()
+        records = []
         for file_info in self.output_files_info:
             outdataset = file_info['output_dataset']
             if not 'FakeDataset' in outdataset:
@@ -2551,31 +2653,77 @@ class PostJob():
                          'directstageout'  : int(file_info['direct_stageout']),
                          'globalTag'       : 'None'
                         }
-            # make a real list of (k,v) pairs as rest_api requires (not sure pylint is rigth to complain !)
-            configreq = [item for item in configreq.items()]  # pylint: disable=unnecessary-comprehension
-            #configreq = configreq.items()
             if 'outfileruns' in file_info:
-                for run in file_info['outfileruns']:
-                    configreq.append(("outfileruns", run))
+                configreq['outfileruns'] = list(file_info['outfileruns'])
             if 'outfilelumis' in file_info:
-                for lumis in file_info['outfilelumis']:
-                    configreq.append(("outfilelumis", lumis))
+                configreq['outfilelumis'] = list(file_info['outfilelumis'])
             if 'inparentlfns' in file_info:
-                for lfn in file_info['inparentlfns']:
-                    # If the user specified a PFN as input, then the LFN is an empty string
-                    # and does not pass validation.
-                    if lfn:
-                        configreq.append(("inparentlfns", lfn))
-            filename = file_info['pfn'].split('/')[-1]
-            rest_api = 'filemetadata'
-            msg = "Uploading output metadata for %s to https://%s: %s" % (filename, self.rest_url+rest_api, configreq)
-            self.logger.debug(msg)
+                # If the user specified a PFN as input, then the LFN is an empty string
+                # and does not pass validation.
+                configreq['inparentlfns'] = [lfn for lfn in file_info['inparentlfns'] if lfn]
+            records.append(configreq)
+
+        if records:
+            self.upload_files_metadata(records, 'output')
+
+    # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+    def upload_files_metadata(self, records, kind):
+        """
+        Upload the metadata of many files (a list of dictionaries with the parameters
+        of a filemetadata PUT) with one call to the bulkinject subresource of filemetadata.
+        If the REST does not know that subresource yet, fall back to one PUT per file.
+        Raise an exception naming the files whose upload failed.
+        """
+        rest_api = 'filemetadata'
+        for record in records:
+            self.logger.debug("Uploading %s metadata for %s to https://%s: %s",
+                              kind, record['outlfn'], self.rest_url+rest_api, record)
+        results = []
+        # the REST accepts at most 1000 files per call, jobs with more than that are very rare
+        for start in range(0, len(records), G_MAX_FILES_IN_BULK_INJECT):
+            chunk = records[start:start + G_MAX_FILES_IN_BULK_INJECT]
+            configreq = {'taskname': chunk[0]['taskname'], 'subresource': 'bulkinject', 'files': json.dumps(chunk)}
+            try:
+                results.extend(self.crabserver.post(api=rest_api, data=encodeRequest(configreq))[0]['result'])
+            except HTTPException as hte:
+                if hte.headers.get('X-Error-Http', -1) == '400' and 'subresource' in hte.headers.get('X-Error-Info', ''):
+                    self.logger.info("REST does not support bulk filemetadata upload, uploading one file at a time")
+                    self.put_files_metadata(records[start:], kind)
+                    break
+                msg = "Error uploading %s files metadata: %s" % (kind, str(hte.headers))
+                self.logger.error(msg)
+                raise
+        failed = [result for result in results if result['result'] == 'failed']
+        self.logger.info("Uploaded metadata of %d %s files (%d failed)", len(results), kind, len(failed))
+        for result in failed:
+            self.logger.error("Error uploading %s file metadata for %s: %s", kind, result['lfn'], result['error'])
+        if failed:
+            msg = "Upload of %s files metadata failed for %d file(s): %s"
+            msg = msg % (kind, len(failed), ', '.join(result['lfn'] for result in failed))
+            raise RuntimeError(msg)
+
+    # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
+
+    def put_files_metadata(self, records, kind):
+        """
+        Upload the metadata of many files with one filemetadata PUT per file.
+        """
+        rest_api = 'filemetadata'
+        for record in records:
+            # make a real list of (k,v) pairs as rest_api requires, with one pair per element of list values
+            configreq = []
+            for key, value in record.items():
+                if isinstance(value, list):
+                    configreq.extend((key, item) for item in value)
+                else:
+                    configreq.append((key, value))
             try:
                 self.crabserver.put(api=rest_api, data=encodeRequest(configreq))
             except HTTPException as hte:
                 # BrianB. Suppressing this exception is a tough decision.
                 # If the file made it back alright, I suppose we can proceed.
-                msg = "Error uploading output file metadata: %s" % (str(hte.headers))
+                msg = "Error uploading %s file metadata for %s: %s" % (kind, record['outlfn'], str(hte.headers))
                 self.logger.error(msg)
                 raise
 
@@ -2895,6 +3043,7 @@ class PostJob():
             except Exception:
                 pass  # caller is not equipped for dealing with exceptions from this method
             return
+        import htcondor  # pylint: disable=import-outside-toplevel
         self.logger.info("====== Starting to update job ClassAd.")
         msg = "status: %s." % (state)
         params = {'CRAB_PostJobStatus': '"{0}"'.format(state)}
@@ -2980,33 +3129,23 @@ class PostJob():
         """
         Calculate the retry number we're on. See the notes in PreJob.
         """
-        fname = "retry_info/job.%s.txt" % (self.job_id)
-        if os.path.exists(fname):
-            try:
-                with open(fname, 'r') as fd:
-                    retry_info = json.load(fd)
-            except Exception:
-                msg = "Unable to calculate post-job retry count."
-                msg += " Failed to load file %s." % (fname)
-                msg += "\nDetails follow:"
-                self.logger.exception(msg)
-                return 1, None
-        else:
-            retry_info = {'pre': 0, 'post': 0}
-        if 'pre' not in retry_info or 'post' not in retry_info:
+        try:
+            retry_info = self.job_state.getRetryInfo(self.job_id)
+        except Exception:
             msg = "Unable to calculate post-job retry count."
-            msg += " File %s doesn't contain the expected information." % (fname)
-            self.logger.warning(msg)
+            msg += " Failed to load the retry info of job %s." % (self.job_id)
+            msg += "\nDetails follow:"
+            self.logger.exception(msg)
             return 1, None
+        if retry_info is None:
+            retry_info = {'pre': 0, 'post': 0}
         if first_pj_execution():
             crab_retry = retry_info['post']
             retry_info['post'] += 1
             try:
-                with open(fname + '.tmp', 'w') as fd:
-                    json.dump(retry_info, fd)
-                os.rename(fname + '.tmp', fname)
+                self.job_state.saveRetryInfo(self.job_id, retry_info)
             except Exception:
-                msg = "Failed to update file %s with increased post-job count by +1." % (fname)
+                msg = "Failed to update the retry info of job %s with increased post-job count by +1." % (self.job_id)
                 msg += "\nDetails follow:"
                 self.logger.exception(msg)
                 return 1, crab_retry
@@ -3084,6 +3223,7 @@ class PostJob():
     # = = = = = PostJob = = = = = = = = = = = = = = = = = = = = = = = = = = = = = =
 
     def processWMArchive(self, retval):
+        from WMCore.Services.WMArchive.DataMap import createArchiverDoc  # pylint: disable=import-outside-toplevel
         try:
             with open("/etc/wmarchive.json") as wma:
                 WMARCHIVE_BASE_LOCATION = json.load(wma).get("BASE_DIR", "/data/wmarchive")
@@ -23,6 +23,7 @@ import os
 import re
 import sys
 import json
+import time
 import copy
 import errno
 import pickle
@@ -36,16 +37,17 @@ from ast import literal_eval
 
 import classad
 
-from WMCore.DataStructs.LumiList import LumiList
-
 from ServerUtilities import getLock, newX509env, MAX_IDLE_JOBS, MAX_POST_JOBS
-from RESTInteractions import CRABRest
-from RucioUtils import getNativeRucioClient
-from TaskWorker.Actions.Splitter import Splitter
-from TaskWorker.Actions.DagmanCreator import DagmanCreator
-from TaskWorker.Actions.Recurring.BanDestinationSites import CRAB3BanDestinationSites
 from TaskWorker.WorkerExceptions import TaskWorkerException
-from TaskWorker.Worker import failTask
+from TaskWorker.JobStateStore import JobStateStore
+# WMCore, RESTInteractions, Rucio and the TaskWorker actions are imported only once the
+# completion threshold is reached: most PreDAG runs defer before that, see PostJob
+
+# job ids of the jobs whose completion triggers each stage
+STAGE_JOBS_RE = {'processing': re.compile(r"^0-\d+$"),
+                 'tail': re.compile(r"^[1-9]\d*$")}
+COMPLETED_JOBS_LOG = "automatic_splitting/completed_jobs"  # NB this name is shared with PostJob
+FULL_CHECK_INTERVAL = 1800
 
 
 class PreDAG():
@@ -59,6 +61,8 @@ class PreDAG():
         self.statusCacheInfo = None
         self.processedJobs = None
         self.failedJobs = []
+        # compact list of the lumis to process in the tail stage, set by adjustLumisForCompletion
+        self.missingLumis = None
         self.logger = logging.getLogger()
         handler = logging.StreamHandler(sys.stdout)
         formatter = logging.Formatter("%(asctime)s:%(levelname)s:%(module)s %(message)s", \
@@ -76,6 +80,7 @@ class PreDAG():
         (copy some code from PostJob.py). Get user proxy from
         X509_USER_PROXY environment variable.
         """
+        from RESTInteractions import CRABRest  # pylint: disable=import-outside-toplevel
         proxy = os.environ['X509_USER_PROXY']
         self.crabserver = CRABRest(restHost, proxy, proxy, retry=20,
                                    logger=self.logger, userAgent='CRABSchedd')
@@ -110,19 +115,54 @@ class PreDAG():
         """Yield job IDs of completed (finished or failed) jobs.  All
         failed jobs are saved in self.failedJobs, too.
         """
-        stagere = {}
-        stagere['processing'] = re.compile(r"^0-\d+$")
-        stagere['tail'] = re.compile(r"^[1-9]\d*$")
         completedCount = 0
         for jobnr, jobdict in self.statusCacheInfo.items():
             state = jobdict.get('State')
-            if stagere[stage].match(jobnr) and state in ('finished', 'failed'):
+            if STAGE_JOBS_RE[stage].match(jobnr) and state in ('finished', 'failed'):
                 if state == 'failed' and processFailed:
                     self.failedJobs.append(jobnr)
                 completedCount += 1
                 yield jobnr
         self.logger.info("found %s completed jobs", completedCount)
 
+    def checkCompletedJobsLog(self):
+        """
+        Cheap check done before reading the status cache: add the entries which PostJob
+        appended to the completed jobs log since the last run of this PreDAG to those seen
+        so far (kept, with the position in the log, in a checkpoint file) and count the
+        completed jobs of the stage we wait for.
+        Returns False if not enough jobs completed yet, True if the status cache must be read.
+        The status cache is read anyhow every FULL_CHECK_INTERVAL seconds, in case some
+        job completed without its post-job writing to the log.
+        """
+        if not os.path.exists(COMPLETED_JOBS_LOG):
+            # task submitted before the log was introduced, or no job completed yet
+            return True
+        checkpointName = f"{COMPLETED_JOBS_LOG}.{self.prefix}.checkpoint"
+        try:
+            with open(checkpointName, 'r', encoding='utf-8') as fd:
+                checkpoint = json.load(fd)
+        except (IOError, ValueError):
+            checkpoint = {'offset': 0, 'jobs': {}, 'lastFullCheck': 0}
+        with open(COMPLETED_JOBS_LOG, 'rb') as fd:
+            fd.seek(checkpoint['offset'])
+            for line in fd:
+                if not line.endswith(b'\n'):
+                    break  # being written right now, will read it next time
+                checkpoint['offset'] += len(line)
+                jobId, state = line.decode().split()
+                if STAGE_JOBS_RE[self.stage].match(jobId):
+                    checkpoint['jobs'][jobId] = state
+        enough = len(checkpoint['jobs']) >= self.completion
+        fullCheck = enough or time.time() - checkpoint['lastFullCheck'] > FULL_CHECK_INTERVAL
+        if fullCheck:
+            checkpoint['lastFullCheck'] = time.time()
+        with open(checkpointName + '.tmp', 'w', encoding='utf-8') as fd:
+            json.dump(checkpoint, fd)
+        os.rename(checkpointName + '.tmp', checkpointName)
+        self.logger.info("completed jobs log: %d of %d jobs completed", len(checkpoint['jobs']), self.completion)
+        return fullCheck
+
     def execute(self, *args):
         """Excecute executeInternal in locked mode
         """
@@ -167,6 +207,8 @@ class PreDAG():
 
         self.statusCacheInfo = {} #Will be filled with the status from the status cache
 
+        if not self.checkCompletedJobsLog():
+            return 4
         self.readJobStatus()
         completed = set(self.completedJobs(stage=self.stage))
         if len(completed) < self.completion:
@@ -199,8 +241,7 @@ class PreDAG():
         self.logger.info("jobs remaining to process: %s", ", ".join(sorted(unprocessed)))
 
         # The TaskWorker saves some files that now we are gonna read
-        with open('datadiscovery.pkl', 'rb') as fd:
-            dataset = pickle.load(fd) #Output from the discovery process
+        # (the output of the discovery process is loaded later, when we know which part of it is needed)
         with open('taskinformation.pkl', 'rb') as fd:
             task = pickle.load(fd) #A dictionary containing information about the task as in the Oracle DB
         with open('taskworkerconfig.pkl', 'rb') as fd:
@@ -223,26 +264,25 @@ class PreDAG():
         config.TaskWorker.scratchDir = './scratchdir'
         if not os.path.exists(config.TaskWorker.scratchDir):
             os.makedirs(config.TaskWorker.scratchDir)
+        from TaskWorker.Actions.Recurring.BanDestinationSites import CRAB3BanDestinationSites  # pylint: disable=import-outside-toplevel
         banSites = CRAB3BanDestinationSites(config, self.logger)
         with config.TaskWorker.envForCMSWEB:
             banSites.execute()
 
-        # Read the automatic_splitting/throughputs/0-N files where the PJ
-        # saved the EventThroughput
+        # Read the EventThroughput
         # (report['steps']['cmsRun']['performance']['cpu']['EventThroughput'])
-        # and the average size of the output per event
+        # and the average size of the output per event which the PJ saved for jobs 0-N
         sumEventsThr = 0
         sumEventsSize = 0
         count = 0
+        throughputs = JobStateStore().getThroughputs(estimates)
         for jid in estimates:
             if jid in self.failedJobs:
                 continue
-            fn = f"automatic_splitting/throughputs/{jid}"
-            with open(fn, 'r', encoding='utf-8') as fd:
-                throughput, eventsize = json.load(fd)
-                sumEventsThr += throughput
-                sumEventsSize += eventsize
-                count += 1
+            throughput, eventsize = throughputs[jid]
+            sumEventsThr += throughput
+            sumEventsSize += eventsize
+            count += 1
         if count:
             eventsThr = sumEventsThr / count
             eventsSize = sumEventsSize / count
@@ -286,6 +326,7 @@ class PreDAG():
             self.logger.info("nothing to process for completion")
             self.saveProcessedJobs(unprocessed)
             return 0
+        dataset = self.loadDataset()
 
         # Disable retries for processing: every lumi is attempted to be
         # processed once in processing, thrice in the tails -> four times.
@@ -295,6 +336,12 @@ class PreDAG():
         if self.stage == "processing":
             config.TaskWorker.numAutomJobRetries = 0
 
+        # pylint: disable=import-outside-toplevel
+        from RucioUtils import getNativeRucioClient
+        from TaskWorker.Actions.Splitter import Splitter
+        from TaskWorker.Actions.DagmanCreator import DagmanCreator
+        from TaskWorker.Worker import failTask
+        # pylint: enable=import-outside-toplevel
         try:
             splitter = Splitter(config, crabserver=None)
             splitResult = splitter.execute(dataset, task=splitTask)
@@ -354,6 +401,7 @@ class PreDAG():
         if len(available) == 0 and len(failed) == 0:
             return False
 
+        from WMCore.DataStructs.LumiList import LumiList  # pylint: disable=import-outside-toplevel
         missing = LumiList()
         for missingFile in available:
             with open(os.path.join(missingDir, missingFile), 'r', encoding='utf-8') as fd:
@@ -384,8 +432,23 @@ class PreDAG():
 
         task['tm_split_args']['runs'] = runs
         task['tm_split_args']['lumis'] = lumis
+        self.missingLumis = missignCompact
 
         return True
 
+    def loadDataset(self):
+        """
+        Load the output of the data discovery saved by the TaskWorker: only the files which
+        contain missing lumis in the tail stage, all of them otherwise.
+        Tasks submitted before the indexed format was introduced only have the pickle.
+        """
+        from TaskWorker.FilesetStore import loadFileset, FILESET_DB  # pylint: disable=import-outside-toplevel
+        if not os.path.exists(FILESET_DB):
+            with open('datadiscovery.pkl', 'rb') as fd:
+                return pickle.load(fd)
+        dataset = loadFileset(FILESET_DB, lumiMask=self.missingLumis)
+        self.logger.info("Loaded %d files from %s", len(dataset.getFiles()), FILESET_DB)
+        return dataset
+
 if __name__ == '__main__':
     sys.exit(PreDAG().execute(sys.argv[1:]))
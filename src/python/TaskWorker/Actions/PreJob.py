@@ -6,13 +6,12 @@ import json
 import errno
 import classad
 import logging
-import htcondor
 from ast import literal_eval
 
 from ServerUtilities import getWebdirForDb, insertJobIdSid
+from TaskWorker.JobStateStore import JobStateStore
 from TaskWorker.Actions.RetryJob import JOB_RETURN_CODES
-
-import CMSGroupMapper
+# htcondor and CMSGroupMapper (ldap) are imported only where they are needed, see PostJob
 
 class PreJob:
     """
@@ -31,6 +30,7 @@ class PreJob:
         self.userWebDirPrx = ""
         self.resubmit_info = {}
         self.prejob_exit_code = None
+        self.job_state = JobStateStore()
         ## Set a logger for the pre-job.
         self.logger = logging.getLogger()
         handler = logging.StreamHandler(sys.stdout)
@@ -54,27 +54,17 @@ class PreJob:
         """
         retmsg = ""
         ## Load the retry_info.
-        retry_info_file_name = "retry_info/job.%s.txt" % (self.job_id)
-        if os.path.exists(retry_info_file_name):
-            try:
-                with open(retry_info_file_name, 'r') as fd:
-                    retry_info = json.load(fd)
-            except:
-                retmsg += "\n\tFailed to load file %s" % (retry_info_file_name)
-                retmsg += "\n\tWill use DAGMan retry number (%s)" % (self.dag_retry)
-                return self.dag_retry, retmsg
-        else:
+        try:
+            retry_info = self.job_state.getRetryInfo(self.job_id)
+        except Exception as ex:
+            retmsg += "\n\tFailed to load the retry_info: %s" % (ex)
+            retmsg += "\n\tWill use DAGMan retry number (%s)" % (self.dag_retry)
+            return self.dag_retry, retmsg
+        if retry_info is None:
             retry_info = {'pre': 0, 'post': 0}
 
         retmsg += "\n\tLoaded retry_info = %s" % (retry_info)
 
-        ## Simple validation of the retry_info.
-        for key in ['pre',  'post']:
-            if key not in retry_info:
-                retmsg += "\n\tKey '%s' not found in retry_info (%s)" % (key, retry_info)
-                retmsg += "\n\tWill use DAGMan retry number (%s)" % (self.dag_retry)
-                return self.dag_retry, retmsg
-
         ## Define the retry number for the pre-job as the number of times the post-job has
         ## been ran.
         crab_retry = retry_info['post']
@@ -114,15 +104,13 @@ class PreJob:
                 retry_info['pre'] = retry_info['post'] + 1
                 retmsg += "\n\tUpdated retry_info = %s" % (retry_info)
 
-        ## Save the retry_info dictionary to file.
-        retmsg += "\n\tSaving retry_info = %s to %s" % (retry_info, retry_info_file_name)
+        ## Save the retry_info dictionary.
+        retmsg += "\n\tSaving retry_info = %s" % (retry_info)
         try:
-            with open(retry_info_file_name + ".tmp", 'w') as fd:
-                json.dump(retry_info, fd)
-            os.rename(retry_info_file_name + ".tmp", retry_info_file_name)
-            retmsg += "\n\tSuccessfully saved %s" % (retry_info_file_name)
-        except:
-            retmsg += "\n\tFailed to save %s" % (retry_info_file_name)
+            self.job_state.saveRetryInfo(self.job_id, retry_info)
+            retmsg += "\n\tSuccessfully saved retry_info"
+        except Exception as ex:
+            retmsg += "\n\tFailed to save retry_info: %s" % (ex)
 
         return crab_retry, retmsg
 
@@ -155,6 +143,7 @@ class PreJob:
                  }
 
         if not self.userWebDirPrx:
+            import htcondor  # pylint: disable=import-outside-toplevel
             storage_rules = htcondor.param['CRAB_StorageRules']
             self.userWebDirPrx = getWebdirForDb(str(self.task_ad.get('CRAB_ReqName')), storage_rules)
 
@@ -354,6 +343,7 @@ class PreJob:
         if 'CMSGroups' in self.task_ad:
             new_submit_text += '+CMSGroups = %s\n' % classad.quote(self.task_ad['CMSGroups'])
         elif username:
+            import CMSGroupMapper  # pylint: disable=import-outside-toplevel
             groups = CMSGroupMapper.map_user_to_groups(username)
             if groups:
                 new_submit_text += '+CMSGroups = %s\n' % classad.quote(groups)
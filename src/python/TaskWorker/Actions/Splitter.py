@@ -64,7 +64,12 @@ class Splitter(TaskAction):
             splitter = SplitterFactory()
             jobfactory = splitter(subscription=wmsubs)
             factory = jobfactory(**splitparam)
-            numJobs = sum([len(jobgroup.getJobs()) for jobgroup in factory])
+            # count jobs one jobgroup at a time and stop as soon as the limit is passed
+            numJobs = 0
+            for jobgroup in factory:
+                numJobs += len(jobgroup.getJobs())
+                if numJobs > maxJobs:
+                    break
         except RuntimeError:
             msg = f"The splitting on your task generated more than {maxJobs} jobs (the maximum)."
             raise TaskWorkerException(msg) from RuntimeError
@@ -79,7 +84,7 @@ class Splitter(TaskAction):
             raise TaskWorkerException(msg)
         if numJobs > maxJobs:
             raise TaskWorkerException(
-                f"The splitting on your task generated {numJobs} jobs. The maximum number of jobs in each task is {maxJobs}"
+                f"The splitting on your task generated more than {maxJobs} jobs. The maximum number of jobs in each task is {maxJobs}"
             )
 
         minRuntime = getattr(self.config.TaskWorker, 'minAutomaticRuntimeMins', 180)
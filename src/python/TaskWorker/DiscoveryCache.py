@@ -0,0 +1,202 @@
+"""
+On-disk cache of data discovery results (DBS block lists, file details, block summaries
+and Rucio replicas) shared by all TaskWorker slaves, so that tasks submitted on the same
+dataset within a short time do not repeat the same DBS and Rucio queries.
+
+Values are kept in one SQLite file (WAL mode, one connection per process), compressed.
+Each kind of value has its own time to live: what can change quickly (block lists, open
+blocks, replicas, file validity, file details of datasets with open blocks) expires after
+config.TaskWorker.discoveryCacheShortTTL seconds, what can not (file details of datasets
+whose blocks are all closed, block summaries of closed blocks) after
+config.TaskWorker.discoveryCacheLongTTL seconds.
+When the file grows beyond config.TaskWorker.discoveryCacheMaxMB the oldest entries go.
+
+The cache is enabled by setting config.TaskWorker.discoveryCacheDir. Any failure
+while using the cache is logged and treated as a cache miss.
+"""
+
+import os
+import time
+import zlib
+import pickle
+import sqlite3
+
+# kinds of cached values
+BLOCKS = 'blocks'                      # list of blocks in a dataset
+OPENBLOCKS = 'openblocks'              # list of the blocks of a dataset which are still open
+REPLICAS = 'replicas'                  # Rucio replicas of a block
+FILEDETAILS = 'filedetails'            # DBS file details (with lumis) of a dataset with only closed blocks
+OPENFILEDETAILS = 'openfiledetails'    # same, for a dataset with open blocks, which can get more files
+FILEVALIDITY = 'filevalidity'          # {lfn: is_file_valid} of a dataset, files can be invalidated any time
+BLOCKSUMMARY = 'blocksummary'          # DBS summary info of a closed block
+KINDS = (BLOCKS, OPENBLOCKS, REPLICAS, FILEDETAILS, OPENFILEDETAILS, FILEVALIDITY, BLOCKSUMMARY)
+SHORT_LIVED = (BLOCKS, OPENBLOCKS, REPLICAS, OPENFILEDETAILS, FILEVALIDITY)
+
+
+def compactLumis(lumis):
+    """
+    [1, 2, 3, 7, 8] -> [[1, 3], [7, 8]]. Only lists which are sorted and without duplicates
+    (i.e. almost all of them) are converted, others are returned as they are
+    """
+    ranges = []
+    for lumi in lumis:
+        if ranges and lumi <= ranges[-1][1]:
+            return lumis
+        if ranges and lumi == ranges[-1][1] + 1:
+            ranges[-1][1] = lumi
+        else:
+            ranges.append([lumi, lumi])
+    return ranges
+
+
+def expandLumis(ranges):
+    """ [[1, 3], [7, 8]] -> [1, 2, 3, 7, 8], lists which were not converted are returned as they are """
+    if not ranges or not isinstance(ranges[0], list):
+        return ranges
+    lumis = []
+    for first, last in ranges:
+        lumis.extend(range(first, last + 1))
+    return lumis
+
+
+def compactFileDetails(filedetails):
+    """
+    copy of the output of DBSReader.listDatasetFileDetails with lumis stored as ranges
+    """
+    compact = {}
+    for lfn, infos in filedetails.items():
+        infos = dict(infos)
+        infos['Lumis'] = {run: compactLumis(lumis) for run, lumis in infos.get('Lumis', {}).items()}
+        compact[lfn] = infos
+    return compact
+
+
+def expandFileDetails(compact):
+    """ the inverse of compactFileDetails """
+    for infos in compact.values():
+        infos['Lumis'] = {run: expandLumis(ranges) for run, ranges in infos['Lumis'].items()}
+    return compact
+
+
+class DiscoveryCache():
+    """
+    key/value store with expiration and a size limit, see module docstring
+    """
+
+    def __init__(self, cacheDir, shortTTL=900, longTTL=7*24*3600, maxMB=2000, logger=None):
+        self.path = os.path.join(cacheDir, 'discovery_cache.db')
+        self.ttl = {kind: shortTTL if kind in SHORT_LIVED else longTTL for kind in KINDS}
+        self.maxBytes = maxMB * 1024 * 1024
+        self.logger = logger
+        self.conn = None
+        self.pid = None
+        if not os.path.isdir(cacheDir):
+            os.makedirs(cacheDir, exist_ok=True)
+
+    @classmethod
+    def fromConfig(cls, config, logger):
+        """
+        build the cache from the TaskWorker configuration, return None if it is not enabled
+        """
+        cacheDir = getattr(config.TaskWorker, 'discoveryCacheDir', None)
+        if not cacheDir:
+            return None
+        try:
+            return cls(cacheDir,
+                       shortTTL=getattr(config.TaskWorker, 'discoveryCacheShortTTL', 900),
+                       longTTL=getattr(config.TaskWorker, 'discoveryCacheLongTTL', 7*24*3600),
+                       maxMB=getattr(config.TaskWorker, 'discoveryCacheMaxMB', 2000),
+                       logger=logger)
+        except OSError as ex:
+            logger.warning("Can not use discovery cache in %s: %s", cacheDir, ex)
+            return None
+
+    def connection(self):
+        """
+        one connection per process: slaves are forked from the master and an SQLite
+        connection must not be used across a fork
+        """
+        if self.conn is None or self.pid != os.getpid():
+            self.conn = sqlite3.connect(self.path, timeout=60)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS entries (kind TEXT, key TEXT, value BLOB, "
+                              "created REAL, size INTEGER, PRIMARY KEY (kind, key))")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS entries_created ON entries (created)")
+            self.conn.commit()
+            self.pid = os.getpid()
+        return self.conn
+
+    def getMany(self, kind, keys):
+        """
+        returns: a dictionary {key: value} for the keys which are in the cache and not expired
+        """
+        keys = list(keys)
+        found = {}
+        if not keys:
+            return found
+        minCreated = time.time() - self.ttl[kind]
+        try:
+            conn = self.connection()
+            # stay well below the SQLite limit on the number of host parameters
+            for start in range(0, len(keys), 500):
+                chunk = keys[start:start + 500]
+                sql = "SELECT key, value FROM entries WHERE kind = ? AND created > ? AND key IN (%s)" % \
+                      ", ".join("?" * len(chunk))
+                for key, value in conn.execute(sql, [kind, minCreated] + chunk):
+                    found[key] = pickle.loads(zlib.decompress(value))
+        except Exception as ex:  # pylint: disable=broad-except
+            self.logger.warning("Discovery cache lookup failed, ignoring the cache: %s", ex)
+            return {}
+        return found
+
+    def get(self, kind, key):
+        """ returns: the cached value, or None """
+        return self.getMany(kind, [key]).get(key)
+
+    def putMany(self, kind, items):
+        """
+        store the values in the dictionary items {key: value}, then make room if needed
+        """
+        if not items:
+            return
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+            rows.append((kind, key, sqlite3.Binary(blob), now, len(blob)))
+        try:
+            conn = self.connection()
+            with conn:
+                conn.executemany("INSERT OR REPLACE INTO entries (kind, key, value, created, size) "
+                                 "VALUES (?, ?, ?, ?, ?)", rows)
+            self.evict()
+        except Exception as ex:  # pylint: disable=broad-except
+            self.logger.warning("Discovery cache update failed: %s", ex)
+
+    def put(self, kind, key, value):
+        """ store one value """
+        self.putMany(kind, {key: value})
+
+    def evict(self):
+        """
+        remove expired entries and, if the cache is still too big, the oldest ones
+        until it is back to 90% of the maximum size
+        """
+        conn = self.connection()
+        now = time.time()
+        with conn:
+            for kind, ttl in self.ttl.items():
+                conn.execute("DELETE FROM entries WHERE kind = ? AND created < ?", (kind, now - ttl))
+            totalBytes = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if totalBytes <= self.maxBytes:
+                return
+            toFree = totalBytes - 0.9 * self.maxBytes
+            freed = 0
+            oldest = []
+            for kind, key, size in conn.execute("SELECT kind, key, size FROM entries ORDER BY created"):
+                oldest.append((kind, key))
+                freed += size
+                if freed >= toFree:
+                    break
+            conn.executemany("DELETE FROM entries WHERE kind = ? AND key = ?", oldest)
+        self.logger.info("Discovery cache: evicted %d entries (%d bytes)", len(oldest), freed)
@@ -0,0 +1,84 @@
+"""
+Indexed on-disk storage of the data discovery output (the WMCore Fileset given to the
+Splitter), written by DagmanCreator at submission and read by PreDAG at each stage.
+
+Files are stored one per row in an SQLite file, next to a table with one row per
+(file, run) which holds the lowest and highest lumi of the file in that run.
+PreDAG can then load the whole Fileset (processing stage) or only the files which
+may contain some lumis of a lumi mask (tail stage), instead of unpickling the
+whole Fileset, which for large datasets can be hundreds of MB.
+"""
+
+import os
+import pickle
+import sqlite3
+
+from WMCore.DataStructs.Fileset import Fileset
+
+FILESET_DB = 'datadiscovery.db'
+
+
+def saveFileset(fileset, fileName=FILESET_DB):
+    """
+    store the fileset, replacing the file if it exists
+    """
+    tmpName = fileName + '.tmp'
+    if os.path.exists(tmpName):
+        os.unlink(tmpName)
+    conn = sqlite3.connect(tmpName)
+    try:
+        # a new file, which is renamed into place only when complete: no journal needed
+        conn.execute("PRAGMA journal_mode=OFF")
+        conn.execute("PRAGMA synchronous=OFF")
+        conn.execute("CREATE TABLE fileset (name TEXT)")
+        conn.execute("CREATE TABLE files (id INTEGER PRIMARY KEY, lfn TEXT, file BLOB)")
+        conn.execute("CREATE TABLE runs (file INTEGER, run INTEGER, minLumi INTEGER, maxLumi INTEGER)")
+        conn.execute("INSERT INTO fileset (name) VALUES (?)", (fileset.name,))
+        files = []
+        runs = []
+        for fileId, wmfile in enumerate(fileset.getFiles(type='list')):
+            files.append((fileId, wmfile['lfn'], sqlite3.Binary(pickle.dumps(wmfile, protocol=pickle.HIGHEST_PROTOCOL))))
+            for run in wmfile['runs']:
+                if run.lumis:
+                    runs.append((fileId, run.run, min(run.lumis), max(run.lumis)))
+        conn.executemany("INSERT INTO files (id, lfn, file) VALUES (?, ?, ?)", files)
+        conn.executemany("INSERT INTO runs (file, run, minLumi, maxLumi) VALUES (?, ?, ?, ?)", runs)
+        conn.execute("CREATE INDEX runs_run ON runs (run, minLumi)")
+        conn.commit()
+    finally:
+        conn.close()
+    os.rename(tmpName, fileName)
+
+
+def loadFileset(fileName=FILESET_DB, lumiMask=None):
+    """
+    :param lumiMask: None to load all the files, or a compact lumi list {run: [[first, last], ...]}
+                     to load only the files which have lumis in one of those ranges. The selection
+                     is done on the lowest and highest lumi of each file in each run, so it may
+                     include a few files with none of the lumis, the lumi mask given to the
+                     splitter takes care of those.
+    :return: a WMCore Fileset
+    """
+    conn = sqlite3.connect('file:%s?mode=ro' % fileName, uri=True)
+    try:
+        name = conn.execute("SELECT name FROM fileset").fetchone()[0]
+        if lumiMask is None:
+            rows = conn.execute("SELECT file FROM files")
+        else:
+            fileIds = set()
+            for run, ranges in lumiMask.items():
+                for first, last in ranges:
+                    fileIds.update(fileId for (fileId,) in conn.execute(
+                        "SELECT file FROM runs WHERE run = ? AND minLumi <= ? AND maxLumi >= ?",
+                        (int(run), last, first)))
+            fileIds = sorted(fileIds)
+            rows = []
+            # stay well below the SQLite limit on the number of host parameters
+            for start in range(0, len(fileIds), 500):
+                chunk = fileIds[start:start + 500]
+                rows.extend(conn.execute("SELECT file FROM files WHERE id IN (%s)" % ", ".join("?" * len(chunk)),
+                                         chunk).fetchall())
+        files = set(pickle.loads(blob) for (blob,) in rows)
+    finally:
+        conn.close()
+    return Fileset(name=name, files=files)
@@ -0,0 +1,252 @@
+"""
+Bookkeeping of the DAG node scripts of a task, kept in one SQLite file in the task
+directory (JOB_STATE_DB) instead of a few small files per job and per retry:
+- retryInfo: how many times the pre-job and the post-job of each job ran (PreJob, PostJob)
+- deferNum: how many times the post-job of each job and DAGMan retry ran, i.e. was deferred (PostJob)
+- docsInTransfer: the transfer documents which the post-job of each job and CRAB retry
+  waits for (PostJob)
+- throughputs: event throughput and output size per event of the probe and processing
+  jobs (written by PostJob, read by PreDAG)
+
+Many pre-jobs and post-jobs of a task run at the same time: the file is in WAL mode so
+that readers do not wait for the writer, and writers wait for each other up to TIMEOUT
+seconds. Each process has its own connection.
+
+The store replaces the retry_info, defer_info, transfer_info and automatic_splitting/throughputs
+directories. The first process which opens it imports what is in those (see migrate), so
+that code which uses the store can take over a task which used the files. The files are
+left where they are.
+
+    python3 -m TaskWorker.JobStateStore show <jobId>
+
+prints what is stored for a job.
+"""
+
+import os
+import sys
+import json
+import sqlite3
+import argparse
+
+JOB_STATE_DB = 'job_state.db'
+TIMEOUT = 120
+
+SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS retryInfo (jobId TEXT PRIMARY KEY, pre INTEGER, post INTEGER)",
+    "CREATE TABLE IF NOT EXISTS deferNum (jobId TEXT, dagRetry INTEGER, num INTEGER, PRIMARY KEY (jobId, dagRetry))",
+    "CREATE TABLE IF NOT EXISTS docsInTransfer (jobId TEXT, crabRetry INTEGER, docs TEXT, PRIMARY KEY (jobId, crabRetry))",
+    "CREATE TABLE IF NOT EXISTS throughputs (jobId TEXT PRIMARY KEY, throughput REAL, eventsize REAL)",
+    "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)",
+)
+
+
+def readOldFiles(taskDir='.'):
+    """
+    the content of the files which the store replaces
+    :return: a dictionary {table: [row, ...]} with the rows to insert in each table
+    """
+    def listDir(dirName):
+        try:
+            return sorted(os.listdir(os.path.join(taskDir, dirName)))
+        except OSError:
+            return []
+
+    def readFile(dirName, fileName):
+        with open(os.path.join(taskDir, dirName, fileName), 'r', encoding='utf-8') as fd:
+            return fd.read()
+
+    rows = {'retryInfo': [], 'deferNum': [], 'docsInTransfer': [], 'throughputs': []}
+    # files which can not be read or parsed are skipped, as if they did not exist
+    # retry_info/job.<jobId>.txt : {"pre": N, "post": M}
+    for fileName in listDir('retry_info'):
+        if not (fileName.startswith('job.') and fileName.endswith('.txt')):
+            continue
+        try:
+            retryInfo = json.loads(readFile('retry_info', fileName))
+            rows['retryInfo'].append((fileName[len('job.'):-len('.txt')], retryInfo['pre'], retryInfo['post']))
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+    # defer_info/defer_num.<jobId>.<dagRetry>.txt : N, possibly followed by spaces, or empty for 0
+    for fileName in listDir('defer_info'):
+        if not (fileName.startswith('defer_num.') and fileName.endswith('.txt')):
+            continue
+        try:
+            jobId, dagRetry = fileName[len('defer_num.'):-len('.txt')].rsplit('.', 1)
+            line = readFile('defer_info', fileName).strip()
+            rows['deferNum'].append((jobId, int(dagRetry), int(line) if line else 0))
+        except (OSError, ValueError):
+            continue
+    # transfer_info/docs_in_transfer.<jobId>.<crabRetry>.json : [doc_info, ...]
+    for fileName in listDir('transfer_info'):
+        if not (fileName.startswith('docs_in_transfer.') and fileName.endswith('.json')):
+            continue
+        try:
+            jobId, crabRetry = fileName[len('docs_in_transfer.'):-len('.json')].rsplit('.', 1)
+            docs = json.loads(readFile('transfer_info', fileName))
+            rows['docsInTransfer'].append((jobId, int(crabRetry), json.dumps(docs)))
+        except (OSError, ValueError):
+            continue
+    # automatic_splitting/throughputs/<jobId> : [throughput, eventsize]
+    for jobId in listDir('automatic_splitting/throughputs'):
+        try:
+            throughput, eventsize = json.loads(readFile('automatic_splitting/throughputs', jobId))
+            rows['throughputs'].append((jobId, throughput, eventsize))
+        except (OSError, ValueError, TypeError):
+            continue
+    return rows
+
+
+class JobStateStore():
+    """
+    see module docstring. Job ids are strings, as in the DAG (e.g. '12', '0-3', '2-7')
+    """
+
+    def __init__(self, fileName=JOB_STATE_DB):
+        self.fileName = fileName
+        self.conn = None
+        self.pid = None
+
+    def connection(self):
+        """ one connection per process, made when first needed """
+        if self.conn is None or self.pid != os.getpid():
+            conn = sqlite3.connect(self.fileName, timeout=TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            # in WAL mode this only risks the last transactions on a power loss, never corruption
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for statement in SCHEMA:
+                conn.execute(statement)
+            conn.commit()
+            self.migrate(conn, os.path.dirname(os.path.abspath(self.fileName)))
+            self.conn = conn
+            self.pid = os.getpid()
+        return self.conn
+
+    @staticmethod
+    def migrate(conn, taskDir):
+        """ import the old files of the task, once: the first process does it, the others wait for it """
+        if conn.execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone():
+            return
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if not conn.execute("SELECT value FROM meta WHERE key = 'migrated'").fetchone():
+                rows = readOldFiles(taskDir)
+                conn.executemany("INSERT OR REPLACE INTO retryInfo (jobId, pre, post) VALUES (?, ?, ?)",
+                                 rows['retryInfo'])
+                conn.executemany("INSERT OR REPLACE INTO deferNum (jobId, dagRetry, num) VALUES (?, ?, ?)",
+                                 rows['deferNum'])
+                conn.executemany("INSERT OR REPLACE INTO docsInTransfer (jobId, crabRetry, docs) VALUES (?, ?, ?)",
+                                 rows['docsInTransfer'])
+                conn.executemany("INSERT OR REPLACE INTO throughputs (jobId, throughput, eventsize) VALUES (?, ?, ?)",
+                                 rows['throughputs'])
+                conn.execute("INSERT INTO meta (key, value) VALUES ('migrated', ?)",
+                             (json.dumps({table: len(tableRows) for table, tableRows in rows.items()}),))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+
+    def getRetryInfo(self, jobId):
+        """ :return: {'pre': N, 'post': M}, or None if nothing was saved for the job """
+        row = self.connection().execute("SELECT pre, post FROM retryInfo WHERE jobId = ?", (str(jobId),)).fetchone()
+        return {'pre': row[0], 'post': row[1]} if row else None
+
+    def saveRetryInfo(self, jobId, retryInfo):
+        """ replace the retry info of the job """
+        conn = self.connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO retryInfo (jobId, pre, post) VALUES (?, ?, ?)",
+                         (str(jobId), retryInfo['pre'], retryInfo['post']))
+
+    def nextDeferNum(self, jobId, dagRetry):
+        """ :return: how many times the post-job ran before for this DAGMan retry (0 the first time), and count this run """
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT num FROM deferNum WHERE jobId = ? AND dagRetry = ?",
+                               (str(jobId), dagRetry)).fetchone()
+            deferNum = row[0] if row else 0
+            conn.execute("INSERT OR REPLACE INTO deferNum (jobId, dagRetry, num) VALUES (?, ?, ?)",
+                         (str(jobId), dagRetry, deferNum + 1))
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        return deferNum
+
+    def resetDeferNum(self, jobId, dagRetry):
+        """ the next run of the post-job will be the first one for this DAGMan retry """
+        conn = self.connection()
+        with conn:
+            conn.execute("DELETE FROM deferNum WHERE jobId = ? AND dagRetry = ?", (str(jobId), dagRetry))
+
+    def getDocsInTransfer(self, jobId, crabRetry):
+        """ :return: the list saved by saveDocsInTransfer, or None """
+        row = self.connection().execute("SELECT docs FROM docsInTransfer WHERE jobId = ? AND crabRetry = ?",
+                                        (str(jobId), crabRetry)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def saveDocsInTransfer(self, jobId, crabRetry, docs):
+        """ replace the list of documents in transfer for the job and CRAB retry """
+        conn = self.connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO docsInTransfer (jobId, crabRetry, docs) VALUES (?, ?, ?)",
+                         (str(jobId), crabRetry, json.dumps(docs)))
+
+    def saveThroughput(self, jobId, throughput, eventsize):
+        """ replace the throughput (events/s) and output size per event (bytes) of the job """
+        conn = self.connection()
+        with conn:
+            conn.execute("INSERT OR REPLACE INTO throughputs (jobId, throughput, eventsize) VALUES (?, ?, ?)",
+                         (str(jobId), throughput, eventsize))
+
+    def getThroughputs(self, jobIds):
+        """ :return: {jobId: (throughput, eventsize)} for the jobs in jobIds which have one """
+        jobIds = [str(jobId) for jobId in jobIds]
+        found = {}
+        conn = self.connection()
+        # stay well below the SQLite limit on the number of host parameters
+        for start in range(0, len(jobIds), 500):
+            chunk = jobIds[start:start + 500]
+            sql = "SELECT jobId, throughput, eventsize FROM throughputs WHERE jobId IN (%s)" % ", ".join("?" * len(chunk))
+            for jobId, throughput, eventsize in conn.execute(sql, chunk):
+                found[jobId] = (throughput, eventsize)
+        return found
+
+    def showJob(self, jobId):
+        """ :return: all that is stored for the job, for humans """
+        conn = self.connection()
+        jobId = str(jobId)
+        throughput = self.getThroughputs([jobId]).get(jobId)
+        return {
+            'retryInfo': self.getRetryInfo(jobId),
+            'deferNum': dict(conn.execute("SELECT dagRetry, num FROM deferNum WHERE jobId = ? ORDER BY dagRetry",
+                                          (jobId,)).fetchall()),
+            'docsInTransfer': {crabRetry: json.loads(docs) for crabRetry, docs in conn.execute(
+                "SELECT crabRetry, docs FROM docsInTransfer WHERE jobId = ? ORDER BY crabRetry", (jobId,))},
+            'throughput': throughput,
+        }
+
+
+def main():
+    """ look at or reset the bookkeeping of a job, from the task directory """
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='action')
+    subparsers.required = True
+    show = subparsers.add_parser('show', help="print what is stored for a job")
+    show.add_argument('jobId')
+    reset = subparsers.add_parser('reset-postjob', help="make the next post-job run of a job a first run")
+    reset.add_argument('jobId')
+    reset.add_argument('--dag-retry', type=int, default=0)
+    args = parser.parse_args()
+
+    store = JobStateStore()
+    if args.action == 'show':
+        print(json.dumps(store.showJob(args.jobId), indent=2))
+    elif args.action == 'reset-postjob':
+        store.saveRetryInfo(args.jobId, {'pre': 1, 'post': 0})
+        store.resetDeferNum(args.jobId, args.dag_retry)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
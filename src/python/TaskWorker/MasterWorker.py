@@ -24,7 +24,7 @@ from WMCore.Configuration import loadConfigurationFile
 #CRAB dependencies
 from RESTInteractions import CRABRest
 import HTCondorLocator
-from ServerUtilities import newX509env
+from ServerUtilities import newX509env, encodeRequest
 from ServerUtilities import SERVICE_INSTANCES
 from TaskWorker import __version__
 from TaskWorker.TestWorker import TestWorker
@@ -229,6 +229,8 @@ class MasterWorker(object):
         self.crabserver = CRABRest(self.restHost, self.config.TaskWorker.cmscert, self.config.TaskWorker.cmskey, retry=20,
                                    logger=self.logger, userAgent='CRABTaskWorker')
         self.crabserver.setDbInstance(self.dbInstance)
+        # switched off by updateWorks if the REST does not support the bulkstate subresource
+        self.bulkStateUpdate = getattr(self.config.TaskWorker, 'bulkStateUpdate', True)
         self.logger.debug("Hostcert: %s, hostkey: %s", str(self.config.TaskWorker.cmscert), str(self.config.TaskWorker.cmskey))
         # Retries for any failures
         if not hasattr(self.config.TaskWorker, 'max_retry'):
@@ -327,6 +329,39 @@ class MasterWorker(object):
         return False #failure
 
 
+    def updateWorks(self, tasks, status):
+        """ Update all the tasks (list of task dictionaries) setting the same status for all of them
+            and keeping their command, using a single call to the REST.
+            Return the list of the tasknames for which the change succeded
+        """
+        if not tasks:
+            return []
+        if not self.bulkStateUpdate:
+            return [task['tm_taskname'] for task in tasks
+                    if self.updateWork(task['tm_taskname'], task['tm_task_command'], status)]
+
+        configreq = {'subresource': 'bulkstate',
+                     'workflows': [task['tm_taskname'] for task in tasks],
+                     'commands': [task['tm_task_command'] for task in tasks],
+                     'statuses': [status] * len(tasks)}
+        try:
+            data = encodeRequest(configreq, listParams=['workflows', 'commands', 'statuses'])
+            result = self.crabserver.post(api='workflowdb', data=data)[0]['result']
+        except HTTPException as hte:
+            if hte.headers.get('X-Error-Http', -1) == '400' and 'subresource' in hte.headers.get('X-Error-Info', ''):
+                self.logger.info("REST does not support bulkstate, updating one task at a time from now on")
+                self.bulkStateUpdate = False
+                return self.updateWorks(tasks, status)
+            msg = "HTTP Error during updateWorks: %s\n" % str(hte)
+            msg += "HTTP Headers are %s: " % hte.headers
+            self.logger.error(msg)
+        except Exception: #pylint: disable=broad-except
+            self.logger.exception("Server could not process the updateWorks request for %d tasks", len(tasks))
+        else:
+            return [res['workflow'] for res in result if res['updated']]
+        return [] #failure
+
+
     def restartQueuedTasks(self):
         """ This method is used at the TW startup and it restarts QUEUED tasks
             setting them  back again to NEW.
@@ -335,9 +370,10 @@ class MasterWorker(object):
         total = 0
         while True:
             pendingwork = self.getWork(limit=limit, getstatus='QUEUED')
-            for task in pendingwork:
-                self.logger.debug("Restarting QUEUED task %s", task['tm_taskname'])
-                self.updateWork(task['tm_taskname'], task['tm_task_command'], 'NEW')
+            self.logger.debug("Restarting QUEUED tasks %s", [task['tm_taskname'] for task in pendingwork])
+            restarted = self.updateWorks(pendingwork, 'NEW')
+            if len(restarted) < len(pendingwork):
+                self.logger.warning("Could not restart %d QUEUED tasks", len(pendingwork) - len(restarted))
             if not pendingwork:
                 self.logger.info("Finished restarting QUEUED tasks (total %s)", total)
                 break #too bad "do..while" does not exist in python...
@@ -407,56 +443,100 @@ class MasterWorker(object):
         return False
 
 
+    def acquireWork(self, limit):
+        """ Acquire up to limit NEW tasks, move them to QUEUED and inject them into the slaves.
+            Return the number of tasks injected into the slaves, or None if the tasks could not
+            be locked. Tasks which are banned, rejected or could not be queued are not counted.
+        """
+        if not self._lockWork(limit=limit, getstatus='NEW', setstatus='HOLDING'):
+            return None
+        acquired = time.time()
+
+        pendingwork = self.getWork(limit=limit, getstatus='HOLDING')
+
+        if pendingwork:
+            keys = ['tm_task_command', 'tm_taskname']
+            tasksInfo = [{k:v for k, v in task.items() if k in keys} for task in pendingwork]
+            self.logger.info("Retrieved a total of %d works", len(pendingwork))
+            self.logger.debug("Retrieved the following works: \n%s", str(tasksInfo))
+
+        toQueue = [task for task in pendingwork if not self.failBannedTask(task) and not self.skipRejectedCommand(task)]
+        queued = set(self.updateWorks(toQueue, 'QUEUED'))
+
+        toInject = []
+        for task in toQueue:
+            if task['tm_taskname'] in queued:
+                worktype, failstatus = STATE_ACTIONS_MAP[task['tm_task_command']]
+                toInject.append((worktype, task, failstatus, None))
+            else:
+                #The task stays in HOLDING and will be acquired again later
+                self.logger.info("Skipping %s since it could not be updated to QUEUED. Will be retried in the next iteration", task['tm_taskname'])
+
+        self.slaves.injectWorks(toInject, acquired=acquired)
+        return len(toInject)
+
+
+    def logStatus(self):
+        """ Log the status of the slaves and the dispatch latency of the works completed since the last call """
+        self.logger.info('Master Worker status:')
+        self.logger.info(' - free slaves: %d', self.slaves.freeSlaves())
+        self.logger.info(' - acquired tasks: %d', self.slaves.queuedTasks())
+        self.logger.info(' - tasks pending in queue: %d', self.slaves.pendingTasks())
+        latencies = self.slaves.dispatchLatencies()
+        if latencies:
+            #log entry below is used for logs parsing, therefore, changing it might require to update logstash configuration
+            self.logger.info(' - HOLDING to processing latency: avg %.1f s, max %.1f s over %d tasks',
+                             sum(latencies)/len(latencies), max(latencies), len(latencies))
+
+
     def algorithm(self):
         """I'm the intelligent guy taking care of getting the work
-           and distributing it to the slave processes."""
+           and distributing it to the slave processes.
+           By default a new cycle starts every config.TaskWorker.polling seconds. If
+           config.TaskWorker.eventDrivenDispatch is True a new cycle starts as soon as
+           a slave finishes its work, and the master only backs off (from
+           config.TaskWorker.minPolling up to config.TaskWorker.polling seconds)
+           when there is no new work in the REST."""
+
+        eventDriven = getattr(self.config.TaskWorker, 'eventDrivenDispatch', False)
+        polling = self.config.TaskWorker.polling
+        minPolling = min(getattr(self.config.TaskWorker, 'minPolling', 1), polling)
+        backoff = minPolling
 
         self.logger.debug("Restarting QUEUED tasks before startup.")
         self.restartQueuedTasks()
         self.logger.debug("Master Worker Starting Main Cycle.")
         while not self.STOP:
             limit = self.slaves.queueableTasks()
-            if not self._lockWork(limit=limit, getstatus='NEW', setstatus='HOLDING'):
-                time.sleep(self.config.TaskWorker.polling)
+            injected = self.acquireWork(limit) if limit or not eventDriven else 0
+            if injected is None:
+                time.sleep(polling)
                 continue
 
-            pendingwork = self.getWork(limit=limit, getstatus='HOLDING')
-
-            if pendingwork:
-                keys = ['tm_task_command', 'tm_taskname']
-                tasksInfo = [{k:v for k, v in task.items() if k in keys} for task in pendingwork]
-                self.logger.info("Retrieved a total of %d works", len(pendingwork))
-                self.logger.debug("Retrieved the following works: \n%s", str(tasksInfo))
-
-            toInject = []
-            for task in pendingwork:
-                if self.failBannedTask(task):
-                    continue
-                if self.skipRejectedCommand(task):
-                    continue
-                if self.updateWork(task['tm_taskname'], task['tm_task_command'], 'QUEUED'):
-                    worktype, failstatus = STATE_ACTIONS_MAP[task['tm_task_command']]
-                    toInject.append((worktype, task, failstatus, None))
-                else:
-                    #The task stays in HOLDING and will be acquired again later
-                    self.logger.info("Skipping %s since it could not be updated to QUEUED. Will be retried in the next iteration", task['tm_taskname'])
-
-            self.slaves.injectWorks(toInject)
-
             for action in self.recurringActions:
                 if action.isTimeToGo():
                     #Maybe we should use new slaves and not reuse the ones used for the tasks
                     self.logger.debug("Injecting recurring action: \n%s", (str(action.__module__)))
                     self.slaves.injectWorks([(handleRecurring, {'tm_username': 'recurring', 'tm_taskname' : action.__module__}, 'FAILED', action.__module__)])
 
-            self.logger.info('Master Worker status:')
-            self.logger.info(' - free slaves: %d', self.slaves.freeSlaves())
-            self.logger.info(' - acquired tasks: %d', self.slaves.queuedTasks())
-            self.logger.info(' - tasks pending in queue: %d', self.slaves.pendingTasks())
-
-            time.sleep(self.config.TaskWorker.polling)
-
-            dummyFinished = self.slaves.checkFinished()
+            self.logStatus()
+
+            if not eventDriven:
+                time.sleep(polling)
+                dummyFinished = self.slaves.checkFinished()
+            elif not limit:
+                # all slots are taken: wait for a slave to finish, but not longer than a polling
+                # cycle so that recurring actions are still injected in time
+                dummyFinished = self.slaves.checkFinished(timeout=polling)
+            elif not injected:
+                # nothing new for the slaves (no work in the REST, or none of it could be queued):
+                # back off, but keep draining the finished works
+                self.logger.debug("No new work found, waiting up to %d seconds", backoff)
+                dummyFinished = self.slaves.checkFinished(timeout=backoff)
+                backoff = min(backoff * 2, polling)
+            else:
+                backoff = minPolling
+                dummyFinished = self.slaves.checkFinished()
 
         self.logger.debug("Master Worker Exiting Main Cycle.")
 
@@ -0,0 +1,89 @@
+"""
+Where the start up time of the DAG node scripts goes: imports the module of a
+TaskManagerBootstrap command (PREJOB, POSTJOB, PREDAG), or any module, in a fresh
+interpreter with `-X importtime` and prints a summary of it: total time, the modules
+which take longest to import including what they import, and those which take
+longest on their own.
+
+To be run on a schedd, in the environment of dag_bootstrap.sh:
+
+python3 -m TaskWorker.StartupReport POSTJOB --top 20
+
+test/benchmarks/bench_wrapperStartup.py uses it to check that the start up does not regress.
+"""
+
+import re
+import sys
+import time
+import argparse
+import subprocess
+
+from TaskWorker.TaskManagerBootstrap import COMMANDS
+
+# e.g. "import time:       431 |       1286 |   TaskWorker.Actions.RetryJob"
+IMPORT_TIME_RE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)\s*$')
+
+
+def commandModule(target):
+    """ the module imported by a TaskManagerBootstrap command, or target itself if it is not a command """
+    return COMMANDS[target][0] if target in COMMANDS else target
+
+
+def measureStartup(target):
+    """
+    import the module of target in a new interpreter
+    :return: (wall clock seconds, [(module, self us, cumulative us, depth), ...] in import order)
+    """
+    module = commandModule(target)
+    start = time.time()
+    proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                          stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    wall = time.time() - start
+    stderr = proc.stderr.decode('utf-8', 'replace')
+    if proc.returncode:
+        raise RuntimeError(f"import {module} failed:\n{stderr[-2000:]}")
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        if match:
+            selfUs, cumulativeUs, indent, name = match.groups()
+            imports.append((name, int(selfUs), int(cumulativeUs), len(indent) // 2))
+    return wall, imports
+
+
+def importedModules(imports):
+    """ names of the modules in the output of measureStartup """
+    return set(name for name, _, _, _ in imports)
+
+
+def formatReport(target, wall, imports, top=15):
+    """ the summary of the output of measureStartup, as a list of lines """
+    lines = [f"{target}: {wall:.3f} s wall clock, {sum(i[1] for i in imports) / 1e6:.3f} s in "
+             f"{len(imports)} imports"]
+    lines.append("  longest imports, including what they import:")
+    # the target module (and what the interpreter imports at start up) is at depth 0,
+    # what the target module imports directly at depth 1
+    topLevel = [i for i in imports if i[3] <= 1]
+    for name, _, cumulativeUs, depth in sorted(topLevel, key=lambda i: -i[2])[:top]:
+        lines.append(f"    {cumulativeUs / 1e3:9.1f} ms  {'  ' * depth}{name}")
+    lines.append("  longest imports on their own:")
+    for name, selfUs, _, _ in sorted(imports, key=lambda i: -i[1])[:top]:
+        lines.append(f"    {selfUs / 1e3:9.1f} ms  {name}")
+    return lines
+
+
+def main():
+    """ print the report for each target on the command line """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('targets', nargs='+', metavar='TARGET',
+                        help=f"one of {', '.join(COMMANDS)} or a module name")
+    parser.add_argument('--top', type=int, default=15, help="number of modules in each list")
+    args = parser.parse_args()
+    for target in args.targets:
+        wall, imports = measureStartup(target)
+        print('\n'.join(formatReport(target, wall, imports, args.top)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,24 +2,34 @@
  bootstrap one TW action which requires a separate process
 """
 import sys
+import importlib
 
-from TaskWorker.Actions import PreDAG, PreJob, PostJob
+# command -> (module, class) of the action. Only the module of the command which runs
+# is imported: each DAG node script pays for its own imports, and PreDAG's are heavy
+COMMANDS = {
+    'POSTJOB': ('TaskWorker.Actions.PostJob', 'PostJob'),
+    'PREJOB': ('TaskWorker.Actions.PreJob', 'PreJob'),
+    'PREDAG': ('TaskWorker.Actions.PreDAG', 'PreDAG'),
+}
+
+
+def loadAction(command):
+    """ import the module of the command and return the class of the action """
+    if command not in COMMANDS:
+        raise Exception(f"Unknown command {command} passed to TaskMangerBootstrap.py")
+    moduleName, className = COMMANDS[command]
+    return getattr(importlib.import_module(moduleName), className)
 
 
 def bootstrap():
     """ bootstrap one TW action which requires a separate process """
     print(f"Entering TaskManagerBootstrap with args: {sys.argv}")
-    command = sys.argv[1]
-    if command == "POSTJOB":
-        return PostJob.PostJob().execute(*sys.argv[2:])
-    if command == "PREJOB":
-        return PreJob.PreJob().execute(*sys.argv[2:])
-    if command == "PREDAG":
-        return PreDAG.PreDAG().execute(*sys.argv[2:])
-    raise Exception(f"Unknown command {sys.argv[1]} passed to TaskMangerBootstrap.py")
+    action = loadAction(sys.argv[1])
+    return action().execute(*sys.argv[2:])
 
 
-if __name__ == '__main__':
+def main():
+    """ run the command and exit with its return value, also used by TaskManagerServer """
     try:
         retval = bootstrap()
         print(f"Ended TaskManagerBootstrap with code {retval}")
@@ -27,3 +37,7 @@ if __name__ == '__main__':
     except Exception as e:
         print(f"Got a fatal exception: {e}")
         raise
+
+
+if __name__ == '__main__':
+    main()
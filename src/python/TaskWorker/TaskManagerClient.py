@@ -0,0 +1,102 @@
+"""
+Run a TaskManagerBootstrap command (PREJOB, POSTJOB, PREDAG) through the TaskManagerServer
+of the task, and exit with its exit code (or die of the signal which killed it).
+Used by dag_bootstrap.sh instead of `python3 -m TaskWorker.TaskManagerBootstrap` when
+the task uses the server.
+
+This runs once per DAG node script, so it must import as little as possible.
+If the server can not be reached, or goes away before it confirms that the command was
+started, start one for the next commands and run this one with TaskManagerBootstrap in
+this process, as if the server did not exist.
+"""
+
+import os
+import sys
+import json
+import array
+import signal
+import socket
+
+# same as in TaskManagerServer, which is not imported to keep this fast
+SOCKET_NAME = 'task_process/taskmanager.sock'
+FAILED_NAME = 'task_process/taskmanager_server.failed'
+SERVER_OUT_NAME = 'task_process/taskmanager_server.out'
+# see SCRIPT DEFER in DagmanCreator.DAG_FRAGMENT: the POST and PREDAG scripts always have it,
+# the PRE script of a job only when the task sets CRAB_JobReleaseTimeout
+DEFER_EXIT_CODE = 4
+DEFERRABLE_COMMANDS = ('POSTJOB', 'PREDAG')
+
+
+def startServer():
+    """ start a server in the background, detached from this process """
+    if os.path.exists(FAILED_NAME):
+        return
+    import subprocess  # pylint: disable=import-outside-toplevel
+    with open(SERVER_OUT_NAME, 'a', encoding='utf-8') as out:
+        subprocess.Popen([sys.executable, '-m', 'TaskWorker.TaskManagerServer'],  # pylint: disable=consider-using-with
+                         stdin=subprocess.DEVNULL, stdout=out, stderr=out, start_new_session=True)
+
+
+def runHere(args):
+    """ run the command in this process, as dag_bootstrap.sh does without the server """
+    sys.stdout.flush()
+    os.execvp(sys.executable, [sys.executable, '-m', 'TaskWorker.TaskManagerBootstrap'] + args)
+
+
+def receive(sock):
+    """ the next message from the server, an empty string if it went away """
+    while True:
+        try:
+            return sock.recv(64).decode('utf-8')
+        except InterruptedError:
+            continue
+        except ConnectionResetError:
+            return ''
+
+
+def main():
+    """ send the request, forward signals, wait for the exit status """
+    args = sys.argv[1:]
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+    try:
+        sock.connect(SOCKET_NAME)
+        request = json.dumps({'args': args, 'cwd': os.getcwd(), 'env': dict(os.environ)}).encode('utf-8')
+        sock.sendmsg([request], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', [0, 1, 2]))])
+        ack = receive(sock)
+        if ack != 'STARTED':
+            raise ConnectionAbortedError("no confirmation that the command was started")
+    except OSError as ex:
+        # the command was not started, it is safe to run it here
+        print(f"TaskManagerServer not available ({ex}), running {' '.join(args)} here")
+        sock.close()
+        if not os.path.exists(SOCKET_NAME) or isinstance(ex, ConnectionRefusedError):
+            startServer()
+        runHere(args)
+
+    def forward(signum, frame):  # pylint: disable=unused-argument
+        try:
+            sock.send(b'SIG %d' % signum)
+        except OSError:
+            pass
+    for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, forward)
+
+    reply = receive(sock)
+    if not reply:
+        # the server died while running the command, which dies with it, and we do not know
+        # how far it got: have DAGMan run it again later where its DAG line allows a deferral,
+        # otherwise start it over here (exiting with DEFER_EXIT_CODE would fail the PRE script)
+        print("TaskManagerServer went away while running the command", file=sys.stderr)
+        if args and args[0] in DEFERRABLE_COMMANDS:
+            return DEFER_EXIT_CODE
+        sock.close()
+        runHere(args)
+    kind, value = reply.split()
+    if kind == 'SIGNALED':
+        signal.signal(int(value), signal.SIG_DFL)
+        os.kill(os.getpid(), int(value))
+    return int(value)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
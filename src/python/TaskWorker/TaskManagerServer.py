@@ -0,0 +1,378 @@
+"""
+Long lived server which runs the TaskManagerBootstrap commands (PREJOB, POSTJOB, PREDAG)
+of one task on the schedd, so that each DAG node script does not pay the start up of a
+python interpreter and the import of htcondor, classad, WMCore, RESTInteractions, ...
+
+The server imports all of that once, then listens on a Unix socket in the task directory
+(SOCKET_NAME). For each request TaskManagerClient sends its command line arguments,
+working directory and environment, plus its stdin, stdout and stderr file descriptors.
+The server forks a child which takes those file descriptors, directory and environment
+and runs TaskManagerBootstrap.main() exactly as `python3 -m TaskWorker.TaskManagerBootstrap`
+would, so each command still runs in a pristine process (PostJob keeps state in module
+globals) and output goes where it always went. Once the child is forked the client is told
+STARTED, until then it can still run the command itself. The exit code of the child (or the
+signal which killed it) goes back to the client, which exits with it: DAGMan sees the same
+exit codes, including the DEFER one. Signals received by the client are forwarded to the
+child, and the child is terminated if the client or the server go away. In the latter case
+the client defers the command (POSTJOB, PREDAG) or runs it again itself (PREJOB, whose DAG
+line has a DEFER clause only with CRAB_JobReleaseTimeout).
+
+The server is started by the first client which does not find it (see TaskManagerClient),
+holds LOCK_NAME for its whole life so that there is never more than one per task, and
+exits after --idle-timeout seconds without requests. With everything preloaded a server
+takes about 70 MB of memory, and there is one per running task on the schedd: the idle
+timeout is short, a task which is quiet for longer pays one server start up, i.e. the cost
+of one command run without the server.
+
+Enabled on a schedd by creating /etc/enable_taskmanager_server, see dag_bootstrap_startup.sh
+"""
+
+import os
+import sys
+import json
+import time
+import array
+import errno
+import fcntl
+import ctypes
+import signal
+import socket
+import logging
+import argparse
+import importlib
+import selectors
+import traceback
+
+SOCKET_NAME = 'task_process/taskmanager.sock'
+LOCK_NAME = 'task_process/taskmanager.lock'
+FAILED_NAME = 'task_process/taskmanager_server.failed'
+LOG_NAME = 'task_process/taskmanager_server.log'
+
+# a request carries the whole environment, which is a few kB
+MAX_MESSAGE = 1024 * 1024
+N_FDS = 3
+# see prctl(2)
+PR_SET_PDEATHSIG = 1
+# imported by the actions only on the paths which need them, so that a DAG node script
+# run without the server does not pay for them: the server imports them once for all
+LAZY_IMPORTS = ('htcondor', 'requests', 'RESTInteractions', 'RucioUtils', 'CMSGroupMapper', 'WMCore.Lexicon',
+                'WMCore.DataStructs.LumiList', 'WMCore.Services.WMArchive.DataMap',
+                'TaskWorker.Actions.Splitter', 'TaskWorker.Actions.DagmanCreator')
+
+
+def sendFds(sock, data, fds):
+    """ send one message with the file descriptors fds attached """
+    sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array('i', fds))])
+
+
+def recvFds(sock, maxFds):
+    """ receive one message and the file descriptors attached to it """
+    fds = array.array('i')
+    data, ancdata, _, _ = sock.recvmsg(MAX_MESSAGE, socket.CMSG_LEN(maxFds * fds.itemsize))
+    for level, kind, cmsgData in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cmsgData[:len(cmsgData) - (len(cmsgData) % fds.itemsize)])
+    return data, list(fds)
+
+
+def exitCode(code):
+    """ the exit status of a process which raised SystemExit(code), as the interpreter does it """
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code & 0xff
+    print(code, file=sys.stderr)
+    return 1
+
+
+class TaskManagerServer():
+    """
+    see module docstring
+    """
+
+    def __init__(self, idleTimeout, logger):
+        self.idleTimeout = idleTimeout
+        self.logger = logger
+        self.selector = selectors.DefaultSelector()
+        self.listener = None
+        self.lockFd = None
+        # written to when a signal arrives, so that the main loop wakes up as soon as a child exits
+        self.wakeupRead, self.wakeupWrite = os.pipe()
+        self.children = {}  # pid -> connection of the client
+        self.connections = {}  # connection -> pid, or None until the request is read
+        self.lastActivity = time.time()
+        self.stopping = False
+        # signal handlers installed by the imported modules (PostJob has some), for the children
+        self.childHandlers = {}
+
+    def acquire(self):
+        """ take the task lock, return False if another server has it """
+        self.lockFd = os.open(LOCK_NAME, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self.lockFd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError as ex:
+            if ex.errno in (errno.EAGAIN, errno.EACCES):
+                os.close(self.lockFd)
+                return False
+            raise
+        return True
+
+    def listen(self):
+        """ bind the socket, removing the one of a server which did not exit cleanly """
+        if os.path.exists(SOCKET_NAME):
+            os.unlink(SOCKET_NAME)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        oldUmask = os.umask(0o177)
+        try:
+            self.listener.bind(SOCKET_NAME)
+        finally:
+            os.umask(oldUmask)
+        self.listener.listen(64)
+        self.selector.register(self.listener, selectors.EVENT_READ)
+
+    def preload(self):
+        """ import everything the commands need, once for all """
+        from TaskWorker import TaskManagerBootstrap  # pylint: disable=import-outside-toplevel
+        for command in TaskManagerBootstrap.COMMANDS:
+            TaskManagerBootstrap.loadAction(command)
+        for name in LAZY_IMPORTS:
+            try:
+                importlib.import_module(name)
+            except Exception as ex:  # pylint: disable=broad-except
+                # the children will import it if they need it, and fail as they would without the server
+                self.logger.warning("Failed to preload %s: %s", name, ex)
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            self.childHandlers[signum] = signal.getsignal(signum)
+
+    def stop(self, signum, frame):  # pylint: disable=unused-argument
+        """ stop accepting requests, exit once the running ones are done """
+        self.logger.info("Received signal %d, stopping", signum)
+        self.stopping = True
+
+    def serve(self):
+        """ main loop """
+        for signum in (signal.SIGHUP, signal.SIGINT, signal.SIGTERM):
+            signal.signal(signum, self.stop)
+        for fd in (self.wakeupRead, self.wakeupWrite):
+            os.set_blocking(fd, False)
+        signal.set_wakeup_fd(self.wakeupWrite)
+        signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+        self.selector.register(self.wakeupRead, selectors.EVENT_READ)
+        self.logger.info("Serving on %s (pid %d)", SOCKET_NAME, os.getpid())
+        while True:
+            if self.stopping and self.listener:
+                self.closeListener()
+            if not self.children and not self.connections:
+                if self.stopping or time.time() - self.lastActivity > self.idleTimeout:
+                    break
+            for key, _ in self.selector.select(timeout=5):
+                if key.fileobj is self.listener:
+                    self.accept()
+                elif key.fileobj == self.wakeupRead:
+                    try:
+                        os.read(self.wakeupRead, 4096)
+                    except BlockingIOError:
+                        pass
+                else:
+                    self.readClient(key.fileobj)
+            self.reap()
+        if self.listener:
+            self.closeListener()
+        self.logger.info("Exiting")
+
+    def closeListener(self):
+        """ no more requests: the next client will start a new server or run the command itself """
+        self.selector.unregister(self.listener)
+        self.listener.close()
+        self.listener = None
+        try:
+            os.unlink(SOCKET_NAME)
+        except OSError:
+            pass
+
+    def accept(self):
+        """ new client """
+        conn, _ = self.listener.accept()
+        self.selector.register(conn, selectors.EVENT_READ)
+        self.connections[conn] = None
+        self.lastActivity = time.time()
+
+    def closeClient(self, conn):
+        """ forget about a client """
+        self.selector.unregister(conn)
+        self.connections.pop(conn, None)
+        conn.close()
+
+    def readClient(self, conn):
+        """ a request, a signal to forward, or the client went away """
+        pid = self.connections[conn]
+        if pid is None:
+            try:
+                data, fds = recvFds(conn, N_FDS)
+            except OSError as ex:
+                self.logger.warning("Failed to read request: %s", ex)
+                self.closeClient(conn)
+                return
+            if not data:
+                self.closeClient(conn)
+                return
+            try:
+                self.start(conn, json.loads(data.decode('utf-8')), fds)
+            except Exception as ex:  # pylint: disable=broad-except
+                self.logger.exception("Failed to start request: %s", ex)
+                self.closeClient(conn)
+            finally:
+                for fd in fds:
+                    os.close(fd)
+            return
+        try:
+            data = conn.recv(64)
+        except OSError:
+            data = b''
+        if not data:
+            # the client was killed: do not leave the command running on its own
+            self.logger.info("Client of %d went away, terminating it", pid)
+            self.kill(pid, signal.SIGTERM)
+            self.connections[conn] = 0
+            self.selector.unregister(conn)
+            return
+        if data.startswith(b'SIG '):
+            self.kill(pid, int(data.split()[1]))
+
+    def kill(self, pid, signum):
+        """ send a signal to a child, which may have just exited """
+        try:
+            os.kill(pid, signum)
+        except OSError:
+            pass
+
+    def start(self, conn, request, fds):
+        """ fork the child which runs the request """
+        if len(fds) != N_FDS:
+            raise ValueError("Expected %d file descriptors, got %d" % (N_FDS, len(fds)))
+        serverPid = os.getpid()
+        pid = os.fork()
+        if pid == 0:
+            os._exit(self.runChild(request, fds, serverPid))  # pylint: disable=protected-access
+        self.logger.info("Started %d: %s in %s", pid, ' '.join(request['args']), request['cwd'])
+        self.children[pid] = conn
+        self.connections[conn] = pid
+        try:
+            conn.send(b'STARTED')
+        except OSError as ex:
+            self.logger.info("Client of %d went away (%s), terminating it", pid, ex)
+            self.kill(pid, signal.SIGTERM)
+            self.connections[conn] = 0
+            self.selector.unregister(conn)
+
+    def runChild(self, request, fds, serverPid):
+        """ in the child: become the process which `python3 -m TaskWorker.TaskManagerBootstrap` would be """
+        code = 1
+        try:
+            # the client defers or reruns the command if the server dies: make sure it does not go on here
+            ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+            if os.getppid() != serverPid:
+                return code
+            signal.set_wakeup_fd(-1)
+            signal.signal(signal.SIGCHLD, signal.SIG_DFL)
+            for signum, handler in self.childHandlers.items():
+                signal.signal(signum, handler)
+            self.selector.close()
+            os.close(self.wakeupRead)
+            os.close(self.wakeupWrite)
+            for sock in list(self.connections) + [self.listener]:
+                if sock:
+                    sock.close()
+            os.close(self.lockFd)
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+            os.chdir(request['cwd'])
+            os.environ.clear()
+            os.environ.update(request['env'])
+            rootLogger = logging.getLogger()
+            for handler in list(rootLogger.handlers):
+                rootLogger.removeHandler(handler)
+            from TaskWorker import TaskManagerBootstrap  # pylint: disable=import-outside-toplevel
+            sys.argv = [TaskManagerBootstrap.__file__] + request['args']
+            try:
+                TaskManagerBootstrap.main()
+                code = 0
+            except SystemExit as ex:
+                code = exitCode(ex.code)
+        except BaseException:  # pylint: disable=broad-except
+            # what the interpreter does with an uncaught exception
+            traceback.print_exc()
+            code = 1
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                logging.shutdown()
+            except Exception:  # pylint: disable=broad-except
+                pass
+        return code
+
+    def reap(self):
+        """ send the exit status of the children which are done to their clients """
+        while self.children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                break
+            if pid == 0:
+                break
+            conn = self.children.pop(pid, None)
+            if conn is None:
+                continue
+            if os.WIFSIGNALED(status):
+                reply = 'SIGNALED %d' % os.WTERMSIG(status)
+            else:
+                reply = 'EXIT %d' % os.WEXITSTATUS(status)
+            self.logger.info("%d finished: %s", pid, reply)
+            if self.connections.get(conn):
+                try:
+                    conn.send(reply.encode('utf-8'))
+                except OSError:
+                    pass
+                self.selector.unregister(conn)
+            self.connections.pop(conn, None)
+            conn.close()
+            self.lastActivity = time.time()
+
+
+def main():
+    """ run the server in the current directory, which must be the task directory """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--idle-timeout', type=int, default=300,
+                        help="exit after this many seconds without requests")
+    args = parser.parse_args()
+
+    logger = logging.getLogger('TaskManagerServer')
+    handler = logging.FileHandler(LOG_NAME)
+    handler.setFormatter(logging.Formatter("%(asctime)s:%(levelname)s:%(message)s"))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    server = TaskManagerServer(args.idle_timeout, logger)
+    if not server.acquire():
+        return 0
+    try:
+        server.preload()
+    except Exception:  # pylint: disable=broad-except
+        # clients must not try to start a server again and again
+        logger.exception("Failed to import the TaskManagerBootstrap commands, clients will run them themselves")
+        with open(FAILED_NAME, 'w', encoding='utf-8') as fd:
+            fd.write(traceback.format_exc())
+        return 1
+    server.listen()
+    try:
+        server.serve()
+    finally:
+        if server.listener:
+            server.closeListener()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,3 +1,6 @@
+import time
+
+
 class TestWorker(object):
     """ TestWorker class providing a sequential execution of the work in the same thread of the caller
         This is useful for debugging purposes because because there are problems executing pdb with
@@ -25,14 +28,19 @@ class TestWorker(object):
     def queueableTasks(self):
         return 1
 
-    def injectWorks(self, works):
+    def injectWorks(self, works, acquired=None):
         if works:
             func, task, _, args = works[0]
             try:
                 func(self.resthost, self.dbInstance, self.config, task, 0, args)
             except Exception:
                 pass
-    def checkFinished(self):
+    def checkFinished(self, timeout=None):
+        if timeout:
+            time.sleep(timeout)
+        return []
+
+    def dispatchLatencies(self):
         return []
 
     def end(self):
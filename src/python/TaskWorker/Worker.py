@@ -130,7 +130,8 @@ def processWorkerLoop(inputs, results, resthost, dbInstance, procnum, logger, lo
 
         results.put({
                      'workid': workid,
-                     'out' : outputs
+                     'out' : outputs,
+                     'started': t0
                     })
 
 
@@ -186,6 +187,7 @@ class Worker(object):
         self.inputs  = multiprocessing.Queue(self.leninqueue)
         self.results = multiprocessing.Queue()
         self.working = {}
+        self.latencies = []
         self.resthost = resthost
         self.dbInstance = dbInstance
 
@@ -226,35 +228,45 @@ class Worker(object):
         self.pool = []
         return
 
-    def injectWorks(self, items):
+    def injectWorks(self, items, acquired=None):
         """Takes care of iterating on the input works to do and
            injecting them into the queue shared with the slaves
 
            :arg list of tuple items: list of tuple, where each element
                                      contains the type of work to be
-                                     done, the task object and the args."""
+                                     done, the task object and the args.
+           :arg float acquired: time when the works have been acquired (set
+                                to HOLDING) by the master, used to measure
+                                the dispatch latency."""
         self.logger.debug("Ready to inject %d items", len(items))
         workid = 0 if len(self.working.keys()) == 0 else max(self.working.keys()) + 1
         for work in items:
             worktype, task, failstatus, arguments = work
             self.inputs.put((workid, worktype, task, failstatus, arguments))
-            self.working[workid] = {'workflow': task['tm_taskname'], 'injected': time.time()}
+            self.working[workid] = {'workflow': task['tm_taskname'], 'injected': time.time(), 'acquired': acquired}
             self.logger.info('Injecting work %d: %s', workid, task['tm_taskname'])
             workid += 1
         self.logger.debug("Injection completed.")
 
-    def checkFinished(self):
+    def checkFinished(self, timeout=None):
         """Verifies if there are any finished jobs in the output queue
 
+           :arg float timeout: if set, wait up to timeout seconds for a work
+                               to finish before draining the output queue.
            :return Result: the output of the work completed."""
         if len(self.working.keys()) == 0:
+            if timeout:
+                time.sleep(timeout)
             return []
         allout = []
         self.logger.info("%d work on going, checking if some has finished", len(self.working.keys()))
-        for _ in range(len(self.working.keys())):
+        for i in range(len(self.working.keys())):
             out = None
             try:
-                out = self.results.get_nowait()
+                if i == 0 and timeout:
+                    out = self.results.get(timeout=timeout)
+                else:
+                    out = self.results.get_nowait()
             except Empty:
                 pass
             if out is not None:
@@ -269,6 +281,10 @@ class Worker(object):
                     # recurring actions do not return a Result object
                     self.logger.debug('Completed work %s', str(out))
 
+                acquired = self.working[workid].get('acquired')
+                if acquired and out.get('started'):
+                    self.latencies.append(out['started'] - acquired)
+
                 if isinstance(out['out'], list):
                     allout.extend(out['out'])
                 else:
@@ -276,6 +292,15 @@ class Worker(object):
                 del self.working[out['workid']]
         return allout
 
+    def dispatchLatencies(self):
+        """Return and reset the list of the time (in seconds) that the finished
+           works waited between being acquired by the master (HOLDING) and
+           the start of their processing in a slave.
+
+           :return list: the latencies collected since the last call."""
+        latencies, self.latencies = self.latencies, []
+        return latencies
+
     def freeSlaves(self):
         """Count how many unemployed slaves are there
 
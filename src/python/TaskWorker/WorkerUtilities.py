@@ -42,8 +42,10 @@ def getCrabserver(restConfig=None, agentName='crabtest', logger=None):
     # Let's increase the server's retries for recoverable errors in the MasterWorker
     # 20 means we'll keep retrying for about 1 hour
     # we wait at 20*NUMRETRY seconds after each try, so retry at: 20s, 60s, 120s ... 20*(n*(n+1))/2
+    # pooledConnections keeps HTTPS connections alive across requests, see RESTInteractions.CurlPool
     crabserver = CRABRest(restHost, restConfig.cert, restConfig.key, retry=20,
-                               logger=logger, userAgent=agentName)
+                               logger=logger, userAgent=agentName,
+                               pooled=getattr(restConfig, 'pooledConnections', False))
     crabserver.setDbInstance(dbInstance)
 
     logger.info('Will connect to CRAB REST via: https://%s/crabserver/%s', restHost, dbInstance)
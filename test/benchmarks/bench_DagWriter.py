@@ -0,0 +1,127 @@
+"""
+Benchmark of the DAG writing part of DagmanCreator.createSubdag on synthetic splitter
+output: --jobs jobs, each with --files input files and a lumi mask of --lumis lumis.
+Compares the old way (str.format of DAG_FRAGMENT for each node, one temporary file per
+job and per archive, tarfile.add of the temporary directories) with renderTemplate and
+writeJobPayloads, serially and with a pool of --processes processes, and checks that
+the archives have the same content.
+
+Needs what DagmanCreator.py imports (WMCore, classad).
+
+run with:
+
+PYTHONPATH=src/python python3 test/benchmarks/bench_DagWriter.py --jobs 10000 --processes 4
+"""
+
+import os
+import json
+import time
+import shutil
+import logging
+import tarfile
+import argparse
+import tempfile
+
+from TaskWorker.Actions.DagmanCreator import DAG_FRAGMENT, DAG_FRAGMENT_COMPILED, renderTemplate, writeJobPayloads
+
+LFN = '/store/data/Run2024C/Muon0/MINIAOD/PromptReco-v1/000/379/%03d/00000/%08x-1c2d-4e5f-8a9b-0c1d2e3f4a5b.root'
+
+
+def makeDagSpecs(nJobs, nFiles, nLumis):
+    """ node specs as makeDagSpecs returns them, with the fields which matter for the size of the output """
+    dagSpecs = []
+    for i in range(1, nJobs + 1):
+        run = 379000 + i // 100
+        firstLumi = (i % 100) * nLumis + 1
+        dagSpecs.append({
+            'count': str(i), 'prescriptDefer': '', 'maxretries': 3, 'taskname': '240301_080000:user_crab_bench',
+            'backend': 'vocms0001.cern.ch', 'stage': 'conventional',
+            'tempDest': '/store/temp/user/user.abcdef/Muon0/bench/240301_080000/%04d' % (i // 1000),
+            'outputDest': '/store/user/user/Muon0/bench/240301_080000/%04d' % (i // 1000),
+            'remoteOutputFiles': 'output_%d.root' % i, 'localOutputFiles': 'output.root=output_%d.root' % i,
+            'runAndLumiMask': {str(run): [[firstLumi, firstLumi + nLumis - 1]]},
+            'inputFiles': [LFN % (i % 1000, i * nFiles + f) for f in range(nFiles)],
+            'firstEvent': 'None', 'lastEvent': 'None', 'firstLumi': 'None', 'firstRun': 'None',
+            'seeding': 'AutomaticSeeding', 'lheInputFiles': False, 'eventsPerLumi': None, 'maxRuntime': 72000,
+            'block': '/Muon0/Run2024C-PromptReco-v1/MINIAOD#%d' % (i // 50),
+            'destination': 'davs://eoscms.cern.ch:443/eos/cms/store/user/user/%d/log/cmsRun_%d.log.tar.gz' % (i, i),
+            'scriptExe': None, 'scriptArgs': '[]',
+        })
+    return dagSpecs
+
+
+def oldWriter(dagSpecs):
+    """ the DAG and the archives as createSubdag wrote them before writeJobPayloads """
+    dag = ''
+    for dagSpec in dagSpecs:
+        dag += DAG_FRAGMENT.format(**dagSpec)
+    tempDir = tempfile.mkdtemp()
+    tempDir2 = tempfile.mkdtemp()
+    tfd = tarfile.open('run_and_lumis.tar.gz', 'w:gz')
+    tfd2 = tarfile.open('input_files.tar.gz', 'w:gz')
+    for dagSpec in dagSpecs:
+        with open(os.path.join(tempDir, 'job_lumis_' + str(dagSpec['count']) + '.json'), 'w', encoding='utf-8') as fd:
+            fd.write(json.dumps(dagSpec['runAndLumiMask']))
+        with open(os.path.join(tempDir2, 'job_input_file_list_' + str(dagSpec['count']) + '.txt'),
+                  'w', encoding='utf-8') as fd2:
+            fd2.write(json.dumps(dagSpec['inputFiles']))
+    tfd.add(tempDir, arcname='')
+    tfd.close()
+    shutil.rmtree(tempDir)
+    tfd2.add(tempDir2, arcname='')
+    tfd2.close()
+    shutil.rmtree(tempDir2)
+    return dag
+
+
+def archiveContent(archive):
+    """ {member name: content} of the regular files in an archive """
+    with tarfile.open(archive) as tf:
+        return {member.name: tf.extractfile(member).read() for member in tf.getmembers() if member.isfile()}
+
+
+def main():
+    """ run the benchmark """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=10000)
+    parser.add_argument('--files', type=int, default=5, help="input files per job")
+    parser.add_argument('--lumis', type=int, default=20, help="lumis per job")
+    parser.add_argument('--processes', type=int, default=4)
+    args = parser.parse_args()
+    logger = logging.getLogger()
+
+    dagSpecs = makeDagSpecs(args.jobs, args.files, args.lumis)
+    workDir = tempfile.mkdtemp()
+    os.chdir(workDir)
+    try:
+        start = time.time()
+        oldDag = oldWriter(dagSpecs)
+        print("%-45s %8.3f s" % ("format + temporary files + tarfile.add", time.time() - start))
+        expected = [archiveContent('run_and_lumis.tar.gz'), archiveContent('input_files.tar.gz')]
+
+        for processes in (1, args.processes):
+            for archive in ('run_and_lumis.tar.gz', 'input_files.tar.gz'):
+                os.unlink(archive)
+            start = time.time()
+            dag = renderTemplate(DAG_FRAGMENT_COMPILED, dagSpecs)
+            writeJobPayloads(dagSpecs, processes, logger)
+            print("%-45s %8.3f s" % ("renderTemplate + writeJobPayloads, %d proc" % processes, time.time() - start))
+            assert dag == oldDag
+            assert [archiveContent('run_and_lumis.tar.gz'), archiveContent('input_files.tar.gz')] == expected
+
+        # a tail stage adds to the archives of the processing stage
+        tail = makeDagSpecs(args.jobs // 10, args.files, args.lumis)
+        for dagSpec in tail:
+            dagSpec['count'] = '0-' + dagSpec['count']
+        start = time.time()
+        writeJobPayloads(tail, args.processes, logger)
+        print("%-45s %8.3f s" % ("adding %d tail jobs" % len(tail), time.time() - start))
+        assert len(archiveContent('run_and_lumis.tar.gz')) == args.jobs + len(tail)
+        print("archive sizes: %d and %d bytes" % (os.path.getsize('run_and_lumis.tar.gz'),
+                                                  os.path.getsize('input_files.tar.gz')))
+    finally:
+        shutil.rmtree(workDir)
+
+
+if __name__ == '__main__':
+    main()
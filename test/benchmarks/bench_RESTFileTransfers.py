@@ -0,0 +1,81 @@
+"""
+Micro-benchmark of the updateTransfers/updatePublication subresources of RESTFileTransfers:
+one statement execution per row (old behaviour) vs. array-bound executemany in chunks.
+An in-memory sqlite table stands in for the Oracle filetransfersdb table.
+
+run with:
+
+PYTHONPATH=src/python python3 test/benchmarks/bench_RESTFileTransfers.py --rows 500 --chunk 1000
+"""
+
+import argparse
+import sqlite3
+import time
+
+from Databases.FileTransfersDB.Oracle.FileTransfers.FileTransfers import FileTransfers
+
+CREATE_SQL = """CREATE TABLE filetransfersdb(
+    tm_id VARCHAR(60) PRIMARY KEY, tm_aso_worker VARCHAR(100), tm_last_update INTEGER,
+    tm_transfer_state INTEGER, tm_transfer_failure_reason VARCHAR(1000), tm_transfer_retry_count INTEGER,
+    tm_fts_id VARCHAR(255), tm_fts_instance VARCHAR(255),
+    tm_publication_state INTEGER, tm_publication_failure_reason VARCHAR(1000),
+    tm_publication_retry_count INTEGER, tm_publish INTEGER)"""
+
+
+def makeDB(nRows):
+    """ create and fill the stand-in table """
+    conn = sqlite3.connect(':memory:')
+    conn.execute(CREATE_SQL)
+    conn.executemany("INSERT INTO filetransfersdb VALUES (?, 'schedd', 0, 0, '', 0, NULL, NULL, 0, '', 0, 1)",
+                     [('id%d' % i,) for i in range(nRows)])
+    conn.commit()
+    return conn
+
+
+def makeRows(nRows):
+    """ one bind dictionary per row, as built by RESTFileTransfers.bulkModify """
+    transfers = [{'id': 'id%d' % i, 'transfer_state': 2, 'last_update': int(time.time()), 'asoworker': 'schedd',
+                  'fail_reason': '', 'retry_value': 0, 'fts_id': 'fts%d' % i, 'fts_instance': 'https://fts3-cms.cern.ch:8446/'}
+                 for i in range(nRows)]
+    publications = [{'id': 'id%d' % i, 'publication_state': 2, 'last_update': int(time.time()), 'asoworker': 'schedd',
+                     'fail_reason': '', 'retry_value': 1, 'publish': -1}
+                    for i in range(nRows)]
+    return transfers, publications
+
+
+def perRow(conn, sql, rows, chunk):  # pylint: disable=unused-argument
+    """ old behaviour: one execute (and one commit, as modifynocheck does) per row """
+    for row in rows:
+        conn.execute(sql, row)
+        conn.commit()
+
+
+def bulk(conn, sql, rows, chunk):
+    """ new behaviour: one executemany and commit per chunk """
+    for start in range(0, len(rows), chunk):
+        conn.executemany(sql, rows[start:start + chunk])
+        conn.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser(formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument("-r", "--rows", help="number of files in the request", type=int, default=500)
+    parser.add_argument("-c", "--chunk", help="executemany chunk size", type=int, default=1000)
+    parser.add_argument("-l", "--loops", help="number of repetitions", type=int, default=5)
+    args = parser.parse_args()
+
+    transfers, publications = makeRows(args.rows)
+    for label, sql, rows in [('updateTransfers', FileTransfers.UpdateTransfers_sql, transfers),
+                             ('updatePublication', FileTransfers.UpdatePublication_sql, publications)]:
+        for mode in (perRow, bulk):
+            conn = makeDB(args.rows)
+            start = time.perf_counter()
+            for _ in range(args.loops):
+                mode(conn, sql, rows, args.chunk)
+            elapsed = (time.perf_counter() - start) / args.loops
+            print("%-18s %-7s %8.2f ms/request %8.2f us/row" % (label, mode.__name__, elapsed * 1e3, elapsed * 1e6 / args.rows))
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""
+Benchmark of the end to end latency of the DAG node scripts with and without the
+TaskManagerServer: runs the same TaskManagerBootstrap command --runs times as
+`python3 -m TaskWorker.TaskManagerBootstrap <command>` (what dag_bootstrap.sh does
+without the server), then --runs times as `python3 -m TaskWorker.TaskManagerClient <command>`
+with a server running, and prints the latency of both.
+
+Needs a task directory on a schedd (or a copy of one, the command may modify it) and
+the environment of dag_bootstrap.sh (PYTHONPATH with CRAB3.zip, X509_USER_PROXY, ...).
+The command is e.g. the POSTJOB line of a node in RunJobs.dag, with
+TEST_POSTJOB_NO_STATUS_UPDATE=1 in the environment to keep the REST out of it.
+
+run with:
+
+PYTHONPATH=src/python python3 test/benchmarks/bench_TaskManagerServer.py --taskdir <copy of task dir> --runs 20 \\
+    -- POSTJOB 1234.0 0 0 10 <taskname> 1 <tempDest> <outputDest> cmsRun_1.log.tar.gz conventional output_1.root
+"""
+
+import os
+import sys
+import time
+import signal
+import argparse
+import statistics
+import subprocess
+
+from TaskWorker.TaskManagerServer import SOCKET_NAME
+
+
+def timeRuns(module, command, runs):
+    """ latency in seconds of each run of `python3 -m module command`, and the set of exit codes """
+    latencies = []
+    exitCodes = set()
+    for _ in range(runs):
+        start = time.time()
+        exitCodes.add(subprocess.call([sys.executable, '-m', module] + command,
+                                      stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        latencies.append(time.time() - start)
+    return latencies, exitCodes
+
+
+def report(label, latencies, exitCodes):
+    """ print one line of results """
+    latencies = sorted(latencies)
+    print("%-12s mean %7.3f s  median %7.3f s  p95 %7.3f s  exit codes %s" %
+          (label, statistics.mean(latencies), statistics.median(latencies),
+           latencies[int(0.95 * (len(latencies) - 1))], sorted(exitCodes)))
+
+
+def main():
+    """ run the benchmark """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--taskdir', required=True)
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('command', nargs=argparse.REMAINDER, help="TaskManagerBootstrap arguments, after --")
+    args = parser.parse_args()
+    command = args.command[1:] if args.command[:1] == ['--'] else args.command
+    os.chdir(args.taskdir)
+    os.makedirs('task_process', exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path[1:]))
+    os.environ.update(env)
+
+    report("no server", *timeRuns('TaskWorker.TaskManagerBootstrap', command, args.runs))
+
+    server = subprocess.Popen([sys.executable, '-m', 'TaskWorker.TaskManagerServer', '--idle-timeout', '60'])
+    try:
+        start = time.time()
+        while not os.path.exists(SOCKET_NAME):
+            if server.poll() is not None:
+                sys.exit("TaskManagerServer exited with code %d, see task_process/" % server.returncode)
+            time.sleep(0.05)
+        print("server started in %.3f s" % (time.time() - start))
+        report("server", *timeRuns('TaskWorker.TaskManagerClient', command, args.runs))
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+if __name__ == '__main__':
+    main()
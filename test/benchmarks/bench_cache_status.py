@@ -0,0 +1,92 @@
+"""
+Benchmark of the job log parsing in cache_status.py: replays a synthetic event log
+(submit, execute, image size, ad information, terminate and post script events for
+each job) through parseJobLog and parseNodeStateV2-like node creation and reports
+the throughput in events/sec. Also times the old per node/per event costs
+(copy.deepcopy of a template dict and time.strptime) against the current ones.
+
+Needs the htcondor python bindings, which cache_status.py imports.
+
+run with:
+
+PYTHONPATH=scripts/task_process python3 test/benchmarks/bench_cache_status.py --jobs 50000
+"""
+
+import argparse
+import copy
+import time
+
+import cache_status
+
+TEMPLATE = cache_status.newNodeInfo()
+
+
+class ReplayLog(object):
+    """ stands in for htcondor.JobEventLog, which can not be built from memory """
+    def __init__(self, events):
+        self._events = events
+
+    def events(self, stop_after):  # pylint: disable=unused-argument
+        """ same signature as JobEventLog.events """
+        return iter(self._events)
+
+
+def makeEvents(nJobs):
+    """ a plausible job log: 6 events per job, spread over a few hours """
+    start = time.mktime((2024, 3, 1, 8, 0, 0, 0, 0, -1))
+    events = []
+    for job in range(1, nJobs + 1):
+        cluster = 1000 + job
+        t0 = start + job % 3600
+        def eventTime(offset):
+            return time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(t0 + offset))
+        events.append({'MyType': 'SubmitEvent', 'EventTime': eventTime(0), 'Cluster': cluster, 'Proc': 0,
+                       'LogNotes': 'DAG Node: Job%d' % job})
+        events.append({'MyType': 'ExecuteEvent', 'EventTime': eventTime(60), 'Cluster': cluster, 'Proc': 0})
+        events.append({'MyType': 'JobAdInformationEvent', 'EventTime': eventTime(61), 'Cluster': cluster, 'Proc': 0,
+                       'JOBGLIDEIN_CMSSite': 'T2_CH_CERN'})
+        events.append({'MyType': 'JobImageSizeEvent', 'EventTime': eventTime(300), 'Cluster': cluster, 'Proc': 0,
+                       'ResidentSetSize': 1500000})
+        events.append({'MyType': 'JobTerminatedEvent', 'EventTime': eventTime(3600), 'Cluster': cluster, 'Proc': 0,
+                       'TerminatedNormally': True, 'ReturnValue': 0,
+                       'TotalRemoteUsage': 'Usr 0 00:50:00, Sys 0 00:01:00'})
+        events.append({'MyType': 'PostScriptTerminatedEvent', 'EventTime': eventTime(3700),
+                       'DAGNodeName': 'Job%d' % job, 'TerminatedNormally': True, 'ReturnValue': 0})
+    return events
+
+
+def timeIt(label, func, count):
+    """ run func once, print and return the rate """
+    start = time.time()
+    func()
+    elapsed = time.time() - start
+    print("%-40s %8.3f s  %12.0f /s" % (label, elapsed, count / elapsed))
+    return elapsed
+
+
+def main():
+    """ run the benchmark """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=50000)
+    args = parser.parse_args()
+
+    events = makeEvents(args.jobs)
+    eventTimes = [event['EventTime'] for event in events]
+    print("%d jobs, %d events" % (args.jobs, len(events)))
+
+    timeIt("node creation, deepcopy", lambda: [copy.deepcopy(TEMPLATE) for _ in range(args.jobs)], args.jobs)
+    timeIt("node creation, newNodeInfo", lambda: [cache_status.newNodeInfo() for _ in range(args.jobs)], args.jobs)
+    timeIt("EventTime, strptime+mktime",
+           lambda: [time.mktime(time.strptime(t, "%Y-%m-%dT%H:%M:%S")) for t in eventTimes], len(events))
+    cache_status.eventTimeCache.clear()
+    timeIt("EventTime, parseEventTime", lambda: [cache_status.parseEventTime(t) for t in eventTimes], len(events))
+
+    cache_status.eventTimeCache.clear()
+    nodes = {}
+    nodeMap = {}
+    timeIt("parseJobLog", lambda: cache_status.parseJobLog(ReplayLog(events), nodes, nodeMap), len(events))
+    assert len(nodes) == args.jobs and all(info['State'] == 'finished' for info in nodes.values())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark of the secondary dataset matching in DBSDataDiscovery: for each primary file
+find the secondary files which share at least one (run, lumi).
+Synthetic datasets: primary files with --lumis lumis each, secondary files with a third
+of that, both covering the same runs. The old nested loop is only timed on the smallest
+size (and used to check the result), the inverted index on all sizes to show that
+it scales linearly.
+
+run with:
+
+PYTHONPATH=src/python python3 test/benchmarks/bench_secondaryMatching.py --sizes 1000 5000 20000
+"""
+
+import argparse
+import time
+
+from TaskWorker.Actions.DBSDataDiscovery import DBSDataDiscovery
+
+LUMIS_PER_RUN = 1000
+
+
+def makeDetails(nFiles, lumisPerFile, prefix):
+    """ {fileName: {'Lumis': {run: [lumis]}}} with consecutive lumis, as DBS would return """
+    details = {}
+    lumi = 0
+    for i in range(nFiles):
+        lumis = {}
+        for _ in range(lumisPerFile):
+            run, lumiInRun = divmod(lumi, LUMIS_PER_RUN)
+            lumis.setdefault(300000 + run, []).append(lumiInRun + 1)
+            lumi += 1
+        details[f'/store/{prefix}/file{i}.root'] = {'Lumis': lumis}
+    return details
+
+
+def nestedLoopMatch(filedetails, secondaryFiledetails):
+    """ the matching as it was done before the inverted index """
+    for infos in filedetails.values():
+        infos['Parents'] = []
+        for secondaryName, secondaryInfos in secondaryFiledetails.items():
+            commonRuns = infos['Lumis'].keys() & secondaryInfos['Lumis'].keys()
+            for run in commonRuns:
+                if set(infos['Lumis'][run]) & set(secondaryInfos['Lumis'][run]):
+                    infos['Parents'].append(secondaryName)
+                    break
+
+
+def main():
+    """ run the benchmark """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000, 20000],
+                        help="numbers of primary files, the secondary dataset has 3 times as many")
+    parser.add_argument('--lumis', type=int, default=30, help="lumis per primary file")
+    args = parser.parse_args()
+
+    for n, nPrimary in enumerate(args.sizes):
+        primary = makeDetails(nPrimary, args.lumis, 'primary')
+        secondary = makeDetails(3 * nPrimary, max(1, args.lumis // 3), 'secondary')
+        start = time.time()
+        DBSDataDiscovery.matchSecondaryFiles(primary, secondary)
+        elapsed = time.time() - start
+        print(f"{nPrimary:8d} x {3 * nPrimary:8d} files: inverted index {elapsed:8.3f} s "
+              f"({elapsed / nPrimary * 1e6:.1f} us per primary file)")
+        if n == 0:
+            indexParents = {name: infos['Parents'] for name, infos in primary.items()}
+            start = time.time()
+            nestedLoopMatch(primary, secondary)
+            print(f"{'':28s}nested loop    {time.time() - start:8.3f} s")
+            assert indexParents == {name: infos['Parents'] for name, infos in primary.items()}
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""
+Start up time of the DAG node scripts (PREJOB, POSTJOB, PREDAG of TaskManagerBootstrap),
+measured as the wall clock time of --runs fresh interpreters which import the module of
+the command, and check that it does not regress. Exits with 1 if:
+- a module in MUST_NOT_IMPORT is imported at start up (those are imported by the actions
+  only on the paths which need them), or
+- with --baseline, the fastest run of a command is more than --tolerance slower than in
+  the baseline, which is made on the same machine with --save-baseline.
+
+Needs what the actions import (classad, ServerUtilities, ...), i.e. a schedd or the
+TaskWorker container. Use TaskWorker.StartupReport to see where the time goes.
+
+run with:
+
+PYTHONPATH=src/python python3 test/benchmarks/bench_wrapperStartup.py --runs 20 --save-baseline /tmp/startup.json
+(make changes)
+PYTHONPATH=src/python python3 test/benchmarks/bench_wrapperStartup.py --runs 20 --baseline /tmp/startup.json
+"""
+
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+from TaskWorker.TaskManagerBootstrap import COMMANDS
+from TaskWorker.StartupReport import commandModule, measureStartup, importedModules, formatReport
+
+# modules (and their submodules) which a command must not import before it runs
+MUST_NOT_IMPORT = {
+    'POSTJOB': ['htcondor', 'requests', 'pycurl', 'RESTInteractions', 'WMCore', 'rucio', 'RucioUtils',
+                'TaskWorker.Actions.PreDAG', 'TaskWorker.Actions.PreJob'],
+    'PREJOB': ['htcondor', 'requests', 'pycurl', 'RESTInteractions', 'WMCore', 'rucio', 'RucioUtils',
+               'CMSGroupMapper', 'ldap', 'TaskWorker.Actions.PreDAG', 'TaskWorker.Actions.PostJob'],
+    'PREDAG': ['htcondor', 'requests', 'pycurl', 'RESTInteractions', 'WMCore', 'rucio', 'RucioUtils',
+               'TaskWorker.Actions.Splitter', 'TaskWorker.Actions.DagmanCreator', 'TaskWorker.Worker',
+               'TaskWorker.Actions.PostJob', 'TaskWorker.Actions.PreJob'],
+}
+
+
+def timeStartup(module, runs):
+    """ wall clock seconds of each of runs interpreters which import module (None: import nothing) """
+    times = []
+    for _ in range(runs):
+        start = time.time()
+        subprocess.run([sys.executable, '-c', f"import {module}" if module else 'pass'], check=True)
+        times.append(time.time() - start)
+    return times
+
+
+def unwantedImports(command, imports):
+    """ the modules in MUST_NOT_IMPORT[command] which are imported """
+    imported = importedModules(imports)
+    return sorted(name for name in imported
+                  if any(name == bad or name.startswith(bad + '.') for bad in MUST_NOT_IMPORT.get(command, [])))
+
+
+def main():
+    """ run the benchmark, return 1 if the start up regressed """
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--commands', nargs='+', default=list(COMMANDS), choices=list(COMMANDS))
+    parser.add_argument('--baseline', help="json file written by --save-baseline to compare with")
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help="fail if slower than the baseline by more than this fraction")
+    parser.add_argument('--save-baseline', help="write the results to this json file")
+    parser.add_argument('--report', action='store_true', help="also print the import time report of each command")
+    args = parser.parse_args()
+
+    failed = False
+    results = {'python': min(timeStartup(None, args.runs))}
+    print(f"{'python':10s} min {results['python']:.3f} s (interpreter alone)")
+    for command in args.commands:
+        times = timeStartup(commandModule(command), args.runs)
+        results[command] = min(times)
+        print(f"{command:10s} min {min(times):.3f} s  median {statistics.median(times):.3f} s")
+        _, imports = measureStartup(command)
+        unwanted = unwantedImports(command, imports)
+        if unwanted:
+            failed = True
+            print(f"  FAIL: imports {', '.join(unwanted)} at start up")
+        if args.report:
+            print('\n'.join(formatReport(command, *measureStartup(command))))
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as fd:
+            baseline = json.load(fd)
+        for command in args.commands:
+            if command not in baseline:
+                continue
+            limit = baseline[command] * (1 + args.tolerance)
+            if results[command] > limit:
+                failed = True
+                print(f"  FAIL: {command} starts in {results[command]:.3f} s, baseline {baseline[command]:.3f} s "
+                      f"(limit {limit:.3f} s)")
+    if args.save_baseline:
+        with open(args.save_baseline, 'w', encoding='utf-8') as fd:
+            json.dump(results, fd)
+
+    print("FAILED" if failed else "OK")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,6 +9,8 @@ Tape recall policy
 import pytest
 import json
 import os
+import time
+import threading
 from unittest.mock import patch, Mock
 from argparse import Namespace
 
@@ -51,3 +53,66 @@ def test_executeTapeRecallPolicy_deny(inputDataset, inputBlocks, totalSizeBytes,
     d = DBSDataDiscovery(config)
     with pytest.raises(TaskWorkerException):
         d.executeTapeRecallPolicy(inputDataset, inputBlocks, totalSizeBytes)
+
+def test_listBlocksReplicas(config_DBSDataDiscovery):
+    config = config_DBSDataDiscovery
+    config.TaskWorker.rucioLookupThreads = 4
+    blocks = [f'/GenericTTbar/Run3-Unittest-dataset/AODSIM#{i}' for i in range(20)]
+    calls = {}
+    threadsOfClient = {}
+    def makeClient(*args, **kwargs):  # pylint: disable=unused-argument
+        client = Mock()
+        def listDatasetReplicas(scope, name, deep):
+            threadsOfClient.setdefault(id(client), set()).add(threading.get_ident())
+            calls[name] = calls.get(name, 0) + 1
+            if name == blocks[3]:
+                raise RuntimeError('Rucio glitch')
+            if name == blocks[5] and calls[name] == 1:
+                raise RuntimeError('Rucio glitch, first time only')
+            time.sleep(0.01)
+            return iter([{'rse': 'T2_CH_CERN', 'state': 'AVAILABLE', 'bytes': 10}])
+        client.list_dataset_replicas.side_effect = listDatasetReplicas
+        return client
+    rucioClient = makeClient()
+    d = DBSDataDiscovery(config, rucioClient=rucioClient)
+    d.logger = Mock()
+    with patch('TaskWorker.Actions.DBSDataDiscovery.getNativeRucioClient', side_effect=makeClient) as getClient:
+        replicasMap = d.listBlocksReplicas('cms', blocks)
+    assert set(replicasMap) == set(blocks) - {blocks[3]}
+    assert replicasMap[blocks[0]] == [{'rse': 'T2_CH_CERN', 'state': 'AVAILABLE', 'bytes': 10}]
+    assert calls[blocks[3]] == 2 and calls[blocks[5]] == 2
+    d.logger.warning.assert_called_once()
+    # no client is used by two threads of the pool (the main thread retries with the one given)
+    assert getClient.call_count <= 3
+    assert all(len(threads - {threading.get_ident()}) == 1 for threads in threadsOfClient.values())
+
+def test_discoveryCacheOpenBlocks(config_DBSDataDiscovery, tmp_path):
+    config = config_DBSDataDiscovery
+    config.TaskWorker.discoveryCacheDir = str(tmp_path)
+    closed, opened = '/Closed/Run3-Unittest-dataset/AODSIM', '/Open/Run3-Unittest-dataset/AODSIM'
+    d = DBSDataDiscovery(config)
+    d.logger = Mock()
+    d.dbsInstance = 'prod/global'
+    d.dbs = Mock()
+    d.dbs.dbs.listBlocks.side_effect = lambda dataset, detail: [
+        {'block_name': dataset + '#1', 'open_for_writing': 0},
+        {'block_name': dataset + '#2', 'open_for_writing': 1 if dataset == opened else 0}]
+    d.dbs.dbs.listFiles.return_value = [{'logical_file_name': '/store/a.root', 'is_file_valid': 0}]
+    d.dbs.listDatasetFileDetails.side_effect = lambda dataset, **kwargs: {
+        '/store/a.root': {'ValidFile': 1, 'BlockName': dataset + '#1', 'Lumis': {1: [1, 2, 3]}, 'Parents': []}}
+    for dataset in (closed, opened):
+        first = d.listDatasetFileDetails(dataset, [dataset + '#1'], False, True)
+        assert first['/store/a.root']['ValidFile'] == 1
+    # closed dataset: details come from the cache with a fresh validity, open one: short lived entry
+    d.discoveryCache.evict()
+    d.discoveryCache.ttl['filevalidity'] = d.discoveryCache.ttl['openfiledetails'] = -1
+    again = d.listDatasetFileDetails(closed, [closed + '#1'], False, True)
+    assert again['/store/a.root'] == {'ValidFile': 0, 'BlockName': closed + '#1', 'Lumis': {1: [1, 2, 3]}, 'Parents': []}
+    assert d.dbs.listDatasetFileDetails.call_count == 2
+    d.listDatasetFileDetails(opened, [opened + '#1'], False, True)
+    assert d.dbs.listDatasetFileDetails.call_count == 3
+    # only the lumi counts of closed blocks are cached
+    d.getBlocksLumiCount = Mock(side_effect=lambda blocks: {block: 10 for block in blocks})
+    d.checkBlocksSize([opened + '#1', opened + '#2'])
+    d.checkBlocksSize([opened + '#1', opened + '#2'])
+    assert d.getBlocksLumiCount.call_args_list[-1][0][0] == [opened + '#2']
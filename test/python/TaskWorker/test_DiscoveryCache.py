@@ -0,0 +1,49 @@
+"""
+Test DiscoveryCache
+"""
+
+import copy
+import os
+import logging
+
+import pytest
+
+from TaskWorker import DiscoveryCache as dc
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return dc.DiscoveryCache(str(tmp_path), shortTTL=900, longTTL=3600, maxMB=1, logger=logging.getLogger())
+
+
+def test_compactFileDetails():
+    filedetails = {
+        '/store/a.root': {'BlockName': 'b1', 'Lumis': {1: [1, 2, 3, 7, 8], 2: [5, 3], 3: []}, 'Parents': []},
+        '/store/b.root': {'BlockName': 'b1', 'Lumis': {}, 'Parents': ['/store/p.root']},
+    }
+    compact = dc.compactFileDetails(filedetails)
+    assert compact['/store/a.root']['Lumis'] == {1: [[1, 3], [7, 8]], 2: [5, 3], 3: []}
+    assert dc.expandFileDetails(copy.deepcopy(compact)) == filedetails
+
+
+def test_putGet(cache):
+    cache.putMany(dc.REPLICAS, {'cms:b1': [{'rse': 'T2_CH_CERN'}], 'cms:b2': []})
+    assert cache.getMany(dc.REPLICAS, ['cms:b1', 'cms:b2', 'cms:b3']) == {'cms:b1': [{'rse': 'T2_CH_CERN'}], 'cms:b2': []}
+    assert cache.get(dc.BLOCKS, 'cms:b1') is None
+
+
+def test_expiration(cache):
+    cache.put(dc.BLOCKS, 'prod/global:/a/b/AOD', ['b1'])
+    cache.put(dc.FILEDETAILS, 'prod/global:/a/b/AOD', {})
+    cache.ttl[dc.BLOCKS] = -1
+    assert cache.get(dc.BLOCKS, 'prod/global:/a/b/AOD') is None
+    assert cache.get(dc.FILEDETAILS, 'prod/global:/a/b/AOD') == {}
+
+
+def test_eviction(cache):
+    # incompressible values of about 100 kB: 1 MB holds no more than 10 of them
+    cache.putMany(dc.BLOCKSUMMARY, {f'block{i}': os.urandom(100000) for i in range(5)})
+    cache.putMany(dc.BLOCKSUMMARY, {f'block{i}': os.urandom(100000) for i in range(5, 20)})
+    found = cache.getMany(dc.BLOCKSUMMARY, [f'block{i}' for i in range(20)])
+    assert 0 < len(found) <= 10
+    assert 'block19' in found and 'block0' not in found
@@ -0,0 +1,75 @@
+"""
+Test JobStateStore
+"""
+
+import os
+import json
+import multiprocessing
+
+import pytest
+
+from TaskWorker.JobStateStore import JobStateStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStateStore(str(tmp_path / 'job_state.db'))
+
+
+def test_retryInfo(store):
+    assert store.getRetryInfo('1') is None
+    store.saveRetryInfo('1', {'pre': 1, 'post': 0})
+    store.saveRetryInfo('1', {'pre': 2, 'post': 1})
+    assert store.getRetryInfo('1') == {'pre': 2, 'post': 1}
+    assert store.getRetryInfo('0-1') is None
+
+
+def test_deferNum(store):
+    assert [store.nextDeferNum('3', 0) for _ in range(3)] == [0, 1, 2]
+    assert store.nextDeferNum('3', 1) == 0
+    store.resetDeferNum('3', 0)
+    assert store.nextDeferNum('3', 0) == 0
+
+
+def test_docsAndThroughputs(store):
+    docs = [{'doc_id': 'abc', 'start_time': 1}]
+    store.saveDocsInTransfer('2', 0, docs)
+    assert store.getDocsInTransfer('2', 0) == docs
+    assert store.getDocsInTransfer('2', 1) is None
+    store.saveThroughput('0-1', 12.5, 1000)
+    store.saveThroughput('0-2', 10.0, 0)
+    assert store.getThroughputs(['0-1', '0-2', '0-3']) == {'0-1': (12.5, 1000), '0-2': (10.0, 0)}
+
+
+def test_migration(tmp_path):
+    for dirName in ('retry_info', 'defer_info', 'transfer_info', 'automatic_splitting/throughputs'):
+        os.makedirs(tmp_path / dirName)
+    (tmp_path / 'retry_info' / 'job.0-1.txt').write_text(json.dumps({'pre': 2, 'post': 1}))
+    (tmp_path / 'retry_info' / 'job.2.txt').write_text('not json')
+    (tmp_path / 'defer_info' / 'defer_num.0-1.0.txt').write_text('5' + ' ' * 10)
+    (tmp_path / 'defer_info' / 'defer_num.7.1.txt').write_text('')
+    (tmp_path / 'transfer_info' / 'docs_in_transfer.0-1.1.json').write_text(json.dumps([{'doc_id': 'x'}]))
+    (tmp_path / 'automatic_splitting' / 'throughputs' / '0-1').write_text(json.dumps([3.5, 120]))
+    store = JobStateStore(str(tmp_path / 'job_state.db'))
+    assert store.getRetryInfo('0-1') == {'pre': 2, 'post': 1}
+    assert store.getRetryInfo('2') is None
+    assert store.nextDeferNum('0-1', 0) == 5
+    assert store.nextDeferNum('7', 1) == 0
+    assert store.getDocsInTransfer('0-1', 1) == [{'doc_id': 'x'}]
+    assert store.getThroughputs(['0-1']) == {'0-1': (3.5, 120)}
+    # done once: later changes to the old files are ignored
+    (tmp_path / 'retry_info' / 'job.0-1.txt').write_text(json.dumps({'pre': 9, 'post': 9}))
+    assert JobStateStore(str(tmp_path / 'job_state.db')).getRetryInfo('0-1') == {'pre': 2, 'post': 1}
+
+
+def deferMany(fileName):
+    """ what many post-jobs deferring at the same time do """
+    store = JobStateStore(fileName)
+    return [store.nextDeferNum('1', 0) for _ in range(20)]
+
+
+def test_concurrentDeferNum(tmp_path):
+    fileName = str(tmp_path / 'job_state.db')
+    with multiprocessing.Pool(4) as pool:
+        results = pool.map(deferMany, [fileName] * 4)
+    assert sorted(num for result in results for num in result) == list(range(80))